@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+PQCert - Audit Log
+Append-only record of who asked for what: challenge created, domain
+validated, certificate issued, downloaded and revoked, one JSON object per
+line in DATA_DIR/audit/.
+
+Records are not written by the request that makes them. A background
+writer collects them and commits each batch with a single write + fsync
+(group commit) once PQCERT_AUDIT_FLUSH_MS has passed since the first
+record of the batch, or as soon as PQCERT_AUDIT_BATCH records are waiting.
+record() returns a future that completes when its batch is on disk;
+callers that must not lose the record await it, the others don't. Records
+of actions already done (issued, revoked) go through record_committed(),
+which waits the same way but only logs a failed write.
+
+Segments are started by size (PQCERT_AUDIT_SEGMENT_MB) and age
+(PQCERT_AUDIT_SEGMENT_HOURS) and never modified after rotation. Each
+process writes its own segments (the name carries host and pid).
+
+Reading:
+    python3 audit.py tail [-n 20] [-f]
+    python3 audit.py query [--event issued] [--domain example.com] [--cert-id ID]
+                           [--account ID] [--since 2026-01-01] [--until ...]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger("pqcert.audit")
+
+EVENTS = ("challenge_created", "validated", "issued", "downloaded", "revoked")
+
+
+class AuditLog:
+
+    def __init__(self, directory: Path, flush_ms: float = 50, batch_size: int = 256,
+                 segment_bytes: int = 64 * 1024 * 1024, segment_seconds: float = 24 * 3600):
+        self.directory = directory
+        self.flush_interval = flush_ms / 1000
+        self.batch_size = batch_size
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.pending = []
+        # Created by run(), in the loop that serves the requests
+        self.has_records = None
+        self.batch_full = None
+        self.segment = None
+        self.segment_started = 0.0
+        self.stats = {"records": 0, "commits": 0, "segments": 0}
+        directory.mkdir(parents=True, exist_ok=True)
+
+    def record(self, event: str, **fields) -> asyncio.Future:
+        """Queue a record; the future completes once it is on disk"""
+        entry = {"ts": datetime.utcnow().isoformat(), "event": event}
+        entry.update((k, v) for k, v in fields.items() if v is not None)
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((json.dumps(entry, separators=(",", ":")).encode() + b"\n", future))
+        if self.has_records is not None:
+            self.has_records.set()
+            if len(self.pending) >= self.batch_size:
+                self.batch_full.set()
+        return future
+
+    async def record_committed(self, event: str, **fields) -> bool:
+        """Record an action that has already taken effect and wait for the write.
+        A failed write is logged, not raised: failing the request now would
+        hide an action the client can't redo."""
+        try:
+            await self.record(event, **fields)
+            return True
+        except Exception:
+            logger.error("audit record lost: %s %s", event, fields)
+            return False
+
+    async def run(self):
+        self.has_records = asyncio.Event()
+        self.batch_full = asyncio.Event()
+        if self.pending:
+            self.has_records.set()
+        while True:
+            await self.has_records.wait()
+            try:
+                await asyncio.wait_for(self.batch_full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.has_records.clear()
+            self.batch_full.clear()
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            await asyncio.to_thread(self._write, b"".join(line for line, _ in batch))
+        except Exception as e:
+            logger.exception("audit log write failed")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()  # fire-and-forget callers never look
+            return
+        self.stats["records"] += len(batch)
+        self.stats["commits"] += 1
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    def _write(self, data: bytes):
+        if (self.segment is None or self.segment.tell() >= self.segment_bytes
+                or time.monotonic() - self.segment_started >= self.segment_seconds):
+            self._rotate()
+        self.segment.write(data)
+        self.segment.flush()
+        os.fsync(self.segment.fileno())
+
+    def _rotate(self):
+        if self.segment is not None:
+            self.segment.close()
+        name = f"audit-{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{socket.gethostname()}-{os.getpid()}.ndjson"
+        self.segment = open(self.directory / name, "ab")
+        self.segment_started = time.monotonic()
+        self.stats["segments"] += 1
+
+    async def close(self):
+        await self.flush()
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+
+def create_audit_log(data_dir: Path) -> AuditLog:
+    return AuditLog(
+        data_dir / "audit",
+        flush_ms=float(os.environ.get("PQCERT_AUDIT_FLUSH_MS", "50")),
+        batch_size=int(os.environ.get("PQCERT_AUDIT_BATCH", "256")),
+        segment_bytes=int(os.environ.get("PQCERT_AUDIT_SEGMENT_MB", "64")) * 1024 * 1024,
+        segment_seconds=float(os.environ.get("PQCERT_AUDIT_SEGMENT_HOURS", "24")) * 3600,
+    )
+
+
+# ============== Reading ==============
+
+def segments(directory: Path) -> list[Path]:
+    """Segments, oldest first (by name: they start with their creation time)"""
+    return sorted(directory.glob("audit-*.ndjson"))
+
+
+def segment_start(path: Path) -> str:
+    stamp = path.name.split("-")[1]
+    return datetime.strptime(stamp, "%Y%m%dT%H%M%S%f").isoformat()
+
+
+def tail_lines(path: Path, count: int, block: int = 65536) -> list[bytes]:
+    """Last count lines of a file, reading backwards from the end"""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        while position > 0 and data.count(b"\n") <= count:
+            step = min(block, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    return [line for line in data.split(b"\n") if line][-count:]
+
+
+def tail(directory: Path, count: int, follow: bool):
+    lines = []
+    for path in reversed(segments(directory)):
+        lines = tail_lines(path, count - len(lines)) + lines
+        if len(lines) >= count:
+            break
+    for line in lines:
+        print(line.decode())
+    if not follow:
+        return
+
+    offsets = {path: path.stat().st_size for path in segments(directory)}
+    while True:
+        time.sleep(0.5)
+        for path in segments(directory):
+            size = path.stat().st_size
+            if size > offsets.get(path, 0):
+                with open(path, "rb") as f:
+                    f.seek(offsets.get(path, 0))
+                    chunk = f.read(size - offsets.get(path, 0))
+                # Only complete lines; the rest is printed next time
+                complete = chunk[:chunk.rfind(b"\n") + 1]
+                sys.stdout.write(complete.decode())
+                sys.stdout.flush()
+                offsets[path] = offsets.get(path, 0) + len(complete)
+
+
+def query(directory: Path, event=None, domain=None, cert_id=None, account=None,
+          since=None, until=None):
+    """Matching records, oldest first"""
+    # Cheap substring test before parsing each line
+    needles = [n.encode() for n in (event, domain, cert_id, account) if n]
+    for path in segments(directory):
+        if until and segment_start(path) > until:
+            continue
+        if since and datetime.utcfromtimestamp(path.stat().st_mtime).isoformat() < since:
+            continue  # last written before the window
+        with open(path, "rb") as f:
+            for line in f:
+                if not all(n in line for n in needles):
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line of a crashed writer
+                if event and record["event"] != event:
+                    continue
+                if domain and domain != record.get("domain") and domain not in record.get("domains", []):
+                    continue
+                if cert_id and record.get("cert_id") != cert_id:
+                    continue
+                if account and record.get("account") != account:
+                    continue
+                if since and record["ts"] < since:
+                    continue
+                if until and record["ts"] > until:
+                    continue
+                yield record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read the PQCert audit log")
+    parser.add_argument("--dir", default=os.path.join(os.environ.get("PQCERT_DATA_DIR", "/var/lib/pqcert"), "audit"))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    tail_parser = subparsers.add_parser("tail", help="Print the newest records")
+    tail_parser.add_argument("-n", "--lines", type=int, default=20)
+    tail_parser.add_argument("-f", "--follow", action="store_true", help="Keep printing new records")
+
+    query_parser = subparsers.add_parser("query", help="Print records matching all filters")
+    query_parser.add_argument("--event", choices=EVENTS)
+    query_parser.add_argument("--domain")
+    query_parser.add_argument("--cert-id")
+    query_parser.add_argument("--account")
+    query_parser.add_argument("--since", help="ISO time (UTC), e.g. 2026-01-31 or 2026-01-31T12:00")
+    query_parser.add_argument("--until", help="ISO time (UTC)")
+    query_parser.add_argument("--count", action="store_true", help="Only print the number of matches")
+
+    args = parser.parse_args()
+    directory = Path(args.dir)
+    try:
+        if args.command == "tail":
+            tail(directory, args.lines, args.follow)
+        else:
+            matches = query(directory, args.event, args.domain, args.cert_id, args.account,
+                            args.since, args.until)
+            if args.count:
+                print(sum(1 for _ in matches))
+            else:
+                for record in matches:
+                    print(json.dumps(record))
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+PQCert - Authorization Reuse
+Remembers successful domain validations per (account, domain) for a
+configurable lifetime, so renewals and re-issues skip the HTTP-01 fetch.
+
+Accounts are identified by a client-held secret (account_key), stored only
+as its SHA-256. The contact email is not used: it is unauthenticated, and
+anyone could claim it to borrow someone else's validation.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+
+class AuthorizationStore:
+
+    def __init__(self, cache, lifetime: timedelta = timedelta(days=30)):
+        self.cache = cache
+        self.lifetime = lifetime
+        self.stats = {"reused": 0, "validated": 0}
+
+    @staticmethod
+    def account_id(account_key: str) -> str:
+        return hashlib.sha256(account_key.encode()).hexdigest()
+
+    @staticmethod
+    def _key(account_id: str, domain: str) -> str:
+        return f"{account_id}:{domain.lower()}"
+
+    async def get(self, account_id: str | None, domain: str) -> dict | None:
+        """A still-valid authorization for account/domain, or None"""
+        if not account_id or self.lifetime.total_seconds() <= 0:
+            return None
+        raw = await self.cache.get(self._key(account_id, domain))
+        if raw is None:
+            return None
+        authz = json.loads(raw)
+        if datetime.fromisoformat(authz["expires_at"]) <= datetime.utcnow():
+            return None
+        return authz
+
+    async def use(self, account_id: str | None, domain: str) -> bool:
+        """True (and counted) if issuance can skip validation for account/domain"""
+        if await self.get(account_id, domain) is None:
+            return False
+        self.stats["reused"] += 1
+        return True
+
+    async def record(self, account_id: str | None, domain: str, method: str = "http-01"):
+        """Remember a successful validation"""
+        self.stats["validated"] += 1
+        if not account_id or self.lifetime.total_seconds() <= 0:
+            return
+        now = datetime.utcnow()
+        authz = {
+            "domain": domain.lower(),
+            "method": method,
+            "validated_at": now.isoformat(),
+            "expires_at": (now + self.lifetime).isoformat(),
+        }
+        await self.cache.set(self._key(account_id, domain), json.dumps(authz).encode(),
+                             int(self.lifetime.total_seconds()))
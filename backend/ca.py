@@ -0,0 +1,79 @@
+"""
+PQCert - Issuing CA
+Loads the CA that signs issued certificates, OCSP responses and CRLs,
+creating it on first start.
+"""
+
+import os
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+CA_NAME = "PQCert Issuing CA"
+CA_VALIDITY_DAYS = 3650
+
+
+def _write_atomic(path: Path, data: bytes, mode: int = 0o644):
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        os.chmod(tmp_path, mode)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class IssuingCA:
+    """The CA key and certificate, as files (for openssl) and loaded objects"""
+
+    def __init__(self, ca_dir: Path):
+        self.cert_file = ca_dir / "ca.pem"
+        self.key_file = ca_dir / "ca-key.pem"
+
+        if not (self.cert_file.exists() and self.key_file.exists()):
+            ca_dir.mkdir(parents=True, exist_ok=True)
+            self._create()
+
+        self.cert_pem = self.cert_file.read_bytes()
+        self.cert = x509.load_pem_x509_certificate(self.cert_pem)
+        self.key = serialization.load_pem_private_key(self.key_file.read_bytes(), password=None)
+
+    def _create(self):
+        key = ec.generate_private_key(ec.SECP384R1())
+        name = x509.Name([
+            x509.NameAttribute(NameOID.COMMON_NAME, CA_NAME),
+            x509.NameAttribute(NameOID.ORGANIZATION_NAME, "PQCert"),
+        ])
+        now = datetime.utcnow()
+        cert = (
+            x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - timedelta(minutes=5))
+            .not_valid_after(now + timedelta(days=CA_VALIDITY_DAYS))
+            .add_extension(x509.BasicConstraints(ca=True, path_length=0), critical=True)
+            .add_extension(x509.KeyUsage(
+                digital_signature=True, content_commitment=False, key_encipherment=False,
+                data_encipherment=False, key_agreement=False, key_cert_sign=True,
+                crl_sign=True, encipher_only=False, decipher_only=False,
+            ), critical=True)
+            .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False)
+            .sign(key, hashes.SHA384())
+        )
+
+        _write_atomic(self.key_file, key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ), 0o600)
+        _write_atomic(self.cert_file, cert.public_bytes(serialization.Encoding.PEM))
@@ -0,0 +1,90 @@
+"""
+PQCert - Byte caches
+In-memory or Redis-backed key/value store for pre-computed responses.
+Set PQCERT_REDIS_URL to share the cache between replicas.
+"""
+
+import os
+import time
+from collections import OrderedDict
+
+
+class MemoryCache:
+    """Process-local cache with per-entry TTL and an LRU size bound"""
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    async def get(self, key: str) -> bytes | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def get_many(self, keys) -> dict:
+        result = {}
+        for key in keys:
+            value = await self.get(key)
+            if value is not None:
+                result[key] = value
+        return result
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        self.entries[key] = (value, time.monotonic() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def add(self, key: str, value: bytes, ttl: int) -> bool:
+        """Set key only if it is absent; True if it was set"""
+        if await self.get(key) is not None:
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def delete(self, key: str):
+        self.entries.pop(key, None)
+
+
+class RedisCache:
+    """Redis-backed cache; keys are namespaced with prefix"""
+
+    def __init__(self, url: str, prefix: str):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+
+    async def get(self, key: str) -> bytes | None:
+        return await self.client.get(self.prefix + key)
+
+    async def get_many(self, keys) -> dict:
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = await self.client.mget([self.prefix + key for key in keys])
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        await self.client.set(self.prefix + key, value, ex=max(int(ttl), 1))
+
+    async def add(self, key: str, value: bytes, ttl: int) -> bool:
+        """Set key only if it is absent; True if it was set"""
+        return bool(await self.client.set(self.prefix + key, value, ex=max(int(ttl), 1), nx=True))
+
+    async def delete(self, key: str):
+        await self.client.delete(self.prefix + key)
+
+
+def create_cache(prefix: str):
+    """Redis cache if PQCERT_REDIS_URL is set, otherwise in-memory"""
+    url = os.environ.get("PQCERT_REDIS_URL")
+    if url:
+        return RedisCache(url, prefix)
+    return MemoryCache()
@@ -0,0 +1,228 @@
+"""
+PQCert - Traffic Capture
+Opt-in (PQCERT_CAPTURE=1) recording of the shape and timing of API calls
+to NDJSON files, one per worker process (traffic.<pid>.ndjson), for
+re-driving against another build with replay-traffic.py, which merges them.
+
+Nothing that identifies a customer or grants access is written: domains,
+ids, account keys, idempotency keys and client addresses become short
+keyed hashes (stable within one capture, so a verify can be matched to
+its request and a download to its certificate), request bodies are
+reduced to the names of the fields present plus a few enumerated values,
+and query strings, CSRs, tokens and headers are dropped.
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import time
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger("pqcert.capture")
+
+UUID_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+# Body fields whose value is kept as is (small, enumerated, not identifying)
+PLAIN_FIELDS = ("algorithm", "reason", "max_key_age_days", "challenge_type")
+# Body fields replaced by a reference, so the replay can follow them
+REF_FIELDS = ("domain", "reuse_key_from")
+# Fields of JSON responses that are referenced by later calls
+RESPONSE_REFS = ("challenge_id", "certificate_id")
+
+MAX_BODY = 65536
+
+
+class TrafficCapture:
+
+    def __init__(self, path: Path, sample_rate: float = 1.0, max_bytes: int = 256 * 1024 * 1024,
+                 key: bytes | None = None):
+        self.base_path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        # Random unless set for all workers of one capture, so their files
+        # share references; they can't be reversed or joined across captures
+        self.key = key or secrets.token_bytes(32)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.pid = None
+        self.file = None
+        self._open()
+
+    def _open(self):
+        """Each process writes (and rotates) its own file, traffic.<pid>.ndjson:
+        workers never append to or rename each other's files"""
+        if self.file is not None:
+            self.file.close()
+        self.pid = os.getpid()
+        self.path = self.base_path.with_name(f"{self.base_path.stem}.{self.pid}{self.base_path.suffix}")
+        # Line buffered: every record is one append, complete on disk
+        self.file = open(self.path, "a", buffering=1)
+
+    def ref(self, value: str) -> str:
+        return hmac.new(self.key, value.lower().encode(), hashlib.sha256).hexdigest()[:16]
+
+    def route(self, path: str) -> tuple[str, str | None]:
+        """(path with ids replaced by {id}, reference of the id)"""
+        if path.startswith("/v1/ocsp/") and path != "/v1/ocsp/prefetch":
+            return "/v1/ocsp/{request}", None
+        parts, path_ref = [], None
+        for part in path.split("/"):
+            if UUID_RE.match(part):
+                parts.append("{id}")
+                path_ref = self.ref(part)
+            else:
+                parts.append(part)
+        return "/".join(parts), path_ref
+
+    def body_shape(self, body: bytes) -> dict | None:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+        shape = {"fields": sorted(k for k, v in data.items() if v not in (None, "", []))}
+        for field in PLAIN_FIELDS:
+            if isinstance(data.get(field), (str, int)):
+                shape[field] = data[field]
+        for field in REF_FIELDS:
+            if isinstance(data.get(field), str):
+                shape[field] = self.ref(data[field])
+        if isinstance(data.get("domain"), str) and data["domain"].startswith("*."):
+            shape["wildcard"] = True
+        if isinstance(data.get("challenge_ids"), list):
+            shape["challenge_ids"] = [self.ref(str(i)) for i in data["challenge_ids"]]
+        if isinstance(data.get("certificate_ids"), list):
+            shape["certificate_count"] = len(data["certificate_ids"])
+        return shape
+
+    def response_refs(self, body: bytes) -> dict:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        return {k: self.ref(data[k]) for k in RESPONSE_REFS if isinstance(data.get(k), str)}
+
+    def record(self, entry: dict):
+        try:
+            if self.pid != os.getpid():
+                self._open()  # forked after the capture was created (preloaded app)
+            if self.file.tell() >= self.max_bytes:
+                self._rotate()
+            self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        except OSError:
+            logger.exception("traffic capture write failed")
+
+    def _rotate(self):
+        self.file.close()
+        os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+        self.file = open(self.path, "a", buffering=1)
+
+
+class CaptureMiddleware:
+    """Pure ASGI middleware; sees request and response bodies without buffering the app"""
+
+    def __init__(self, app, capture: TrafficCapture, skip_prefixes=("/admin",)):
+        self.app = app
+        self.capture = capture
+        self.skip_prefixes = skip_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["path"].startswith(self.skip_prefixes)
+                or random.random() >= self.capture.sample_rate):
+            await self.app(scope, receive, send)
+            return
+
+        request_body = bytearray()
+        request_bytes = 0
+        response_body = bytearray()
+        response_bytes = 0
+        status = 500
+        content_type = ""
+
+        async def receive_wrapper():
+            nonlocal request_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                request_bytes += len(chunk)
+                if len(request_body) < MAX_BODY:
+                    request_body.extend(chunk)
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status, content_type, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                for name, value in message.get("headers", []):
+                    if name.lower() == b"content-type":
+                        content_type = value.decode("latin-1")
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                response_bytes += len(chunk)
+                if content_type.startswith("application/json") and len(response_body) < MAX_BODY:
+                    response_body.extend(chunk)
+            elif message["type"] == "http.response.zerocopy":
+                response_bytes += message.get("count") or 0
+            await send(message)
+
+        started_at = datetime.utcnow()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            self._record(scope, started_at, duration_ms, status, request_body, request_bytes,
+                         response_body, response_bytes)
+
+    def _record(self, scope, started_at, duration_ms, status, request_body, request_bytes,
+                response_body, response_bytes):
+        capture = self.capture
+        headers = {name.decode("latin-1").lower(): value.decode("latin-1")
+                   for name, value in scope.get("headers", [])}
+        route, path_ref = capture.route(scope["path"])
+        client = (scope.get("client") or ("", 0))[0]
+        entry = {
+            "at": started_at.isoformat(),
+            "method": scope["method"],
+            "route": route,
+            "status": status,
+            "ms": round(duration_ms, 2),
+            "request_bytes": request_bytes,
+            "response_bytes": response_bytes,
+            "client": capture.ref(headers.get("x-real-ip") or client),
+        }
+        if path_ref:
+            entry["path_ref"] = path_ref
+        if "idempotency-key" in headers:
+            entry["idempotency_key"] = capture.ref(headers["idempotency-key"])
+        if "accept-encoding" in headers:
+            entry["accept_encoding"] = headers["accept-encoding"][:100]
+        if request_body:
+            shape = capture.body_shape(bytes(request_body))
+            if shape is not None:
+                entry["body"] = shape
+        if response_body:
+            refs = capture.response_refs(bytes(response_body))
+            if refs:
+                entry["refs"] = refs
+        capture.record(entry)
+
+
+def create_capture(data_dir: Path) -> TrafficCapture | None:
+    """A traffic capture if PQCERT_CAPTURE is set, else None"""
+    if os.environ.get("PQCERT_CAPTURE", "").lower() in ("", "0", "false", "no", "off"):
+        return None
+    return TrafficCapture(
+        Path(os.environ.get("PQCERT_CAPTURE_FILE", str(data_dir / "capture" / "traffic.ndjson"))),
+        sample_rate=float(os.environ.get("PQCERT_CAPTURE_SAMPLE_RATE", "1")),
+        max_bytes=int(os.environ.get("PQCERT_CAPTURE_MAX_MB", "256")) * 1024 * 1024,
+        key=os.environ.get("PQCERT_CAPTURE_KEY", "").encode() or None,
+    )
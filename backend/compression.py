@@ -0,0 +1,65 @@
+"""
+PQCert - Artifact Compression
+Certificate artifacts are compressed once, when they are stored, and the
+stored variant a client accepts is sent as is. Post-quantum chains are
+large enough for this to matter; compressing per request would not be
+worth the CPU.
+
+zstd needs the zstandard package; without it only gzip variants are made.
+"""
+
+import gzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Content-Encoding -> suffix of the stored variant, in order of preference
+SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+if zstandard is None:
+    del SUFFIXES["zstd"]
+
+# Artifacts served by the download endpoint
+COMPRESSED_ARTIFACTS = ("cert.pem", "key.pem", "chain.pem", "fullchain.pem")
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=19).compress(data)
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def compressed_variants(artifacts: dict) -> dict:
+    """{"<name><suffix>": data} for each compressible artifact, where it helps"""
+    variants = {}
+    for name in COMPRESSED_ARTIFACTS:
+        if name not in artifacts:
+            continue
+        for encoding, suffix in SUFFIXES.items():
+            data = compress(artifacts[name], encoding)
+            if len(data) < len(artifacts[name]):
+                variants[name + suffix] = data
+    return variants
+
+
+def negotiate(accept_encoding: str | None) -> list[str]:
+    """Encodings the client accepts (q > 0), best first; identity is always the fallback"""
+    if not accept_encoding:
+        return []
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding.strip().lower()] = q
+    accepted = [(weights.get(e, weights.get("*", 0.0)), e) for e in SUFFIXES]
+    # Stable sort: equal weights keep the server's preference
+    return [e for q, e in sorted(accepted, key=lambda item: -item[0]) if q > 0]
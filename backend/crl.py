@@ -0,0 +1,221 @@
+"""
+PQCert - CRL Publisher
+Keeps a base CRL plus a delta CRL (RFC 5280 section 5.2.4), both built
+incrementally from an append-only revocation log. A revocation only
+re-signs the small delta; the base is rebuilt when the delta grows past a
+threshold or the base gets old, so relying parties mostly fetch deltas.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+
+logger = logging.getLogger("pqcert.crl")
+
+REASON_FLAGS = {flag.value: flag for flag in x509.ReasonFlags}
+# Reasons a revocation request may give: final ones only. removeFromCRL
+# belongs in delta CRLs only (RFC 5280 5.3.1), a certificateHold could
+# never be released, and the CA-compromise reasons don't apply to leaves.
+REVOCATION_REASONS = {
+    name: REASON_FLAGS[name]
+    for name in ("unspecified", "keyCompromise", "affiliationChanged", "superseded",
+                 "cessationOfOperation", "privilegeWithdrawn")
+}
+
+
+class CRLPublisher:
+
+    def __init__(self, ca, crl_dir: Path, base_url: str,
+                 rebase_entries: int = 1000,
+                 base_lifetime: timedelta = timedelta(hours=24),
+                 delta_lifetime: timedelta = timedelta(hours=1)):
+        self.ca = ca
+        self.crl_dir = crl_dir
+        self.base_url = base_url
+        self.rebase_entries = rebase_entries
+        self.base_lifetime = base_lifetime
+        self.delta_lifetime = delta_lifetime
+
+        self.log_file = crl_dir / "revocations.log"
+        self.state_file = crl_dir / "state.json"
+        self.lock = threading.Lock()
+
+        crl_dir.mkdir(parents=True, exist_ok=True)
+        self.entries = self._read_log()
+        self.revoked = {entry["serial"]: entry for entry in self.entries}
+        self.state = self._read_state()
+
+        # Signed CRLs held in memory: {"der", "number", "etag", "next_update"}
+        self.base = self._load_signed("base")
+        self.delta = self._load_signed("delta")
+        if self.base is None or self.delta is None:
+            self.rebase()
+
+    # ---- persistence ----
+
+    def _read_log(self) -> list:
+        if not self.log_file.exists():
+            return []
+        entries = []
+        for line in self.log_file.read_text().splitlines():
+            if line.strip():
+                entries.append(json.loads(line))
+        return entries
+
+    def _append_log(self, entry: dict):
+        with open(self.log_file, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read_state(self) -> dict:
+        if self.state_file.exists():
+            return json.loads(self.state_file.read_text())
+        return {"last_number": 0, "base_number": 0, "base_seq": 0}
+
+    def _write(self, path: Path, data: bytes):
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def _save(self, kind: str, signed: dict):
+        self._write(self.crl_dir / f"{kind}.crl", signed["der"])
+        self._write(self.state_file, json.dumps(self.state).encode())
+
+    def _load_signed(self, kind: str) -> dict | None:
+        path = self.crl_dir / f"{kind}.crl"
+        if not path.exists():
+            return None
+        crl = x509.load_der_x509_crl(path.read_bytes())
+        next_update = crl.next_update_utc.replace(tzinfo=None)
+        if next_update <= datetime.utcnow():
+            return None
+        number = crl.extensions.get_extension_for_class(x509.CRLNumber).value.crl_number
+        return self._signed(path.read_bytes(), number, next_update)
+
+    @staticmethod
+    def _signed(der: bytes, number: int, next_update: datetime) -> dict:
+        return {"der": der, "number": number, "etag": f'"crl-{number}"', "next_update": next_update}
+
+    # ---- signing ----
+
+    def _next_number(self) -> int:
+        self.state["last_number"] += 1
+        return self.state["last_number"]
+
+    def _sign(self, entries, number: int, lifetime: timedelta, delta_of: int | None = None) -> dict:
+        now = datetime.utcnow()
+        next_update = now + lifetime
+        builder = (
+            x509.CertificateRevocationListBuilder()
+            .issuer_name(self.ca.cert.subject)
+            .last_update(now)
+            .next_update(next_update)
+            .add_extension(x509.CRLNumber(number), critical=False)
+            .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(
+                self.ca.cert.public_key()), critical=False)
+        )
+        if delta_of is None:
+            builder = builder.add_extension(x509.FreshestCRL([x509.DistributionPoint(
+                full_name=[x509.UniformResourceIdentifier(f"{self.base_url}/delta.crl")],
+                relative_name=None, reasons=None, crl_issuer=None,
+            )]), critical=False)
+        else:
+            builder = builder.add_extension(x509.DeltaCRLIndicator(delta_of), critical=True)
+
+        for entry in entries:
+            revoked = (
+                x509.RevokedCertificateBuilder()
+                .serial_number(int(entry["serial"], 16))
+                .revocation_date(datetime.fromisoformat(entry["revoked_at"]))
+            )
+            reason = entry.get("reason") or "unspecified"
+            # RFC 5280: omit the reason code rather than use unspecified
+            if reason != "unspecified":
+                revoked = revoked.add_extension(x509.CRLReason(REASON_FLAGS[reason]),
+                                                critical=False)
+            builder = builder.add_revoked_certificate(revoked.build())
+
+        crl = builder.sign(self.ca.key, hashes.SHA256())
+        return self._signed(crl.public_bytes(serialization.Encoding.DER), number, next_update)
+
+    def rebase(self):
+        """Rebuild the base CRL from every unexpired revocation and reset the delta"""
+        with self.lock:
+            now = datetime.utcnow().isoformat()
+            live = [e for e in self.entries if (e.get("expires_at") or now) >= now]
+            base_number = self._next_number()
+            self.state["base_number"] = base_number
+            self.state["base_seq"] = self.entries[-1]["seq"] if self.entries else 0
+            self.base = self._sign(live, base_number, self.base_lifetime)
+            self._save("base", self.base)
+            self._rebuild_delta()
+            logger.info("published base CRL #%d (%d entries)", base_number, len(live))
+
+    def _rebuild_delta(self):
+        """Sign a delta holding the revocations since the current base (lock held)"""
+        new = [e for e in self.entries if e["seq"] > self.state["base_seq"]]
+        self.delta = self._sign(new, self._next_number(), self.delta_lifetime,
+                                delta_of=self.state["base_number"])
+        self._save("delta", self.delta)
+
+    # ---- revocation ----
+
+    def revoke(self, serial: str, reason: str = "unspecified", expires_at: str | None = None) -> dict:
+        """Record a revocation and publish a new delta; idempotent per serial"""
+        if reason not in REVOCATION_REASONS:
+            raise ValueError(f"Unknown revocation reason: {reason}")
+
+        with self.lock:
+            existing = self.revoked.get(serial)
+            if existing is not None:
+                return existing
+
+            entry = {
+                "seq": (self.entries[-1]["seq"] + 1) if self.entries else 1,
+                "serial": serial,
+                "revoked_at": datetime.utcnow().replace(microsecond=0).isoformat(),
+                "reason": reason,
+                "expires_at": expires_at,
+            }
+            self._append_log(entry)
+            self.entries.append(entry)
+            self.revoked[serial] = entry
+
+            pending = entry["seq"] - self.state["base_seq"]
+            if pending < self.rebase_entries:
+                self._rebuild_delta()
+                return entry
+
+        self.rebase()
+        return entry
+
+    # ---- background refresh ----
+
+    async def run(self, interval: int = 60):
+        """Re-publish CRLs before they expire; rebase on schedule"""
+        while True:
+            try:
+                now = datetime.utcnow()
+                base_due = self.base["next_update"] - self.base_lifetime / 2
+                delta_due = self.delta["next_update"] - self.delta_lifetime / 2
+                if now >= base_due:
+                    await asyncio.to_thread(self.rebase)
+                elif now >= delta_due:
+                    await asyncio.to_thread(self._refresh_delta)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("CRL publishing failed")
+            await asyncio.sleep(interval)
+
+    def _refresh_delta(self):
+        with self.lock:
+            self._rebuild_delta()
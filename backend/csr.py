@@ -0,0 +1,101 @@
+"""
+PQCert - CSR Signing
+Signs client-generated certificate signing requests, so the private key
+never leaves the client. The server only checks the request and makes
+one CA signature.
+
+Only the public key and the requested DNS names are taken from a CSR;
+subject fields and extensions in it are ignored.
+"""
+
+from datetime import datetime, timedelta
+
+from cryptography import x509
+from cryptography.exceptions import UnsupportedAlgorithm
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+
+MAX_CSR_NAMES = 100
+
+
+def key_algorithm(public_key) -> str:
+    """Short name for a CSR's public key; ValueError if we don't issue for it"""
+    if isinstance(public_key, rsa.RSAPublicKey):
+        if public_key.key_size < 2048:
+            raise ValueError("RSA keys must be at least 2048 bits")
+        return f"rsa-{public_key.key_size}"
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        if public_key.curve.name not in ("secp256r1", "secp384r1"):
+            raise ValueError("EC keys must use P-256 or P-384")
+        return {"secp256r1": "ecdsa-p256", "secp384r1": "ecdsa-p384"}[public_key.curve.name]
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        return "ed25519"
+    raise ValueError("Unsupported key type (use RSA, ECDSA P-256/P-384 or Ed25519)")
+
+
+def load_csr(pem: str) -> tuple:
+    """(csr, domains, algorithm) for a PEM CSR; ValueError with a client-facing message"""
+    try:
+        csr = x509.load_pem_x509_csr(pem.encode())
+        public_key = csr.public_key()
+    except (ValueError, UnsupportedAlgorithm):
+        raise ValueError("Invalid CSR or unsupported key type")
+
+    algorithm = key_algorithm(public_key)
+    if not csr.is_signature_valid:
+        raise ValueError("CSR signature is invalid")
+
+    try:
+        san = csr.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+        names = san.get_values_for_type(x509.DNSName)
+    except x509.ExtensionNotFound:
+        names = [attr.value for attr in csr.subject.get_attributes_for_oid(NameOID.COMMON_NAME)]
+
+    domains = list(dict.fromkeys(name.lower().rstrip(".") for name in names))
+    if not domains:
+        raise ValueError("CSR names no domains")
+    if len(domains) > MAX_CSR_NAMES:
+        raise ValueError(f"At most {MAX_CSR_NAMES} names per certificate")
+    return csr, domains, algorithm
+
+
+def sign_csr(ca, csr, domains: list, serial: str, validity: timedelta,
+             ocsp_url: str, base_crl_url: str, delta_crl_url: str) -> bytes:
+    """Issue a leaf certificate for csr's public key; returns PEM"""
+    public_key = csr.public_key()
+    now = datetime.utcnow()
+
+    def uri(url):
+        return [x509.DistributionPoint(full_name=[x509.UniformResourceIdentifier(url)],
+                                       relative_name=None, reasons=None, crl_issuer=None)]
+
+    key_usage = x509.KeyUsage(
+        digital_signature=True, content_commitment=False,
+        key_encipherment=isinstance(public_key, rsa.RSAPublicKey),
+        data_encipherment=False, key_agreement=False, key_cert_sign=False,
+        crl_sign=False, encipher_only=False, decipher_only=False,
+    )
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, domains[0])]))
+        .issuer_name(ca.cert.subject)
+        .public_key(public_key)
+        .serial_number(int(serial, 16))
+        .not_valid_before(now - timedelta(minutes=5))
+        .not_valid_after(now + validity)
+        .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True)
+        .add_extension(key_usage, critical=True)
+        .add_extension(x509.ExtendedKeyUsage([ExtendedKeyUsageOID.SERVER_AUTH]), critical=False)
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(d) for d in domains]), critical=False)
+        .add_extension(x509.SubjectKeyIdentifier.from_public_key(public_key), critical=False)
+        .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(ca.cert.public_key()),
+                       critical=False)
+        .add_extension(x509.AuthorityInformationAccess([x509.AccessDescription(
+            x509.oid.AuthorityInformationAccessOID.OCSP, x509.UniformResourceIdentifier(ocsp_url),
+        )]), critical=False)
+        .add_extension(x509.CRLDistributionPoints(uri(base_crl_url)), critical=False)
+        .add_extension(x509.FreshestCRL(uri(delta_crl_url)), critical=False)
+        .sign(ca.key, hashes.SHA256())
+    )
+    return cert.public_bytes(serialization.Encoding.PEM)
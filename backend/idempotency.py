@@ -0,0 +1,104 @@
+"""
+PQCert - Idempotency
+Makes retried or concurrent duplicate requests share one result instead of
+repeating the work (and issuing twice).
+
+- Requests with the same operation key that arrive while the first is
+  still running wait for it (single-flight within the process; across
+  replicas a short-lived claim in the shared cache does the same job).
+- Successful results are kept for a while and replayed to later retries.
+  Failures are not kept, so a retry after fixing the problem runs again.
+"""
+
+import asyncio
+import hashlib
+import json
+
+from profiling import shield
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a request with a different payload"""
+
+
+class RequestInProgress(Exception):
+    """Another replica is still working on this key"""
+
+
+def fingerprint(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+
+    def __init__(self, cache, ttl: int = 24 * 3600, lock_ttl: int = 120,
+                 wait: float = 30.0, poll_interval: float = 0.25):
+        self.cache = cache
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self.flights = {}
+        self.stats = {"executed": 0, "coalesced": 0, "replayed": 0}
+
+    async def _replay(self, key: str, request_hash: str) -> dict | None:
+        raw = await self.cache.get(f"result:{key}")
+        if raw is None:
+            return None
+        stored = json.loads(raw)
+        if stored["fingerprint"] != request_hash:
+            raise IdempotencyConflict(key)
+        self.stats["replayed"] += 1
+        return stored["result"]
+
+    async def run(self, key: str, payload, fn, ttl: int | None = None) -> dict:
+        """
+        Result of fn() for this key: replayed if already stored, shared if
+        in flight, otherwise computed once and stored. fn returns a
+        JSON-serializable dict.
+        """
+        request_hash = fingerprint(payload)
+        result = await self._replay(key, request_hash)
+        if result is not None:
+            return result
+
+        flight = self.flights.get(key)
+        if flight is not None:
+            self.stats["coalesced"] += 1
+            stored_hash, task = flight
+            if stored_hash != request_hash:
+                raise IdempotencyConflict(key)
+            return await shield(task)
+
+        # The work runs in its own task, so it completes (and its result is
+        # stored for the retry) even if the client that started it goes away;
+        # shield() lets the request profiler see into it
+        task = asyncio.create_task(self._execute(key, request_hash, fn, ttl or self.ttl))
+        self.flights[key] = (request_hash, task)
+        task.add_done_callback(lambda _: self.flights.pop(key, None))
+        return await shield(task)
+
+    async def _execute(self, key: str, request_hash: str, fn, ttl: int) -> dict:
+        # Claim the key across replicas; if someone else holds it, wait for their result
+        if not await self.cache.add(f"lock:{key}", b"1", self.lock_ttl):
+            deadline = asyncio.get_running_loop().time() + self.wait
+            while asyncio.get_running_loop().time() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                result = await self._replay(key, request_hash)
+                if result is not None:
+                    return result
+                if await self.cache.add(f"lock:{key}", b"1", self.lock_ttl):
+                    break  # the other attempt failed or died; our turn
+            else:
+                raise RequestInProgress(key)
+
+        try:
+            self.stats["executed"] += 1
+            result = await fn()
+            await self.cache.set(f"result:{key}", json.dumps({
+                "fingerprint": request_hash,
+                "result": result,
+            }).encode(), ttl)
+            return result
+        finally:
+            await self.cache.delete(f"lock:{key}")
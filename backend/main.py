@@ -3,22 +3,63 @@ PQCert - Post-Quantum Certificate Authority
 Main API Server
 """
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, PlainTextResponse
-from pydantic import BaseModel, EmailStr
+from fastapi.responses import PlainTextResponse, RedirectResponse, Response
+from pydantic import BaseModel, EmailStr, Field
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from contextlib import asynccontextmanager
+import asyncio
+import base64
+import secrets
 import subprocess
-import tempfile
 import os
+import re
 import uuid
 import json
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from audit import create_audit_log
+from authz import AuthorizationStore
+from ca import IssuingCA
+from cache import create_cache
+from capture import CaptureMiddleware, create_capture
+from compression import SUFFIXES, compressed_variants, negotiate
+from crl import CRLPublisher, REVOCATION_REASONS
+from csr import load_csr, sign_csr
+from idempotency import IdempotencyConflict, IdempotencyStore, RequestInProgress
+from memdiag import create_memory_diagnostics, summary as memory_summary
+from ocsp import OCSPResponder
+from profiling import ProfilingMiddleware, create_profiler
+from storage import create_storage
+from transparency import ENTRY_FIELDS, MAX_ENTRIES, create_transparency_log, leaf_hash
+from validation import create_resolver, dns01_record, verify_dns01, verify_http01
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await load_certificate_index()
+    tasks = [
+        asyncio.create_task(ocsp_responder.run()),
+        asyncio.create_task(crl_publisher.run()),
+        asyncio.create_task(audit.run()),
+        asyncio.create_task(transparency.run(TRANSPARENCY_INTERVAL)),
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
+    await transparency.close()
+    await audit.close()
+    await storage.close()
+
+
 app = FastAPI(
     title="PQCert API",
     description="Post-Quantum Certificate Authority - Free SSL Certificates",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS
@@ -31,25 +72,150 @@ app.add_middleware(
 )
 
 # Storage paths
-CERTS_DIR = Path("/var/lib/pqcert/certs")
-CHALLENGES_DIR = Path("/var/lib/pqcert/challenges")
+DATA_DIR = Path(os.environ.get("PQCERT_DATA_DIR", "/var/lib/pqcert"))
+CA_DIR = DATA_DIR / "ca"
+CRL_DIR = DATA_DIR / "crl"
+
+# Opt-in profiling of slow requests (PQCERT_PROFILE=1)
+profiler = create_profiler(DATA_DIR)
+if profiler is not None:
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+# Opt-in tracemalloc allocation tracking (PQCERT_MEMDIAG=1)
+memdiag = create_memory_diagnostics()
+
+# Append-only audit trail of challenges, validations, issuance, downloads
+# and revocations (DATA_DIR/audit, group-committed by a background writer)
+audit = create_audit_log(DATA_DIR)
+
+# Opt-in capture of sanitized request shape and timing (PQCERT_CAPTURE=1),
+# for replay-traffic.py
+capture = create_capture(DATA_DIR)
+if capture is not None:
+    app.add_middleware(CaptureMiddleware, capture=capture)
+
+# Admin endpoints are disabled unless PQCERT_ADMIN_TOKEN is set
+ADMIN_TOKEN = os.environ.get("PQCERT_ADMIN_TOKEN")
+
+# How local artifact downloads are sent: "direct" (by the API, read in a
+# worker thread) or "x-accel" (the API only checks the request; nginx sends
+# DATA_DIR/public/<id>/<file> with sendfile from the internal location
+# PQCERT_ACCEL_PREFIX, see nginx/nginx.conf). Only x-accel is zero-copy.
+DOWNLOAD_MODE = os.environ.get("PQCERT_DOWNLOAD_MODE", "direct")
+ACCEL_PREFIX = os.environ.get("PQCERT_ACCEL_PREFIX", "/_pqcert_files/")
+
+# Certificate artifacts and pending challenges: files under DATA_DIR, or a
+# shared S3-compatible bucket when PQCERT_S3_BUCKET is set
+storage = create_storage(DATA_DIR, export_public=DOWNLOAD_MODE == "x-accel")
+
+# Public base URL embedded in issued certificates (OCSP, CRL locations)
+PUBLIC_URL = os.environ.get("PQCERT_PUBLIC_URL", "https://api.pqcert.org")
+OCSP_URL = f"{PUBLIC_URL}/v1/ocsp"
+BASE_CRL_URL = f"{PUBLIC_URL}/v1/crl/base.crl"
+DELTA_CRL_URL = f"{PUBLIC_URL}/v1/crl/delta.crl"
+
+CERT_VALIDITY = timedelta(days=90)
+
+# Upper bound for reusing a server-generated key across renewals
+MAX_KEY_AGE = timedelta(days=int(os.environ.get("PQCERT_MAX_KEY_AGE_DAYS", "365")))
+
+# Issuing CA and revocation status
+ca = IssuingCA(CA_DIR)
+
+# serial (lowercase hex) -> {"cert_id", "expires_at"}
+CERT_INDEX = {}
+
+ocsp_responder = OCSPResponder(
+    ca,
+    lookup=lambda serial: lookup_certificate(serial),
+    active_serials=lambda: active_serials(),
+    cache=create_cache("pqcert:ocsp:"),
+    interval=int(os.environ.get("PQCERT_OCSP_REFRESH_SECONDS", "300")),
+)
 
-# Ensure directories exist
-CERTS_DIR.mkdir(parents=True, exist_ok=True)
-CHALLENGES_DIR.mkdir(parents=True, exist_ok=True)
+# Cached DNS for domain validation (PQCERT_DNS_SERVERS: other resolvers,
+# e.g. a local stand-in DNS server in tests)
+resolver = create_resolver()
+
+CHALLENGE_TYPES = ("http-01", "dns-01")
+VALIDATION_FAILED = {
+    "http-01": "Domain verification failed. Make sure the challenge file is accessible.",
+    "dns-01": "Domain verification failed. Make sure the TXT record holds the challenge token "
+              "and has propagated.",
+}
+
+# Validated (account, domain) authorizations, reused until they expire
+authorizations = AuthorizationStore(
+    create_cache("pqcert:authz:"),
+    lifetime=timedelta(hours=float(os.environ.get("PQCERT_AUTHZ_LIFETIME_HOURS", "720"))),
+)
+
+# Replays results of retried requests and coalesces concurrent duplicates
+idempotency = IdempotencyStore(
+    create_cache("pqcert:idem:"),
+    ttl=int(os.environ.get("PQCERT_IDEMPOTENCY_TTL_SECONDS", "86400")),
+)
+
+# Pending challenge per (account, domain, algorithm), handed out again on repeated requests
+pending_challenges = create_cache("pqcert:pending:")
+
+# Issuance dedup: an account that asks again for the same names and algorithm
+# within the window gets its recent certificate back, unless that one has
+# less than the minimum validity left (renewals) or the request sets force_new.
+# A window of 0 turns this off.
+DEDUP_WINDOW = timedelta(hours=float(os.environ.get("PQCERT_DEDUP_WINDOW_HOURS", "24")))
+DEDUP_MIN_REMAINING = timedelta(days=float(os.environ.get("PQCERT_DEDUP_MIN_REMAINING_DAYS", "30")))
+recent_issuance = create_cache("pqcert:issued:")
+issuance_stats = {"issued": 0, "deduplicated": 0, "forced": 0, "stale": 0}
+
+crl_publisher = CRLPublisher(
+    ca,
+    CRL_DIR,
+    base_url=f"{PUBLIC_URL}/v1/crl",
+    rebase_entries=int(os.environ.get("PQCERT_CRL_REBASE_ENTRIES", "1000")),
+)
+
+# Merkle-tree log of every issued certificate; issuance only queues, a
+# background task appends the queue and signs a tree head every interval
+transparency = create_transparency_log(ca, DATA_DIR)
+TRANSPARENCY_INTERVAL = float(os.environ.get("PQCERT_TRANSPARENCY_INTERVAL_SECONDS", "10"))
 
 
 class CertificateRequest(BaseModel):
     domain: str
     email: EmailStr | None = None
     algorithm: str = "hybrid"  # hybrid, ml-dsa, rsa
+    # Client-held secret; validations are remembered per account and domain
+    account_key: str | None = Field(None, min_length=32, max_length=256)
+    # Renewal: keep the server-generated key of this earlier certificate
+    reuse_key_from: str | None = None
+    max_key_age_days: int | None = Field(None, ge=0)
+    # Issue a new certificate even if an identical one was issued recently
+    force_new: bool = False
+    # http-01 or dns-01 (default: http-01; wildcards, e.g. *.example.com,
+    # can only be validated with dns-01 and also cover example.com)
+    challenge_type: str | None = None
+
+
+class RevocationRequest(BaseModel):
+    reason: str = "unspecified"  # RFC 5280 reason: keyCompromise, superseded, ... (crl.REVOCATION_REASONS)
 
 
 class ChallengeResponse(BaseModel):
     challenge_id: str
     challenge_token: str
-    challenge_url: str
+    challenge_type: str = "http-01"
+    challenge_url: str | None = None  # http-01: where the token must be served
+    dns_record: str | None = None  # dns-01: TXT record that must hold the token
     expires_at: str
+    authorized: bool = False  # domain already validated for this account
+
+
+class CSRSignRequest(BaseModel):
+    csr: str = Field(..., max_length=65536)  # PEM
+    # Challenges for names the account doesn't hold an authorization for yet
+    challenge_ids: list[str] = Field([], max_length=100)
+    account_key: str | None = Field(None, min_length=32, max_length=256)
 
 
 class CertificateResponse(BaseModel):
@@ -60,6 +226,8 @@ class CertificateResponse(BaseModel):
     key_url: str | None = None
     chain_url: str | None = None
     expires_at: str | None = None
+    key_reused: bool = False
+    deduplicated: bool = False  # a recently issued certificate was returned
 
 
 # ============== API Endpoints ==============
@@ -80,13 +248,58 @@ async def health():
 
 
 @app.post("/v1/certificate/request", response_model=ChallengeResponse)
-async def request_certificate(req: CertificateRequest):
+async def request_certificate(
+    req: CertificateRequest,
+    request: Request,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key", max_length=255),
+):
     """
     Step 1: Request a certificate and receive a challenge
     """
     # Validate domain
-    if not is_valid_domain(req.domain):
+    if not is_valid_domain(req.domain, wildcard=True):
         raise HTTPException(400, "Invalid domain name")
+    if req.challenge_type is None:
+        req.challenge_type = "dns-01" if req.domain.startswith("*.") else "http-01"
+    if req.challenge_type not in CHALLENGE_TYPES:
+        raise HTTPException(400, f"challenge_type must be one of: {', '.join(CHALLENGE_TYPES)}")
+    if req.domain.startswith("*.") and req.challenge_type != "dns-01":
+        raise HTTPException(400, "Wildcard names can only be validated with dns-01")
+
+    account_id = AuthorizationStore.account_id(req.account_key) if req.account_key else None
+    if idempotency_key and not account_id:
+        # Keys are scoped to an account; shared by anonymous callers, a replay
+        # would hand one client another's challenge_id
+        raise HTTPException(400, "Idempotency-Key requires account_key")
+
+    async def create():
+        return (await create_challenge(req, account_id, client_address(request))).model_dump()
+
+    if idempotency_key:
+        result = await run_idempotent(f"request:{account_id}:{idempotency_key}", req.model_dump(), create)
+        return ChallengeResponse(**result)
+    return await create_challenge(req, account_id, client_address(request))
+
+
+async def create_challenge(req: CertificateRequest, account_id: str | None,
+                           client: str) -> ChallengeResponse:
+    authorized = await authorizations.get(account_id, req.domain) is not None
+
+    # The challenge id is what lets its holder collect the certificate, so a
+    # pending one is only handed out again to the same account
+    pending_key = f"{account_id}:{req.domain.lower()}:{req.algorithm}"
+    if account_id:
+        pending_id = await pending_challenges.get(pending_key)
+        raw = await storage.get(f"challenges/{pending_id.decode()}.json") if pending_id else None
+        if raw is not None:
+            pending = json.loads(raw)
+            if (datetime.fromisoformat(pending["expires_at"]) > datetime.utcnow() + timedelta(minutes=5)
+                    and pending.get("email") == req.email
+                    and pending.get("reuse_key_from") == req.reuse_key_from
+                    and pending.get("max_key_age_days") == req.max_key_age_days
+                    and pending.get("force_new", False) == req.force_new
+                    and pending.get("challenge_type", "http-01") == req.challenge_type):
+                return challenge_response(pending_id.decode(), pending, authorized)
 
     # Generate challenge
     challenge_id = str(uuid.uuid4())
@@ -97,57 +310,149 @@ async def request_certificate(req: CertificateRequest):
         "domain": req.domain,
         "email": req.email,
         "algorithm": req.algorithm,
+        "account": account_id,
+        "reuse_key_from": req.reuse_key_from,
+        "max_key_age_days": req.max_key_age_days,
+        "force_new": req.force_new,
+        "challenge_type": req.challenge_type,
         "token": challenge_token,
         "created_at": datetime.utcnow().isoformat(),
         "expires_at": (datetime.utcnow() + timedelta(hours=1)).isoformat(),
         "verified": False
     }
 
-    challenge_file = CHALLENGES_DIR / f"{challenge_id}.json"
-    challenge_file.write_text(json.dumps(challenge_data))
+    await storage.put(f"challenges/{challenge_id}.json", json.dumps(challenge_data).encode(),
+                      "application/json", private=True)
+    if account_id:
+        await pending_challenges.set(pending_key, challenge_id.encode(), 3600)
+    audit.record("challenge_created", challenge_id=challenge_id, domain=req.domain,
+                 algorithm=req.algorithm, account=account_id, challenge_type=req.challenge_type,
+                 client=client)
+
+    return challenge_response(challenge_id, challenge_data, authorized)
+
 
+def challenge_response(challenge_id: str, challenge_data: dict, authorized: bool) -> ChallengeResponse:
+    """What the client has to publish for a stored challenge"""
+    domain = challenge_data["domain"]
+    token = challenge_data["token"]
+    challenge_type = challenge_data.get("challenge_type", "http-01")
     return ChallengeResponse(
         challenge_id=challenge_id,
-        challenge_token=challenge_token,
-        challenge_url=f"http://{req.domain}/.well-known/pqcert-challenge/{challenge_token}",
-        expires_at=challenge_data["expires_at"]
+        challenge_token=token,
+        challenge_type=challenge_type,
+        challenge_url=f"http://{domain}/.well-known/pqcert-challenge/{token}"
+                      if challenge_type == "http-01" else None,
+        dns_record=dns01_record(domain) if challenge_type == "dns-01" else None,
+        expires_at=challenge_data["expires_at"],
+        authorized=authorized
     )
 
 
 @app.post("/v1/certificate/verify/{challenge_id}")
-async def verify_challenge(challenge_id: str, background_tasks: BackgroundTasks):
+async def verify_challenge(challenge_id: str, background_tasks: BackgroundTasks, request: Request):
     """
     Step 2: Verify domain ownership and issue certificate
+
+    Concurrent calls for one challenge share a single issuance, and a retry
+    after it finished gets the same certificate back.
     """
-    challenge_file = CHALLENGES_DIR / f"{challenge_id}.json"
+    if not is_valid_id(challenge_id):
+        raise HTTPException(404, "Challenge not found")
+
+    async def issue():
+        return (await issue_for_challenge(challenge_id, background_tasks,
+                                          client_address(request))).model_dump()
 
-    if not challenge_file.exists():
+    return CertificateResponse(**await run_idempotent(f"verify:{challenge_id}", {}, issue))
+
+
+async def issue_for_challenge(challenge_id: str, background_tasks: BackgroundTasks,
+                              client: str) -> CertificateResponse:
+    challenge_key = f"challenges/{challenge_id}.json"
+    raw = await storage.get(challenge_key)
+    if raw is None:
         raise HTTPException(404, "Challenge not found")
 
-    challenge_data = json.loads(challenge_file.read_text())
+    challenge_data = json.loads(raw)
 
     # Check expiration
     expires_at = datetime.fromisoformat(challenge_data["expires_at"])
     if datetime.utcnow() > expires_at:
         raise HTTPException(400, "Challenge expired")
 
-    # Verify domain ownership (HTTP-01 challenge)
+    # Verify domain ownership (HTTP-01 or DNS-01 challenge), unless this
+    # account already holds a valid authorization for the domain
     domain = challenge_data["domain"]
+    domains = certificate_names(domain)
     token = challenge_data["token"]
+    challenge_type = challenge_data.get("challenge_type", "http-01")
+    account_id = challenge_data.get("account")
 
-    if not await verify_domain_ownership(domain, token):
-        raise HTTPException(400, "Domain verification failed. Make sure the challenge file is accessible.")
-
-    # Generate certificate
+    if await authorizations.use(account_id, domain):
+        method = "authorization"
+    else:
+        if not await verify_domain_ownership(domain, token, challenge_type):
+            raise HTTPException(400, VALIDATION_FAILED[challenge_type])
+        for name in domains:
+            await authorizations.record(account_id, name, challenge_type)
+        method = challenge_type
+    audit.record("validated", challenge_id=challenge_id, domain=domain, account=account_id,
+                 method=method, client=client)
+
+    # Same names, algorithm and account as a certificate issued moments ago:
+    # hand that one out again
+    dedup_key = issuance_key(account_id, domains, challenge_data["algorithm"],
+                             challenge_data.get("reuse_key_from"))
+    if dedup_key and challenge_data.get("force_new"):
+        issuance_stats["forced"] += 1
+    elif dedup_key:
+        recent = await recent_certificate(dedup_key)
+        if recent is not None:
+            cert_id, metadata = recent
+            await storage.delete(challenge_key)
+            issuance_stats["deduplicated"] += 1
+            await audit.record_committed("issued", cert_id=cert_id, serial=metadata["serial"],
+                                         domains=domains, algorithm=metadata["algorithm"],
+                                         account=account_id, challenge_id=challenge_id,
+                                         deduplicated=True, client=client)
+            return CertificateResponse(
+                success=True,
+                message=f"Certificate issued at {metadata['issued_at']} returned (use force_new for a new one)",
+                certificate_id=cert_id,
+                cert_url=f"/v1/certificate/{cert_id}/cert.pem",
+                key_url=f"/v1/certificate/{cert_id}/key.pem",
+                chain_url=f"/v1/certificate/{cert_id}/chain.pem",
+                expires_at=metadata["expires_at"],
+                deduplicated=True
+            )
+
+    # Generate certificate, keeping the previous key if asked and still allowed
+    key_pem, key_created_at = await reusable_key(
+        challenge_data.get("reuse_key_from"), domain, challenge_data["algorithm"],
+        challenge_data.get("max_key_age_days")
+    )
     cert_id = str(uuid.uuid4())
     cert_data = await generate_certificate(
-        domain=domain,
+        domains=domains,
         algorithm=challenge_data["algorithm"],
-        cert_id=cert_id
+        cert_id=cert_id,
+        key_pem=key_pem,
+        key_created_at=key_created_at
     )
 
     # Clean up challenge
-    challenge_file.unlink()
+    await storage.delete(challenge_key)
+    issuance_stats["issued"] += 1
+    if dedup_key:
+        await recent_issuance.set(dedup_key, cert_id.encode(), int(DEDUP_WINDOW.total_seconds()))
+    await audit.record_committed("issued", cert_id=cert_id, serial=cert_data["serial"], domains=domains,
+                                 algorithm=challenge_data["algorithm"], account=account_id,
+                                 challenge_id=challenge_id, key="reused" if key_pem else "server",
+                                 client=client)
+
+    # Pre-sign the OCSP response so the first status query is a cache hit
+    background_tasks.add_task(ocsp_responder.response_for, cert_data["serial"])
 
     return CertificateResponse(
         success=True,
@@ -156,29 +461,435 @@ async def verify_challenge(challenge_id: str, background_tasks: BackgroundTasks)
         cert_url=f"/v1/certificate/{cert_id}/cert.pem",
         key_url=f"/v1/certificate/{cert_id}/key.pem",
         chain_url=f"/v1/certificate/{cert_id}/chain.pem",
+        expires_at=cert_data["expires_at"],
+        key_reused=key_pem is not None
+    )
+
+
+@app.post("/v1/certificate/sign", response_model=CertificateResponse)
+async def sign_certificate_request(
+    req: CSRSignRequest,
+    background_tasks: BackgroundTasks,
+    request: Request,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key", max_length=255),
+):
+    """
+    Step 2 (client-held key): sign a CSR. The private key never reaches
+    the server, so no key.pem is stored or served.
+
+    Every DNS name in the CSR must be covered by an authorization the
+    account already holds, or by one of challenge_ids (HTTP-01 is checked
+    here, as in /verify).
+    """
+    if idempotency_key:
+        if not req.account_key:
+            raise HTTPException(400, "Idempotency-Key requires account_key")
+        account_id = AuthorizationStore.account_id(req.account_key)
+
+        async def sign():
+            return (await sign_csr_request(req, background_tasks, client_address(request))).model_dump()
+
+        result = await run_idempotent(f"sign:{account_id}:{idempotency_key}", req.model_dump(), sign)
+        return CertificateResponse(**result)
+    return await sign_csr_request(req, background_tasks, client_address(request))
+
+
+async def sign_csr_request(req: CSRSignRequest, background_tasks: BackgroundTasks,
+                           client: str) -> CertificateResponse:
+    try:
+        csr, domains, key_algorithm = load_csr(req.csr)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    invalid = [d for d in domains if not is_valid_domain(d, wildcard=True)]
+    if invalid:
+        raise HTTPException(400, f"Invalid domain name: {', '.join(invalid)}")
+
+    account_id = AuthorizationStore.account_id(req.account_key) if req.account_key else None
+
+    # Pending, unexpired challenges by domain
+    challenges = {}
+    for challenge_id in req.challenge_ids:
+        raw = await storage.get(f"challenges/{challenge_id}.json") if is_valid_id(challenge_id) else None
+        if raw is None:
+            continue
+        challenge_data = json.loads(raw)
+        if datetime.fromisoformat(challenge_data["expires_at"]) >= datetime.utcnow():
+            challenges[challenge_data["domain"].lower()] = (challenge_id, challenge_data)
+
+    unauthorized = []
+    used = []
+    validated = set()
+    # Wildcards first: their DNS-01 validation also covers the base domain
+    for domain in sorted(domains, key=lambda d: not d.startswith("*.")):
+        if domain in validated or await authorizations.use(account_id, domain):
+            continue
+        if domain in challenges:
+            challenge_id, challenge_data = challenges[domain]
+            challenge_type = challenge_data.get("challenge_type", "http-01")
+            if await verify_domain_ownership(domain, challenge_data["token"], challenge_type):
+                validated.update(certificate_names(domain))
+                for name in certificate_names(domain):
+                    await authorizations.record(account_id or challenge_data.get("account"), name,
+                                                challenge_type)
+                audit.record("validated", challenge_id=challenge_id, domain=domain,
+                             account=account_id or challenge_data.get("account"),
+                             method=challenge_type, client=client)
+                used.append(challenge_id)
+                continue
+        unauthorized.append(domain)
+
+    if unauthorized:
+        raise HTTPException(403, f"Domain verification failed for: {', '.join(unauthorized)}")
+
+    cert_id = str(uuid.uuid4())
+    serial = new_serial()
+    cert_pem = sign_csr(ca, csr, domains, serial, CERT_VALIDITY, OCSP_URL, BASE_CRL_URL, DELTA_CRL_URL)
+    cert_data = await store_certificate(cert_id, serial, domains, key_algorithm, cert_pem)
+    issuance_stats["issued"] += 1
+    await audit.record_committed("issued", cert_id=cert_id, serial=serial, domains=domains,
+                                 algorithm=key_algorithm, account=account_id, key="client",
+                                 client=client)
+
+    for challenge_id in used:
+        await storage.delete(f"challenges/{challenge_id}.json")
+
+    # Pre-sign the OCSP response so the first status query is a cache hit
+    background_tasks.add_task(ocsp_responder.response_for, serial)
+
+    return CertificateResponse(
+        success=True,
+        message="Certificate issued successfully",
+        certificate_id=cert_id,
+        cert_url=f"/v1/certificate/{cert_id}/cert.pem",
+        chain_url=f"/v1/certificate/{cert_id}/chain.pem",
         expires_at=cert_data["expires_at"]
     )
 
 
 @app.get("/v1/certificate/{cert_id}/{filename}")
-async def download_certificate(cert_id: str, filename: str):
+async def download_certificate(cert_id: str, filename: str, request: Request,
+                               accept_encoding: str | None = Header(None)):
     """
     Download certificate files
+
+    Compressed variants stored at issuance are sent as is when the client
+    accepts their encoding (zstd preferred over gzip).
     """
     allowed_files = ["cert.pem", "key.pem", "chain.pem", "fullchain.pem"]
     if filename not in allowed_files:
         raise HTTPException(400, "Invalid filename")
 
-    cert_path = CERTS_DIR / cert_id / filename
-    if not cert_path.exists():
+    if not is_valid_id(cert_id):
         raise HTTPException(404, "Certificate not found")
 
-    return FileResponse(
-        cert_path,
-        media_type="application/x-pem-file",
-        filename=filename
+    # Stored names to try, best accepted encoding first, the plain file last
+    encodings = negotiate(accept_encoding)
+    candidates = [(filename + SUFFIXES[e], e) for e in encodings] + [(filename, None)]
+
+    # Object store: send the client there directly, once the metadata
+    # (stored with the artifacts, never deleted) shows the file exists
+    url = storage.download_url(f"certs/{cert_id}/{filename}", filename)
+    if url is not None:
+        metadata = await read_metadata(cert_id)
+        if metadata is None or (filename == "key.pem" and metadata.get("client_key")):
+            raise HTTPException(404, "Certificate not found")
+        for name, encoding in candidates:
+            if name in metadata.get("compressed", []):
+                url = storage.download_url(f"certs/{cert_id}/{name}", filename)
+                break
+        audit.record("downloaded", cert_id=cert_id, file=filename, client=client_address(request))
+        return RedirectResponse(url, status_code=307, headers={"Vary": "Accept-Encoding"})
+
+    # Front-end web server sends the file (never used for key.pem); nginx
+    # sets Content-Encoding from the variant's suffix
+    if DOWNLOAD_MODE == "x-accel":
+        for name, encoding in candidates:
+            public_file = await asyncio.to_thread(storage.public_file, cert_id, name)
+            if public_file is not None:
+                audit.record("downloaded", cert_id=cert_id, file=filename, encoding=encoding,
+                             client=client_address(request))
+                return Response(media_type="application/x-pem-file", headers={
+                    "X-Accel-Redirect": ACCEL_PREFIX + public_file,
+                    "Content-Disposition": f'attachment; filename="{filename}"',
+                })
+
+    # Local: the artifact is a byte range of the certificate's pack file
+    for name, encoding in candidates:
+        location = await asyncio.to_thread(storage.artifact_range, cert_id, name)
+        if location is not None:
+            audit.record("downloaded", cert_id=cert_id, file=filename, encoding=encoding,
+                         client=client_address(request))
+            return FileRangeResponse(
+                *location,
+                media_type="application/x-pem-file",
+                filename=filename,
+                content_encoding=encoding
+            )
+
+    raise HTTPException(404, "Certificate not found")
+
+
+@app.post("/v1/certificate/{cert_id}/revoke")
+async def revoke_certificate(cert_id: str, req: RevocationRequest, request: Request):
+    """
+    Revoke an issued certificate. The certificate ID is the credential,
+    just as for downloads.
+    """
+    if req.reason not in REVOCATION_REASONS:
+        raise HTTPException(422, f"Invalid reason. Use one of: {', '.join(REVOCATION_REASONS)}")
+
+    metadata = await read_metadata(cert_id)
+    if metadata is None or not metadata.get("serial"):
+        raise HTTPException(404, "Certificate not found")
+
+    entry = await asyncio.to_thread(
+        crl_publisher.revoke, metadata["serial"], req.reason, metadata["expires_at"]
     )
 
+    if not metadata.get("revoked_at"):
+        metadata["revoked_at"] = entry["revoked_at"]
+        metadata["revocation_reason"] = entry["reason"]
+        await storage.set_artifact(cert_id, "metadata.json", json.dumps(metadata).encode())
+        await ocsp_responder.invalidate(metadata["serial"])
+        await audit.record_committed("revoked", cert_id=cert_id, serial=metadata["serial"],
+                                     reason=entry["reason"], client=client_address(request))
+
+    return {
+        "success": True,
+        "certificate_id": cert_id,
+        "serial": metadata["serial"],
+        "revoked_at": entry["revoked_at"],
+        "reason": entry["reason"]
+    }
+
+
+@app.get("/v1/crl/base.crl")
+async def base_crl(request: Request):
+    """
+    Full (base) CRL. Relying parties keep it and then follow delta.crl.
+    """
+    return crl_http_response(crl_publisher.base, request)
+
+
+@app.get("/v1/crl/delta.crl")
+async def delta_crl(request: Request):
+    """
+    Delta CRL: revocations since the current base CRL
+    """
+    return crl_http_response(crl_publisher.delta, request)
+
+
+@app.post("/v1/ocsp")
+async def ocsp_post(request: Request):
+    """
+    OCSP responder (RFC 6960, POST). Answers come pre-signed from the cache.
+    """
+    der = await ocsp_responder.respond(await request.body())
+    return ocsp_http_response(der)
+
+
+@app.get("/v1/ocsp/{encoded_request:path}")
+async def ocsp_get(encoded_request: str):
+    """
+    OCSP responder (RFC 6960, GET with base64 DER request in the path)
+    """
+    try:
+        request_der = base64.b64decode(encoded_request, validate=True)
+    except ValueError:
+        return ocsp_http_response(ocsp_responder.malformed)
+    return ocsp_http_response(await ocsp_responder.respond(request_der))
+
+
+class OCSPPrefetchRequest(BaseModel):
+    serials: list[str] = []
+    certificate_ids: list[str] = []
+
+
+@app.post("/v1/ocsp/prefetch")
+async def ocsp_prefetch(req: OCSPPrefetchRequest):
+    """
+    Bulk fetch of pre-signed OCSP responses for stapling servers.
+    Returns base64 DER responses keyed by serial; unknown serials are omitted.
+    """
+    if len(req.serials) + len(req.certificate_ids) > 1000:
+        raise HTTPException(400, "At most 1000 certificates per request")
+
+    # openssl prints serials zero-padded and in upper case
+    serials = [serial.lower().lstrip("0") or "0" for serial in req.serials]
+    if not all(is_valid_serial(serial) for serial in serials):
+        raise HTTPException(400, "Serials must be hex")
+    for cert_id in req.certificate_ids:
+        metadata = await read_metadata(cert_id)
+        if metadata and metadata.get("serial"):
+            serials.append(metadata["serial"])
+
+    responses = await ocsp_responder.prefetch(serials)
+    return {
+        "responses": {serial: base64.b64encode(der).decode() for serial, der in responses.items()}
+    }
+
+
+# ============== Transparency Log ==============
+
+@app.get("/v1/transparency/sth")
+async def transparency_sth():
+    """
+    Latest signed tree head. The signature (CA key, ECDSA with SHA-256) is
+    over the RFC 6962 TreeHeadSignature structure.
+    """
+    return Response(content=json.dumps(transparency.sth), media_type="application/json",
+                    headers={"Cache-Control": "public, max-age=10"})
+
+
+@app.get("/v1/transparency/entries")
+async def transparency_entries(start: int, end: int):
+    """
+    Log entries start..end (inclusive, at most 256); leaf_input is the
+    certificate's DER, base64
+    """
+    size = transparency.sth["tree_size"]
+    if start < 0 or end < start or start >= size:
+        raise HTTPException(400, f"Invalid range (tree size {size})")
+    end = min(end, start + MAX_ENTRIES - 1, size - 1)
+    entries = await asyncio.to_thread(lambda: list(transparency.entries(start, end)))
+    # Entries logged before cert_id was dropped from the file still carry it
+    return {"entries": [{k: e[k] for k in ENTRY_FIELDS if k in e} for e in entries]}
+
+
+@app.get("/v1/transparency/proof")
+async def transparency_inclusion_proof(tree_size: int, hash: str | None = None,
+                                       leaf_index: int | None = None):
+    """
+    Inclusion proof (audit path) of a leaf, by its base64 RFC 6962 leaf hash
+    or by index, in the tree of tree_size leaves
+    """
+    if not 0 < tree_size <= transparency.sth["tree_size"]:
+        raise HTTPException(400, f"tree_size must be between 1 and {transparency.sth['tree_size']}")
+    if hash is not None:
+        try:
+            leaf_index = transparency.leaf_index.get(base64.b64decode(hash, validate=True))
+        except ValueError:
+            raise HTTPException(400, "hash must be base64")
+        if leaf_index is None:
+            raise HTTPException(404, "Leaf not found")
+    if leaf_index is None or not 0 <= leaf_index < tree_size:
+        raise HTTPException(400 if hash is None else 404, "Leaf not in this tree")
+    path = await asyncio.to_thread(transparency.inclusion_proof, leaf_index, tree_size)
+    return {"leaf_index": leaf_index, "audit_path": [base64.b64encode(h).decode() for h in path]}
+
+
+@app.get("/v1/transparency/consistency")
+async def transparency_consistency_proof(first: int, second: int):
+    """
+    Proof that the tree of first leaves is a prefix of the tree of second
+    """
+    if not 0 < first <= second <= transparency.sth["tree_size"]:
+        raise HTTPException(400, f"Need 0 < first <= second <= {transparency.sth['tree_size']}")
+    proof = await asyncio.to_thread(transparency.consistency_proof, first, second)
+    return {"consistency": [base64.b64encode(h).decode() for h in proof]}
+
+
+@app.get("/v1/transparency/certificate/{cert_id}")
+async def certificate_transparency(cert_id: str):
+    """
+    Where a certificate is in the log, with its inclusion proof in the
+    latest tree head (404 until its batch has been appended)
+    """
+    cert_pem = await storage.get_artifact(cert_id, "cert.pem") if is_valid_id(cert_id) else None
+    if cert_pem is None:
+        raise HTTPException(404, "Certificate not found")
+    der = x509.load_pem_x509_certificate(cert_pem).public_bytes(serialization.Encoding.DER)
+    leaf = leaf_hash(der)
+    sth = transparency.sth
+    leaf_index = transparency.leaf_index.get(leaf)
+    if leaf_index is None or leaf_index >= sth["tree_size"]:
+        raise HTTPException(404, "Not in the log yet")
+    path = await asyncio.to_thread(transparency.inclusion_proof, leaf_index, sth["tree_size"])
+    return {
+        "leaf_index": leaf_index,
+        "leaf_hash": base64.b64encode(leaf).decode(),
+        "sth": sth,
+        "audit_path": [base64.b64encode(h).decode() for h in path],
+    }
+
+
+# ============== Admin Endpoints ==============
+
+def require_admin(authorization: str | None = Header(None)):
+    """Bearer PQCERT_ADMIN_TOKEN; admin endpoints don't exist without one"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(404, "Not found")
+    if not authorization or not secrets.compare_digest(authorization, f"Bearer {ADMIN_TOKEN}"):
+        raise HTTPException(401, "Invalid admin token")
+
+
+@app.get("/admin/stats", dependencies=[Depends(require_admin)])
+async def admin_stats():
+    """Counters since start: issuance and dedup, idempotent replays, DNS cache"""
+    return {
+        "issuance": issuance_stats,
+        "idempotency": idempotency.stats,
+        "dns": resolver.stats,
+        "audit": audit.stats,
+        "transparency": {**transparency.stats, "tree_size": transparency.size,
+                         "pending": len(transparency.pending)},
+    }
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles(limit: int = 50):
+    """
+    Recent slow (or sampled) request profiles, newest first
+    """
+    if profiler is None:
+        raise HTTPException(404, "Profiling is disabled (set PQCERT_PROFILE=1)")
+    return {
+        "slow_ms": profiler.slow_ms,
+        "sample_rate": profiler.sample_rate,
+        "profiles": await asyncio.to_thread(profiler.recent, min(limit, 500))
+    }
+
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """
+    One profile as collapsed stacks (flamegraph.pl, speedscope)
+    """
+    record = profiler.get(profile_id) if profiler is not None else None
+    if record is None:
+        raise HTTPException(404, "Profile not found")
+    return PlainTextResponse(record["stacks"] + "\n")
+
+
+@app.get("/admin/memory", dependencies=[Depends(require_admin)])
+async def memory_status():
+    """
+    RSS, open file descriptors by kind and live asyncio tasks by coroutine
+    """
+    return {
+        "tracemalloc": memdiag is not None,
+        **memory_summary(),
+    }
+
+
+@app.post("/admin/memory/snapshot", dependencies=[Depends(require_admin)])
+async def memory_snapshot(limit: int = 25, group_by: str = "lineno", reset: bool = False):
+    """
+    Top allocation sites by size, and by growth since the previous snapshot
+    (group_by=traceback for the full call stacks; reset=true drops the baseline)
+    """
+    if memdiag is None:
+        raise HTTPException(404, "Memory diagnostics are disabled (set PQCERT_MEMDIAG=1)")
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(400, "group_by must be lineno, filename or traceback")
+    if reset:
+        memdiag.reset()
+    return {
+        **await asyncio.to_thread(memdiag.snapshot, min(limit, 500), group_by),
+        **memory_summary(),
+    }
+
 
 @app.get("/install")
 async def install_script():
@@ -251,102 +962,343 @@ fi
 
 # ============== Helper Functions ==============
 
-def is_valid_domain(domain: str) -> bool:
-    """Validate domain name"""
+async def run_idempotent(key: str, payload, fn) -> dict:
+    """idempotency.run with its errors mapped to HTTP responses"""
+    try:
+        return await idempotency.run(key, payload, fn)
+    except IdempotencyConflict:
+        raise HTTPException(422, "Idempotency-Key was already used for a different request")
+    except RequestInProgress:
+        raise HTTPException(409, "This request is still being processed, retry shortly")
+
+
+def client_address(request: Request) -> str:
+    """Client IP; behind nginx, the one it reports in X-Real-IP"""
+    return request.headers.get("x-real-ip") or (request.client.host if request.client else "")
+
+
+def is_valid_domain(domain: str, wildcard: bool = False) -> bool:
+    """Validate domain name (with wildcard, *.<domain> too)"""
     import re
+    if wildcard and domain.startswith("*."):
+        domain = domain[2:]
     pattern = r'^(?:[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}$'
     return bool(re.match(pattern, domain))
 
 
+def certificate_names(domain: str) -> list[str]:
+    """Names a validated domain is issued for; a wildcard also covers its base"""
+    if domain.startswith("*."):
+        return [domain, domain[2:]]
+    return [domain]
+
+
+def is_valid_id(value: str) -> bool:
+    """Certificate and challenge IDs are UUIDs"""
+    try:
+        return str(uuid.UUID(value)) == value
+    except ValueError:
+        return False
+
+
+# Serials are at most 20 octets (RFC 5280), keyed as format(serial_number, "x")
+SERIAL_PATTERN = re.compile(r"0|[1-9a-f][0-9a-f]{0,39}")
+
+
+def is_valid_serial(value: str) -> bool:
+    """Serials are lowercase hex without leading zeros"""
+    return SERIAL_PATTERN.fullmatch(value) is not None
+
+
 def generate_token() -> str:
     """Generate a random token for challenges"""
     import secrets
     return secrets.token_urlsafe(32)
 
 
-async def verify_domain_ownership(domain: str, token: str) -> bool:
-    """Verify domain ownership via HTTP-01 challenge"""
-    import httpx
+def ocsp_http_response(der: bytes) -> Response:
+    """Wrap a DER OCSP response; cacheable by CDNs/proxies for a short while"""
+    return Response(
+        content=der,
+        media_type="application/ocsp-response",
+        headers={"Cache-Control": "public, max-age=3600, no-transform"}
+    )
 
-    challenge_url = f"http://{domain}/.well-known/pqcert-challenge/{token}"
 
-    try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            response = await client.get(challenge_url)
-            return response.status_code == 200 and token in response.text
-    except Exception:
-        return False
+def crl_http_response(signed: dict, request: Request) -> Response:
+    """Serve a signed CRL with ETag revalidation, cacheable until its nextUpdate"""
+    max_age = max(int((signed["next_update"] - datetime.utcnow()).total_seconds()), 0)
+    headers = {
+        "ETag": signed["etag"],
+        "Cache-Control": f"public, max-age={max_age}, no-transform"
+    }
+    if request.headers.get("if-none-match") == signed["etag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=signed["der"], media_type="application/pkix-crl", headers=headers)
+
+
+class FileRangeResponse(Response):
+    """
+    A byte range of a file as the response body. Uses the ASGI zero-copy
+    extension (sendfile) when the server offers it; uvicorn doesn't, so there
+    it is one pread in a worker thread. For sendfile use the x-accel mode.
+    """
+
+    def __init__(self, path: Path, offset: int, length: int, media_type: str, filename: str,
+                 content_encoding: str | None = None):
+        headers = {
+            "Content-Length": str(length),
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Vary": "Accept-Encoding",
+        }
+        if content_encoding:
+            headers["Content-Encoding"] = content_encoding
+        super().__init__(media_type=media_type, headers=headers)
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+    def _read(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return os.pread(f.fileno(), self.length, self.offset)
+
+    async def __call__(self, scope, receive, send):
+        if "http.response.zerocopy" not in scope.get("extensions", {}):
+            body = await asyncio.to_thread(self._read)
+            await send({"type": "http.response.start", "status": self.status_code,
+                        "headers": self.raw_headers})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        f = await asyncio.to_thread(open, self.path, "rb")
+        try:
+            await send({"type": "http.response.start", "status": self.status_code,
+                        "headers": self.raw_headers})
+            await send({"type": "http.response.zerocopy", "file": f,
+                        "offset": self.offset, "count": self.length})
+        finally:
+            f.close()
+
+
+async def read_metadata(cert_id: str) -> dict | None:
+    """Metadata of an issued certificate, or None"""
+    if not is_valid_id(cert_id):
+        return None
+    raw = await storage.get_artifact(cert_id, "metadata.json")
+    return json.loads(raw) if raw is not None else None
+
+
+async def load_certificate_index():
+    """Build the serial -> certificate index from the certificate store, and
+    log certificates the transparency log lost (queued when the API stopped)"""
+    CERT_INDEX.clear()
+    since = transparency.backfill_since()
+    recent = []
+    for cert_id in await storage.certificate_ids():
+        metadata = await read_metadata(cert_id)
+        if metadata and metadata.get("serial"):
+            CERT_INDEX[metadata["serial"]] = {
+                "cert_id": cert_id,
+                "expires_at": metadata["expires_at"]
+            }
+            if metadata.get("issued_at", "") >= since:
+                recent.append((metadata.get("issued_at", ""), metadata["serial"], cert_id))
+
+    logged = await asyncio.to_thread(transparency.logged_serials, since) if recent else set()
+    for issued_at, serial, cert_id in sorted(recent):
+        cert_pem = await storage.get_artifact(cert_id, "cert.pem")
+        if serial not in logged and cert_pem is not None:
+            der = x509.load_pem_x509_certificate(cert_pem).public_bytes(serialization.Encoding.DER)
+            transparency.submit(serial, issued_at, der)
+
+
+async def lookup_certificate(serial: str) -> dict | None:
+    """Revocation-status record for a serial, or None if we didn't issue it"""
+    if not is_valid_serial(serial):
+        return None
+    entry = CERT_INDEX.get(serial)
+    if entry is None:
+        # Possibly issued by another replica since we built the index
+        cert_id = await storage.get(f"serials/{serial}")
+        if cert_id is None:
+            return None
+        entry = {"cert_id": cert_id.decode()}
+    cert_id = entry["cert_id"]
+    metadata = await read_metadata(cert_id)
+    cert_pem = await storage.get_artifact(cert_id, "cert.pem")
+    if metadata is None or cert_pem is None:
+        return None
+    CERT_INDEX.setdefault(serial, {"cert_id": cert_id, "expires_at": metadata["expires_at"]})
+    return {
+        "cert_pem": cert_pem,
+        "expires_at": metadata["expires_at"],
+        "revoked_at": metadata.get("revoked_at"),
+        "revocation_reason": metadata.get("revocation_reason")
+    }
 
 
-async def generate_certificate(domain: str, algorithm: str, cert_id: str) -> dict:
-    """Generate a post-quantum certificate"""
+def active_serials() -> list[str]:
+    """Serials of certificates that haven't expired yet"""
+    now = datetime.utcnow().isoformat()
+    return [serial for serial, entry in CERT_INDEX.items() if entry["expires_at"] > now]
 
-    cert_dir = CERTS_DIR / cert_id
-    cert_dir.mkdir(parents=True, exist_ok=True)
 
-    key_file = cert_dir / "key.pem"
-    cert_file = cert_dir / "cert.pem"
-    chain_file = cert_dir / "chain.pem"
-    fullchain_file = cert_dir / "fullchain.pem"
+async def verify_domain_ownership(domain: str, token: str, challenge_type: str = "http-01") -> bool:
+    """Verify domain ownership via HTTP-01 or DNS-01 challenge"""
+    if challenge_type == "dns-01":
+        return await verify_dns01(domain, token, resolver)
+    return await verify_http01(domain, token, resolver)
 
-    # Generate key based on algorithm
-    if algorithm == "ml-dsa":
+
+async def generate_certificate(domains: list, algorithm: str, cert_id: str,
+                               key_pem: bytes | None = None, key_created_at: str | None = None) -> dict:
+    """Generate a post-quantum certificate for domains, the first one as CN
+    (for key_pem instead of a new key, if given)"""
+
+    # Key type based on algorithm
+    if key_pem is not None:
+        # Renewal with the existing key (PEM on stdin)
+        newkey = ["-key", "/dev/stdin"]
+    elif algorithm == "ml-dsa":
         # Pure post-quantum (ML-DSA-65 / Dilithium3)
-        key_cmd = ["openssl", "genpkey", "-algorithm", "ml-dsa-65", "-out", str(key_file)]
+        newkey = ["-newkey", "ml-dsa-65", "-noenc", "-keyout", "-"]
     elif algorithm == "hybrid":
         # Hybrid: RSA + ML-DSA for compatibility
-        key_cmd = ["openssl", "genpkey", "-algorithm", "RSA", "-pkeyopt", "rsa_keygen_bits:2048", "-out", str(key_file)]
+        newkey = ["-newkey", "rsa:2048", "-noenc", "-keyout", "-"]
     else:
         # Traditional RSA
-        key_cmd = ["openssl", "genpkey", "-algorithm", "RSA", "-pkeyopt", "rsa_keygen_bits:2048", "-out", str(key_file)]
-
-    subprocess.run(key_cmd, check=True, capture_output=True)
-
-    # Generate CSR
-    csr_file = cert_dir / "csr.pem"
-    csr_cmd = [
-        "openssl", "req", "-new",
-        "-key", str(key_file),
-        "-out", str(csr_file),
-        "-subj", f"/CN={domain}"
-    ]
-    subprocess.run(csr_cmd, check=True, capture_output=True)
+        newkey = ["-newkey", "rsa:2048", "-noenc", "-keyout", "-"]
 
-    # Sign certificate (self-signed for MVP, would use CA in production)
-    expires_at = datetime.utcnow() + timedelta(days=90)
+    # Generate the key and sign the certificate with the issuing CA in one
+    # openssl call; key and certificate come back on stdout, no temp files
+    serial = new_serial()
     cert_cmd = [
-        "openssl", "x509", "-req",
-        "-in", str(csr_file),
-        "-signkey", str(key_file),
-        "-out", str(cert_file),
-        "-days", "90",
-        "-extfile", "-"
+        "openssl", "req", "-x509", "-new",
+        *newkey,
+        "-out", "-",
+        "-CA", str(ca.cert_file),
+        "-CAkey", str(ca.key_file),
+        "-set_serial", f"0x{serial}",
+        "-days", str(CERT_VALIDITY.days),
+        "-subj", f"/CN={domains[0]}",
+        # SAN and revocation-status (OCSP, base + delta CRL) extensions
+        "-addext", "basicConstraints=CA:FALSE",
+        "-addext", "subjectAltName=" + ",".join(f"DNS:{d}" for d in domains),
+        "-addext", f"authorityInfoAccess=OCSP;URI:{OCSP_URL}",
+        "-addext", f"crlDistributionPoints=URI:{BASE_CRL_URL}",
+        "-addext", f"freshestCRL=URI:{DELTA_CRL_URL}",
     ]
+    # Key generation and signing take a while; keep the event loop free
+    if key_pem is not None:
+        result = await asyncio.to_thread(subprocess.run, cert_cmd, input=key_pem,
+                                         check=True, capture_output=True)
+        cert_pem = result.stdout
+    else:
+        result = await asyncio.to_thread(subprocess.run, cert_cmd, check=True, capture_output=True)
+        key_pem, cert_pem = split_key_and_cert(result.stdout)
 
-    # Add SAN extension
-    san_config = f"subjectAltName=DNS:{domain}"
-    subprocess.run(cert_cmd, input=san_config.encode(), check=True, capture_output=True)
-
-    # Create chain and fullchain (placeholder for now)
-    chain_file.write_text("")  # Would contain intermediate certs
-    fullchain_content = cert_file.read_text()
-    fullchain_file.write_text(fullchain_content)
+    return await store_certificate(cert_id, serial, domains, algorithm, cert_pem, key_pem,
+                                   key_created_at)
 
-    # Clean up CSR
-    csr_file.unlink()
 
-    # Store metadata
+async def store_certificate(cert_id: str, serial: str, domains: list, algorithm: str,
+                            cert_pem: bytes, key_pem: bytes | None = None,
+                            key_created_at: str | None = None) -> dict:
+    """Store an issued certificate (and its key, if we generated it), index it
+    and queue it for the transparency log"""
+    certificate = x509.load_pem_x509_certificate(cert_pem)
     metadata = {
-        "domain": domain,
+        "domain": domains[0],
+        "domains": domains,
         "algorithm": algorithm,
+        "serial": serial,
+        "client_key": key_pem is None,
         "issued_at": datetime.utcnow().isoformat(),
-        "expires_at": expires_at.isoformat()
+        "expires_at": certificate.not_valid_after_utc.replace(tzinfo=None).isoformat()
+    }
+    if key_pem is not None:
+        metadata["key_created_at"] = key_created_at or metadata["issued_at"]
+
+    # Key, certificate, chain, fullchain, their compressed variants and
+    # metadata are stored together
+    artifacts = {
+        "cert.pem": cert_pem,
+        "chain.pem": ca.cert_pem,
+        "fullchain.pem": cert_pem + ca.cert_pem,
     }
-    (cert_dir / "metadata.json").write_text(json.dumps(metadata))
+    if key_pem is not None:
+        artifacts["key.pem"] = key_pem
+    variants = compressed_variants(artifacts)
+    metadata["compressed"] = sorted(variants)
+    artifacts.update(variants)
+    artifacts["metadata.json"] = json.dumps(metadata).encode()
+    await storage.put_artifacts(cert_id, artifacts)
+    await storage.put(f"serials/{serial}", cert_id.encode(), "text/plain")
+
+    CERT_INDEX[serial] = {"cert_id": cert_id, "expires_at": metadata["expires_at"]}
+    transparency.submit(serial, metadata["issued_at"],
+                        certificate.public_bytes(serialization.Encoding.DER))
 
     return metadata
 
 
+async def reusable_key(previous_id: str | None, domain: str, algorithm: str,
+                       max_age_days: int | None) -> tuple:
+    """(key_pem, key_created_at) of an earlier certificate that may be renewed with
+    the same key, or (None, None). Revoked certificates never pass their key on."""
+    metadata = await read_metadata(previous_id) if previous_id else None
+    if (metadata is None or metadata.get("client_key") or metadata.get("revoked_at")
+            or metadata["domain"] != domain or metadata["algorithm"] != algorithm):
+        return None, None
+
+    max_age = MAX_KEY_AGE
+    if max_age_days is not None:
+        max_age = min(max_age, timedelta(days=max_age_days))
+    created = metadata.get("key_created_at") or metadata["issued_at"]
+    if datetime.utcnow() - datetime.fromisoformat(created) > max_age:
+        return None, None
+
+    key_pem = await storage.get_artifact(previous_id, "key.pem")
+    return (key_pem, created) if key_pem else (None, None)
+
+
+def issuance_key(account_id: str | None, domains: list, algorithm: str,
+                 reuse_key_from: str | None) -> str | None:
+    """Dedup key for an issuance; None when dedup doesn't apply (off, or no account)"""
+    if not account_id or DEDUP_WINDOW <= timedelta(0):
+        return None
+    names = ",".join(sorted(d.lower() for d in domains))
+    return f"{account_id}:{algorithm}:{names}:{reuse_key_from or ''}"
+
+
+async def recent_certificate(dedup_key: str) -> tuple[str, dict] | None:
+    """(cert_id, metadata) of the certificate recorded under dedup_key, if still good to hand out"""
+    cert_id = await recent_issuance.get(dedup_key)
+    if cert_id is None:
+        return None
+    cert_id = cert_id.decode()
+    metadata = await read_metadata(cert_id)
+    if (metadata is None or metadata.get("revoked_at")
+            or datetime.fromisoformat(metadata["expires_at"]) - datetime.utcnow() < DEDUP_MIN_REMAINING):
+        issuance_stats["stale"] += 1
+        await recent_issuance.delete(dedup_key)
+        return None
+    return cert_id, metadata
+
+
+def new_serial() -> str:
+    """Random positive 128-bit serial, lowercase hex"""
+    return format(secrets.randbits(128) | (1 << 127), "x")
+
+
+def split_key_and_cert(output: bytes) -> tuple[bytes, bytes]:
+    """Split openssl's "key then certificate" PEM output"""
+    marker = output.find(b"-----BEGIN CERTIFICATE-----")
+    if marker <= 0:
+        raise RuntimeError("openssl did not return a key and certificate")
+    return output[:marker], output[marker:]
+
+
 # ============== Run Server ==============
 
 if __name__ == "__main__":
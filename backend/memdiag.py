@@ -0,0 +1,142 @@
+"""
+PQCert - Memory Diagnostics
+Opt-in (PQCERT_MEMDIAG=1) tracemalloc snapshots for finding what makes the
+API's memory grow: top allocation sites by size, and by growth since the
+previous snapshot, so two snapshots taken minutes apart under load point at
+the lines that keep allocating. Alongside: RSS, open file descriptors by
+kind and live asyncio tasks by coroutine.
+
+tracemalloc slows allocations down and uses memory of its own (more with
+deeper PQCERT_MEMDIAG_FRAMES), so it only runs when enabled.
+"""
+
+import asyncio
+import gc
+import os
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+# Allocations of the tracer itself and of the import machinery are noise
+IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def _stat(stat, key_type: str) -> dict:
+    frames = stat.traceback if key_type == "traceback" else stat.traceback[:1]
+    return {
+        "size_kb": round(stat.size / 1024, 1),
+        "count": stat.count,
+        "where": [f"{frame.filename}:{frame.lineno}" for frame in frames],
+    }
+
+
+def _diff(stat, key_type: str) -> dict:
+    return {**_stat(stat, key_type),
+            "size_diff_kb": round(stat.size_diff / 1024, 1), "count_diff": stat.count_diff}
+
+
+def process_memory() -> dict:
+    """RSS and its high-water mark from /proc (empty elsewhere)"""
+    info = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "VmHWM"):
+                    info[name.lower() + "_kb"] = int(value.split()[0])
+    except OSError:
+        pass
+    return info
+
+
+def open_files(limit: int = 20) -> dict | None:
+    """Open descriptors by kind, and the most frequent targets"""
+    try:
+        fds = os.listdir("/proc/self/fd")
+    except OSError:
+        return None
+    kinds, targets = Counter(), Counter()
+    for fd in fds:
+        try:
+            target = os.readlink(f"/proc/self/fd/{fd}")
+        except OSError:
+            continue  # closed meanwhile (including listdir's own)
+        kind = target.split(":", 1)[0] if target.startswith(("socket:", "pipe:", "anon_inode:")) else "file"
+        kinds[kind] += 1
+        if kind == "file" or kind == "anon_inode":
+            targets[target] += 1
+    return {"total": sum(kinds.values()), "by_kind": dict(kinds), "top_targets": targets.most_common(limit)}
+
+
+def live_tasks(limit: int = 20) -> dict:
+    """asyncio tasks of the running loop, grouped by coroutine and where it is suspended"""
+    groups = Counter()
+    tasks = asyncio.all_tasks()
+    for task in tasks:
+        coro = task.get_coro()
+        name = getattr(coro, "__qualname__", type(coro).__name__)
+        stack = task.get_stack(limit=1)
+        where = f" @ {os.path.basename(stack[0].f_code.co_filename)}:{stack[0].f_lineno}" if stack else ""
+        groups[name + where] += 1
+    return {"total": len(tasks), "top": groups.most_common(limit)}
+
+
+class MemoryDiagnostics:
+
+    def __init__(self, frames: int = 10):
+        self.frames = frames
+        self.previous = None
+        self.previous_at = None
+        self.lock = threading.Lock()
+        tracemalloc.start(frames)
+
+    def snapshot(self, limit: int = 25, key_type: str = "lineno") -> dict:
+        """Top allocation sites now, and growth since the previous call"""
+        with self.lock:
+            return self._snapshot(limit, key_type)
+
+    def _snapshot(self, limit: int, key_type: str) -> dict:
+        snapshot = tracemalloc.take_snapshot().filter_traces(IGNORED)
+        current, peak = tracemalloc.get_traced_memory()
+        result = {
+            "taken_at": datetime.utcnow().isoformat(),
+            "traced_kb": round(current / 1024, 1),
+            "traced_peak_kb": round(peak / 1024, 1),
+            "tracemalloc_overhead_kb": round(tracemalloc.get_tracemalloc_memory() / 1024, 1),
+            "top_by_size": [_stat(s, key_type) for s in snapshot.statistics(key_type)[:limit]],
+        }
+        if self.previous is not None:
+            growth = [s for s in snapshot.compare_to(self.previous, key_type) if s.size_diff > 0]
+            result["previous_at"] = self.previous_at
+            result["top_by_growth"] = [_diff(s, key_type) for s in growth[:limit]]
+        self.previous = snapshot
+        self.previous_at = result["taken_at"]
+        return result
+
+    def reset(self):
+        """Forget the baseline; the next snapshot starts a new comparison"""
+        with self.lock:
+            self.previous = None
+            self.previous_at = None
+
+
+def summary() -> dict:
+    return {
+        "process": process_memory(),
+        "open_files": open_files(),
+        "tasks": live_tasks(),
+        "gc_counts": gc.get_count(),
+    }
+
+
+def create_memory_diagnostics() -> MemoryDiagnostics | None:
+    """Start tracing if PQCERT_MEMDIAG is set, else None"""
+    if os.environ.get("PQCERT_MEMDIAG", "").lower() in ("", "0", "false", "no", "off"):
+        return None
+    return MemoryDiagnostics(frames=int(os.environ.get("PQCERT_MEMDIAG_FRAMES", "10")))
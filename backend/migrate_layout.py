@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+PQCert - Storage Layout Migration
+Moves a flat local tree (certs/<id>.pack, challenges/<id>.json, serials/,
+public/<id>/) into the sharded layout, e.g. certs/3f/a2/<id>.pack.
+
+Safe to run while the API serves from the same tree: the API already
+writes sharded paths and reads the flat ones as a fallback. Each file is
+hard-linked to its new path and then unlinked, so it is reachable at every
+moment and a newer copy the API wrote in the meantime is never replaced
+(the flat one is simply dropped). Re-running it is harmless.
+
+Run: python3 migrate_layout.py [--data-dir /var/lib/pqcert] [--dry-run] [--rate 500]
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+from storage import SHARDED_NAMESPACES, shard_key
+
+
+def migrate_file(src: Path, dst: Path) -> str:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        # The API wrote this key since sharding; the flat copy is older
+        src.unlink(missing_ok=True)
+        return "stale"
+    except FileNotFoundError:
+        return "gone"  # deleted (or moved) meanwhile
+    src.unlink(missing_ok=True)
+    return "moved"
+
+
+def migrate_dir(src: Path, dst: Path, counts: Counter):
+    """Pre-pack certificate directories and public/<id>/: move file by file"""
+    for entry in os.scandir(src):
+        if entry.is_file(follow_symlinks=False) and not entry.name.endswith(".tmp"):
+            counts[migrate_file(Path(entry.path), dst / entry.name)] += 1
+    try:
+        src.rmdir()
+    except OSError:
+        pass  # something was written into it meanwhile; the next run picks it up
+
+
+def migrate(root: Path, dry_run: bool = False, rate: float = 0) -> Counter:
+    counts = Counter()
+    for namespace in SHARDED_NAMESPACES:
+        top = root / namespace
+        if not top.is_dir():
+            continue
+        with os.scandir(top) as entries:
+            for entry in entries:
+                key = f"{namespace}/{entry.name}"
+                if shard_key(key) == key or entry.name.endswith(".tmp"):
+                    continue  # a shard directory, or not ours
+                dst = root / shard_key(key)
+                if dry_run:
+                    counts["would move"] += 1
+                elif entry.is_dir(follow_symlinks=False):
+                    migrate_dir(Path(entry.path), dst, counts)
+                else:
+                    counts[migrate_file(Path(entry.path), dst)] += 1
+
+                done = sum(counts.values())
+                if done % 10000 == 0:
+                    print(f"[migrate] {done} entries: {dict(counts)}", file=sys.stderr)
+                if rate > 0:
+                    time.sleep(1 / rate)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move a flat PQCert data directory to the sharded layout")
+    parser.add_argument("--data-dir", default=os.environ.get("PQCERT_DATA_DIR", "/var/lib/pqcert"))
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would be moved")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="At most this many entries per second (0 = no limit), to spare the disk")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    counts = migrate(Path(args.data_dir), args.dry_run, args.rate)
+    print(f"[migrate] done in {time.monotonic() - started:.1f}s: {dict(counts) or 'nothing to move'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+PQCert - OCSP Responder
+Serves pre-signed OCSP responses (RFC 6960, RFC 5019 profile) from a cache.
+A background worker re-signs responses for every active certificate well
+before they go stale, so answering a query is a cache lookup, not a signature.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.x509 import ocsp
+
+logger = logging.getLogger("pqcert.ocsp")
+
+# SHA-1 CertIDs are what nginx/OpenSSL stapling and browsers send (RFC 5019)
+CERT_ID_HASHES = {
+    "sha1": hashes.SHA1(),
+    "sha256": hashes.SHA256(),
+}
+
+REVOCATION_REASONS = {flag.value: flag for flag in x509.ReasonFlags}
+
+
+def _spki_bits(public_key) -> bytes:
+    """The subjectPublicKey BIT STRING contents (what issuerKeyHash is computed over)"""
+    der = public_key.public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+    def read_tlv(data, pos):
+        tag = data[pos]
+        length = data[pos + 1]
+        pos += 2
+        if length & 0x80:
+            n = length & 0x7F
+            length = int.from_bytes(data[pos:pos + n], "big")
+            pos += n
+        return tag, data[pos:pos + length], pos + length
+
+    _, spki, _ = read_tlv(der, 0)
+    _, _, pos = read_tlv(spki, 0)          # AlgorithmIdentifier
+    _, bits, _ = read_tlv(spki, pos)       # BIT STRING
+    return bits[1:]                        # drop the unused-bits byte
+
+
+def _digest(algorithm, data: bytes) -> bytes:
+    h = hashes.Hash(algorithm)
+    h.update(data)
+    return h.finalize()
+
+
+class OCSPResponder:
+    """
+    lookup(serial) is a coroutine returning a record for an issued certificate, or None:
+        {"cert_pem": bytes, "expires_at": str, "revoked_at": str|None,
+         "revocation_reason": str|None}
+    active_serials() lists serials of certificates that haven't expired.
+    Serials are lowercase hex strings.
+    """
+
+    def __init__(self, ca, lookup, active_serials, cache,
+                 validity=timedelta(days=4), refresh_before=timedelta(days=2),
+                 interval: int = 300):
+        self.ca = ca
+        self.lookup = lookup
+        self.active_serials = active_serials
+        self.cache = cache
+        self.validity = validity
+        self.refresh_before = refresh_before
+        self.interval = interval
+        self.next_update = {}
+        self.stats = {"hits": 0, "misses": 0, "signed": 0}
+
+        issuer_bits = _spki_bits(ca.cert.public_key())
+        self.issuer_key_hashes = {
+            name: _digest(algorithm, issuer_bits) for name, algorithm in CERT_ID_HASHES.items()
+        }
+        self.unauthorized = ocsp.OCSPResponseBuilder.build_unsuccessful(
+            ocsp.OCSPResponseStatus.UNAUTHORIZED).public_bytes(serialization.Encoding.DER)
+        self.malformed = ocsp.OCSPResponseBuilder.build_unsuccessful(
+            ocsp.OCSPResponseStatus.MALFORMED_REQUEST).public_bytes(serialization.Encoding.DER)
+
+    # ---- signing (CPU-bound, runs in a worker thread) ----
+
+    def sign(self, record: dict, hash_name: str = "sha1") -> tuple:
+        """Build and sign a response; returns (der_bytes, next_update)"""
+        cert = x509.load_pem_x509_certificate(record["cert_pem"])
+        now = datetime.utcnow()
+        next_update = now + self.validity
+
+        if record.get("revoked_at"):
+            status = ocsp.OCSPCertStatus.REVOKED
+            revoked_at = datetime.fromisoformat(record["revoked_at"])
+            reason = REVOCATION_REASONS.get(record.get("revocation_reason") or "unspecified")
+        else:
+            status = ocsp.OCSPCertStatus.GOOD
+            revoked_at = reason = None
+
+        response = (
+            ocsp.OCSPResponseBuilder()
+            .add_response(
+                cert=cert,
+                issuer=self.ca.cert,
+                algorithm=CERT_ID_HASHES[hash_name],
+                cert_status=status,
+                this_update=now,
+                next_update=next_update,
+                revocation_time=revoked_at,
+                revocation_reason=reason,
+            )
+            .responder_id(ocsp.OCSPResponderEncoding.HASH, self.ca.cert)
+            .sign(self.ca.key, hashes.SHA256())
+        )
+        self.stats["signed"] += 1
+        return response.public_bytes(serialization.Encoding.DER), next_update
+
+    # ---- cache ----
+
+    @staticmethod
+    def _cache_key(serial: str, hash_name: str) -> str:
+        return serial if hash_name == "sha1" else f"{serial}:{hash_name}"
+
+    async def _store(self, serial: str, hash_name: str, der: bytes, next_update: datetime):
+        ttl = (next_update - datetime.utcnow()).total_seconds()
+        await self.cache.set(self._cache_key(serial, hash_name), der, int(ttl))
+        if hash_name == "sha1":
+            self.next_update[serial] = next_update
+
+    async def response_for(self, serial: str, hash_name: str = "sha1") -> bytes | None:
+        """Cached response for serial, signing once on a miss; None if unknown"""
+        cached = await self.cache.get(self._cache_key(serial, hash_name))
+        if cached is not None:
+            self.stats["hits"] += 1
+            return cached
+
+        self.stats["misses"] += 1
+        record = await self.lookup(serial)
+        if record is None:
+            return None
+        der, next_update = await asyncio.to_thread(self.sign, record, hash_name)
+        await self._store(serial, hash_name, der, next_update)
+        return der
+
+    async def invalidate(self, serial: str):
+        """Drop cached responses for serial (e.g. after revocation) and re-sign"""
+        for hash_name in CERT_ID_HASHES:
+            await self.cache.delete(self._cache_key(serial, hash_name))
+        self.next_update.pop(serial, None)
+        await self.response_for(serial)
+
+    # ---- protocol ----
+
+    async def respond(self, request_der: bytes) -> bytes:
+        """Answer a DER-encoded OCSP request"""
+        try:
+            request = ocsp.load_der_ocsp_request(request_der)
+        except (ValueError, NotImplementedError):
+            # cryptography refuses requests listing more than one certificate;
+            # RFC 5019 clients send one, so treat the rest as malformed
+            return self.malformed
+
+        hash_name = request.hash_algorithm.name
+        if self.issuer_key_hashes.get(hash_name) != request.issuer_key_hash:
+            return self.unauthorized
+
+        der = await self.response_for(format(request.serial_number, "x"), hash_name)
+        return der if der is not None else self.unauthorized
+
+    async def prefetch(self, serials) -> dict:
+        """Responses for many serials at once (for stapling servers); unknown ones omitted"""
+        serials = [s.lower() for s in serials]
+        found = await self.cache.get_many(serials)
+        for serial in serials:
+            if serial not in found:
+                der = await self.response_for(serial)
+                if der is not None:
+                    found[serial] = der
+        return found
+
+    # ---- background pre-signing ----
+
+    async def refresh(self) -> int:
+        """Re-sign every active certificate whose cached response is due; returns count"""
+        due_before = datetime.utcnow() + self.refresh_before
+        signed = 0
+        for serial in self.active_serials():
+            next_update = self.next_update.get(serial)
+            if next_update is not None and next_update > due_before:
+                continue
+            record = await self.lookup(serial)
+            if record is None:
+                continue
+            der, next_update = await asyncio.to_thread(self.sign, record)
+            await self._store(serial, "sha1", der, next_update)
+            signed += 1
+        return signed
+
+    async def run(self):
+        """Background worker: keep responses for all active certificates fresh"""
+        while True:
+            try:
+                signed = await self.refresh()
+                if signed:
+                    logger.info("pre-signed %d OCSP responses", signed)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("OCSP pre-signing failed")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,246 @@
+"""
+PQCert - Request Profiling
+Opt-in (PQCERT_PROFILE=1) sampling profiler for slow API calls.
+
+While a request is in flight, a background thread samples its stack every
+few milliseconds. For an async request that is the chain of coroutines it
+is awaiting in, extended with the event loop thread's real stack while the
+request is actually running (CPU work, or a blocking call that holds up
+the loop). Work the request waits on through shield(), such as a
+single-flight issuance in its own task, is followed into that task.
+Requests slower than a threshold, plus an optional random sample, are
+written as collapsed stacks (flamegraph.pl / speedscope format) to a
+bounded ring buffer on disk.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger("pqcert.profiling")
+
+# Task waiting in shield() -> the task it is waiting for
+_shielded = weakref.WeakKeyDictionary()
+
+
+async def shield(task: asyncio.Task):
+    """await asyncio.shield(task), with the sampler following the caller into task"""
+    waiter = asyncio.current_task()
+    _shielded[waiter] = task
+    try:
+        return await asyncio.shield(task)
+    finally:
+        _shielded.pop(waiter, None)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _coroutine_frames(task) -> list:
+    """Frames of task and everything it is awaiting, outermost first"""
+    frames = []
+    while task is not None:
+        coro = task.get_coro()
+        while coro is not None:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) \
+                or getattr(coro, "ag_frame", None)
+            if frame is None:
+                break
+            frames.append(frame)
+            coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) \
+                or getattr(coro, "ag_await", None)
+        task = _shielded.get(task)
+    return frames
+
+
+def _thread_frames(thread_id: int) -> list:
+    frame = sys._current_frames().get(thread_id)
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+class _Profile:
+    __slots__ = ("task", "stacks", "samples")
+
+    def __init__(self, task):
+        self.task = task
+        self.stacks = Counter()
+        self.samples = 0
+
+
+class RequestProfiler:
+
+    def __init__(self, out_dir: Path, slow_ms: float = 1000, sample_rate: float = 0.0,
+                 interval_ms: float = 5, keep: int = 200):
+        self.out_dir = out_dir
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.keep = keep
+        self.active = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.loop_thread = None
+        self.sampler = None
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+    # ---- sampling (background thread) ----
+
+    def _sample(self):
+        with self.lock:
+            profiles = list(self.active.values())
+        running = _thread_frames(self.loop_thread)
+        for profile in profiles:
+            frames = _coroutine_frames(profile.task)
+            if not frames:
+                continue
+            stack = [_frame_label(f) for f in frames]
+            # If the request is on the CPU right now, its innermost coroutine
+            # frame is on the loop thread's stack; add what runs below it
+            innermost = frames[-1]
+            for i, frame in enumerate(running):
+                if frame is innermost:
+                    stack += [_frame_label(f) for f in running[i + 1:]]
+                    break
+            else:
+                stack.append("(waiting)")
+            profile.stacks[";".join(stack)] += 1
+            profile.samples += 1
+
+    def _run(self):
+        while True:
+            if not self.active:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            try:
+                self._sample()
+            except Exception:
+                logger.exception("profiler sample failed")
+            time.sleep(self.interval)
+
+    # ---- per request ----
+
+    def start(self) -> _Profile:
+        """Begin sampling the current request (call from the request's task)"""
+        if self.sampler is None:
+            self.loop_thread = threading.get_ident()
+            self.sampler = threading.Thread(target=self._run, name="pqcert-profiler", daemon=True)
+            self.sampler.start()
+        profile = _Profile(asyncio.current_task())
+        with self.lock:
+            self.active[id(profile)] = profile
+        self.wakeup.set()
+        return profile
+
+    def finish(self, profile: _Profile, scope: dict, status: int, duration_ms: float):
+        with self.lock:
+            self.active.pop(id(profile), None)
+        if duration_ms >= self.slow_ms:
+            reason = "slow"
+        elif random.random() < self.sample_rate:
+            reason = "sampled"
+        else:
+            return
+        self._save({
+            "id": f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}",
+            "reason": reason,
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status,
+            "duration_ms": round(duration_ms, 1),
+            "samples": profile.samples,
+            "interval_ms": self.interval * 1000,
+            "recorded_at": datetime.utcnow().isoformat(),
+            "stacks": "\n".join(f"{stack} {count}" for stack, count in profile.stacks.most_common()),
+        })
+
+    # ---- ring buffer ----
+
+    def _save(self, record: dict):
+        path = self.out_dir / f"{record['id']}.json"
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(record))
+        os.replace(tmp, path)
+        for old in sorted(self.out_dir.glob("*.json"))[:-self.keep]:
+            old.unlink(missing_ok=True)
+
+    def recent(self, limit: int = 50) -> list:
+        """Newest profiles first, without their stacks"""
+        records = []
+        for path in sorted(self.out_dir.glob("*.json"), reverse=True)[:limit]:
+            try:
+                record = json.loads(path.read_text())
+            except (FileNotFoundError, ValueError):
+                continue  # rotated out or being written
+            record.pop("stacks")
+            records.append(record)
+        return records
+
+    def get(self, profile_id: str) -> dict | None:
+        path = self.out_dir / f"{profile_id}.json"
+        if path.parent != self.out_dir or not path.exists():
+            return None
+        return json.loads(path.read_text())
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware, so the endpoint runs in the same task that
+    start() records (BaseHTTPMiddleware would move it to another task)
+    """
+
+    def __init__(self, app, profiler: RequestProfiler, skip_prefixes=("/admin", "/health")):
+        self.app = app
+        self.profiler = profiler
+        self.skip_prefixes = skip_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.skip_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        profile = self.profiler.start()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            self.profiler.finish(profile, scope, status, duration_ms)
+
+
+def create_profiler(data_dir: Path) -> RequestProfiler | None:
+    """A profiler if PQCERT_PROFILE is set, else None"""
+    if os.environ.get("PQCERT_PROFILE", "").lower() in ("", "0", "false", "no", "off"):
+        return None
+    return RequestProfiler(
+        data_dir / "profiles",
+        slow_ms=float(os.environ.get("PQCERT_PROFILE_SLOW_MS", "1000")),
+        sample_rate=float(os.environ.get("PQCERT_PROFILE_SAMPLE_RATE", "0")),
+        interval_ms=float(os.environ.get("PQCERT_PROFILE_INTERVAL_MS", "5")),
+        keep=int(os.environ.get("PQCERT_PROFILE_KEEP", "200")),
+    )
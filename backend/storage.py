@@ -0,0 +1,469 @@
+"""
+PQCert - Artifact Storage
+Where certificate artifacts and pending challenges live. The local backend
+keeps them under PQCERT_DATA_DIR; the S3 backend puts them in an
+S3-compatible bucket (AWS, MinIO, ...) so every API replica sees the same
+objects and downloads can be redirected straight to the object store.
+
+Keys are "/"-separated paths such as "challenges/<id>.json". Certificate
+artifacts go through put_artifacts/get_artifact: locally they are packed
+into one file per certificate, in S3 they stay one object each.
+
+Locally, the per-id namespaces (certs/, challenges/, serials/, public/)
+fan out by the first characters of the id, e.g. certs/3f/a2/3fa2....pack,
+so no directory grows to millions of entries. Trees written before that
+still work: reads fall back to the flat path, writes go to the sharded
+one, and migrate_layout.py moves the rest over while the API runs.
+
+With export_public, LocalStorage also writes the public artifacts (and
+their compressed variants) as plain files under public/<id>/ so a
+front-end web server can send them itself (X-Accel-Redirect); private keys
+are never exported there.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import struct
+import tempfile
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+import httpx
+
+from compression import SUFFIXES
+
+S3_NS = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+
+
+# Packed certificate file: magic, u32 header length, JSON header
+# {"name": [offset, length], ...}, then the artifacts. Offsets are relative
+# to the end of the header.
+PACK_MAGIC = b"PQCPACK1"
+PACK_HEAD = 4096  # first read; covers the header of any normal pack
+
+PUBLIC_ARTIFACTS = ("cert.pem", "chain.pem", "fullchain.pem")
+
+
+def content_encoding(name: str) -> str | None:
+    """Content-Encoding of a stored compressed variant ("cert.pem.gz" -> "gzip")"""
+    for encoding, suffix in SUFFIXES.items():
+        if name.endswith(suffix):
+            return encoding
+    return None
+
+
+def is_public(name: str) -> bool:
+    encoding = content_encoding(name)
+    return (name[:-len(SUFFIXES[encoding])] if encoding else name) in PUBLIC_ARTIFACTS
+
+
+def pack_artifacts(artifacts: dict) -> bytes:
+    index, offset = {}, 0
+    for name, data in artifacts.items():
+        index[name] = [offset, len(data)]
+        offset += len(data)
+    header = json.dumps(index, separators=(",", ":")).encode()
+    return PACK_MAGIC + struct.pack(">I", len(header)) + header + b"".join(artifacts.values())
+
+
+def parse_pack_header(head: bytes) -> tuple[dict | None, int]:
+    """(index, header_end) from the start of a pack; index is None if head is too short"""
+    if head[:len(PACK_MAGIC)] != PACK_MAGIC:
+        raise ValueError("Not a certificate pack")
+    start = len(PACK_MAGIC) + 4
+    (size,) = struct.unpack(">I", head[len(PACK_MAGIC):start])
+    if start + size > len(head):
+        return None, start + size
+    return json.loads(head[start:start + size]), start + size
+
+
+def read_pack_index(fd: int) -> dict:
+    """{"name": (absolute offset, length)} from an open pack file"""
+    index, end = parse_pack_header(os.pread(fd, PACK_HEAD, 0))
+    if index is None:
+        index, end = parse_pack_header(os.pread(fd, end, 0))
+    return {name: (end + offset, length) for name, (offset, length) in index.items()}
+
+
+SHARDED_NAMESPACES = ("certs", "challenges", "serials", "public")
+
+
+def shard_key(key: str) -> str:
+    """"certs/<id>..." -> "certs/<id[:2]>/<id[2:4]>/<id>..." for the sharded namespaces"""
+    namespace, _, rest = key.partition("/")
+    if namespace not in SHARDED_NAMESPACES or len(rest) < 5:
+        return key
+    return f"{namespace}/{rest[:2]}/{rest[2:4]}/{rest}"
+
+
+def unshard_key(key: str) -> str:
+    """Inverse of shard_key; flat keys are returned unchanged"""
+    parts = key.split("/")
+    if (parts[0] in SHARDED_NAMESPACES and len(parts) > 3 and len(parts[1]) == 2
+            and len(parts[2]) == 2 and parts[3].startswith(parts[1] + parts[2])):
+        return "/".join([parts[0]] + parts[3:])
+    return key
+
+
+def _query_string(items) -> str:
+    """Query string with SigV4 encoding (RFC 3986 unreserved characters only)"""
+    return "&".join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in items)
+
+
+class LocalStorage:
+    """Objects are files under root; writes are atomic (temp file + rename)"""
+
+    def __init__(self, root: Path, export_public: bool = False):
+        self.root = root
+        self.export_public = export_public
+
+    def _resolve(self, relative: str) -> Path:
+        path = (self.root / relative).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f"Invalid storage key: {relative}")
+        return path
+
+    def local_path(self, key: str) -> Path:
+        """Where key is written (the sharded path)"""
+        return self._resolve(shard_key(key))
+
+    def flat_path(self, key: str) -> Path:
+        """Where key was written before sharding"""
+        return self._resolve(key)
+
+    def _existing(self, key: str, fn):
+        """
+        fn(path) on the sharded path of key, else on its flat path;
+        FileNotFoundError if neither exists
+        """
+        sharded = self.local_path(key)
+        try:
+            return fn(sharded)
+        except FileNotFoundError:
+            flat = self.flat_path(key)
+            if flat == sharded:
+                raise
+        try:
+            return fn(flat)
+        except FileNotFoundError:
+            # Moved by migrate_layout.py between the two attempts
+            return fn(sharded)
+
+    def _put(self, key: str, data: bytes, mode: int):
+        path = self.local_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Unique per writer: concurrent puts of one key must not share a temp file
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                os.fchmod(f.fileno(), mode)
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        if shard_key(key) != key:
+            # A pre-sharding copy is stale now
+            self.flat_path(key).unlink(missing_ok=True)
+
+    async def put(self, key: str, data: bytes, content_type: str = "application/octet-stream",
+                  private: bool = False):
+        await asyncio.to_thread(self._put, key, data, 0o600 if private else 0o644)
+
+    async def get(self, key: str) -> bytes | None:
+        try:
+            return await asyncio.to_thread(self._existing, key, Path.read_bytes)
+        except FileNotFoundError:
+            return None
+
+    def _delete(self, key: str):
+        # Flat copy first: a concurrent migrate_layout.py either linked it to
+        # the sharded path already (removed next) or finds it gone. The other
+        # order lets the migration link it back after the sharded unlink.
+        self.flat_path(key).unlink(missing_ok=True)
+        self.local_path(key).unlink(missing_ok=True)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._delete, key)
+
+    async def list_keys(self, prefix: str) -> list[str]:
+        """Keys starting with prefix"""
+        def walk():
+            top = self.root / prefix.rpartition("/")[0]
+            if not top.is_dir():
+                return []
+            keys = []
+            for dirpath, _, filenames in os.walk(top):
+                for name in filenames:
+                    key = unshard_key(Path(dirpath, name).relative_to(self.root).as_posix())
+                    if key.startswith(prefix) and not name.endswith(".tmp"):
+                        keys.append(key)
+            # A key can show up in both layouts mid-migration
+            return list(dict.fromkeys(keys))
+
+        return await asyncio.to_thread(walk)
+
+    def download_url(self, key: str, filename: str) -> str | None:
+        """Local objects are served by the API itself"""
+        return None
+
+    async def close(self):
+        pass
+
+    # ---- certificate artifacts: certs/<id>.pack ----
+
+    async def put_artifacts(self, cert_id: str, artifacts: dict):
+        """Write all artifacts of a certificate as one pack file (one inode, one rename)"""
+        await asyncio.to_thread(self._put, f"certs/{cert_id}.pack", pack_artifacts(artifacts), 0o600)
+        if self.export_public:
+            for name, data in artifacts.items():
+                if is_public(name):
+                    await asyncio.to_thread(self._put, f"public/{cert_id}/{name}", data, 0o644)
+
+    def public_file(self, cert_id: str, name: str) -> str | None:
+        """Path of the exported artifact relative to public/, or None"""
+        if not self.export_public or not is_public(name):
+            return None
+        def found(path):
+            path.stat()
+            return path
+
+        try:
+            path = self._existing(f"public/{cert_id}/{name}", found)
+        except FileNotFoundError:
+            return None
+        return path.relative_to(self.root.resolve() / "public").as_posix()
+
+    def _read_artifacts(self, cert_id: str) -> dict | None:
+        try:
+            data = self._existing(f"certs/{cert_id}.pack", Path.read_bytes)
+        except FileNotFoundError:
+            return None
+        index, end = parse_pack_header(data)
+        return {name: data[end + offset:end + offset + length] for name, (offset, length) in index.items()}
+
+    async def get_artifact(self, cert_id: str, name: str) -> bytes | None:
+        artifacts = await asyncio.to_thread(self._read_artifacts, cert_id)
+        if artifacts is None:
+            # Certificates issued before packing: one file per artifact
+            return await self.get(f"certs/{cert_id}/{name}")
+        return artifacts.get(name)
+
+    async def set_artifact(self, cert_id: str, name: str, data: bytes):
+        """Replace one artifact (e.g. metadata after revocation) by rewriting the pack"""
+        artifacts = await asyncio.to_thread(self._read_artifacts, cert_id)
+        if artifacts is None:
+            await self.put(f"certs/{cert_id}/{name}", data)
+            return
+        artifacts[name] = data
+        await self.put_artifacts(cert_id, artifacts)
+
+    def artifact_range(self, cert_id: str, name: str) -> tuple | None:
+        """(path, offset, length) of an artifact, for serving it straight from the file"""
+        try:
+            path, fd = self._existing(f"certs/{cert_id}.pack", lambda p: (p, os.open(p, os.O_RDONLY)))
+        except FileNotFoundError:
+            try:
+                return self._existing(f"certs/{cert_id}/{name}", lambda p: (p, 0, p.stat().st_size))
+            except FileNotFoundError:
+                return None
+        try:
+            entry = read_pack_index(fd).get(name)
+        finally:
+            os.close(fd)
+        return (path, *entry) if entry else None
+
+    async def certificate_ids(self) -> list[str]:
+        ids = set()
+        for key in await self.list_keys("certs/"):
+            name = key[len("certs/"):]
+            if name.endswith(".pack") and "/" not in name:
+                ids.add(name[:-len(".pack")])
+            elif name.endswith("/metadata.json"):
+                ids.add(name.split("/")[0])
+        return sorted(ids)
+
+
+class S3Storage:
+    """
+    S3-compatible bucket using path-style requests signed with AWS
+    Signature V4. All requests share one pooled keep-alive client.
+
+    public_endpoint is the address clients use for redirected downloads
+    (presigned URLs are bound to the host they were signed for); it
+    defaults to endpoint.
+    """
+
+    def __init__(self, endpoint: str, bucket: str, access_key: str, secret_key: str,
+                 region: str = "us-east-1", public_endpoint: str | None = None,
+                 presign_ttl: int = 300, max_connections: int = 32):
+        self.endpoint = endpoint.rstrip("/")
+        self.public_endpoint = (public_endpoint or endpoint).rstrip("/")
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.presign_ttl = presign_ttl
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections)
+        self.client = None  # created on first use, inside the serving event loop
+
+    # ---- Signature V4 ----
+
+    def _signing_key(self, date: str) -> bytes:
+        key = ("AWS4" + self.secret_key).encode()
+        for part in (date, self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        return key
+
+    def _signature(self, method: str, path: str, query: dict, headers: dict,
+                   payload_hash: str, timestamp: str) -> tuple[str, str]:
+        """(signature, signed_headers) for a canonical request"""
+        canonical_query = _query_string(sorted(query.items()))
+        names = sorted(name.lower() for name in headers)
+        lowered = {name.lower(): str(value).strip() for name, value in headers.items()}
+        signed_headers = ";".join(names)
+        canonical_request = "\n".join([
+            method, quote(path, safe="/-_.~"), canonical_query,
+            "".join(f"{name}:{lowered[name]}\n" for name in names),
+            signed_headers, payload_hash,
+        ])
+        scope = f"{timestamp[:8]}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", timestamp, scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+        signature = hmac.new(self._signing_key(timestamp[:8]), string_to_sign.encode(),
+                             hashlib.sha256).hexdigest()
+        return signature, signed_headers
+
+    def _path(self, key: str) -> str:
+        return f"/{self.bucket}/{key}" if key else f"/{self.bucket}"
+
+    async def _request(self, method: str, key: str, query: dict | None = None,
+                       data: bytes = b"", headers: dict | None = None) -> httpx.Response:
+        query = query or {}
+        timestamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        payload_hash = hashlib.sha256(data).hexdigest()
+        headers = {
+            "host": urlsplit(self.endpoint).netloc,
+            "x-amz-date": timestamp,
+            "x-amz-content-sha256": payload_hash,
+            **(headers or {}),
+        }
+        path = self._path(key)
+        signature, signed_headers = self._signature(method, path, query, headers,
+                                                    payload_hash, timestamp)
+        headers["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{timestamp[:8]}/{self.region}"
+            f"/s3/aws4_request, SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        url = self.endpoint + quote(path, safe="/-_.~")
+        if query:
+            # Encoded exactly as signed
+            url += "?" + _query_string(sorted(query.items()))
+        if self.client is None:
+            self.client = httpx.AsyncClient(limits=self.limits, timeout=httpx.Timeout(10.0, connect=3.0))
+        return await self.client.request(method, url, content=data or None, headers=headers)
+
+    # ---- objects ----
+
+    async def put(self, key: str, data: bytes, content_type: str = "application/octet-stream",
+                  private: bool = False, encoding: str | None = None):
+        # Objects are private either way; downloads go through presigned URLs
+        headers = {"content-type": content_type}
+        if encoding:
+            # Sent back as Content-Encoding, so clients decode it transparently
+            headers["content-encoding"] = encoding
+        response = await self._request("PUT", key, data=data, headers=headers)
+        response.raise_for_status()
+
+    async def get(self, key: str) -> bytes | None:
+        response = await self._request("GET", key)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.content
+
+    async def delete(self, key: str):
+        response = await self._request("DELETE", key)
+        if response.status_code not in (200, 204, 404):
+            response.raise_for_status()
+
+    async def list_keys(self, prefix: str) -> list[str]:
+        """Keys starting with prefix (ListObjectsV2, following continuation tokens)"""
+        keys = []
+        token = None
+        while True:
+            query = {"list-type": "2", "prefix": prefix}
+            if token:
+                query["continuation-token"] = token
+            response = await self._request("GET", "", query=query)
+            response.raise_for_status()
+            root = ET.fromstring(response.content)
+            keys += [c.findtext(f"{S3_NS}Key") for c in root.iter(f"{S3_NS}Contents")]
+            if root.findtext(f"{S3_NS}IsTruncated") != "true":
+                return keys
+            token = root.findtext(f"{S3_NS}NextContinuationToken")
+
+    def download_url(self, key: str, filename: str) -> str | None:
+        """Presigned GET on public_endpoint, valid for presign_ttl seconds"""
+        timestamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        query = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{timestamp[:8]}/{self.region}/s3/aws4_request",
+            "X-Amz-Date": timestamp,
+            "X-Amz-Expires": str(self.presign_ttl),
+            "X-Amz-SignedHeaders": "host",
+            "response-content-disposition": f'attachment; filename="{filename}"',
+        }
+        path = self._path(key)
+        signature, _ = self._signature("GET", path, query, {"host": urlsplit(self.public_endpoint).netloc},
+                                       "UNSIGNED-PAYLOAD", timestamp)
+        query["X-Amz-Signature"] = signature
+        return f"{self.public_endpoint}{quote(path, safe='/-_.~')}?{_query_string(query.items())}"
+
+    # ---- certificate artifacts: certs/<id>/<name> objects ----
+
+    async def put_artifacts(self, cert_id: str, artifacts: dict):
+        # Independent objects; upload them concurrently over the pool
+        await asyncio.gather(*(
+            self.put(f"certs/{cert_id}/{name}", data, encoding=content_encoding(name))
+            for name, data in artifacts.items()
+        ))
+
+    async def get_artifact(self, cert_id: str, name: str) -> bytes | None:
+        return await self.get(f"certs/{cert_id}/{name}")
+
+    async def set_artifact(self, cert_id: str, name: str, data: bytes):
+        await self.put(f"certs/{cert_id}/{name}", data)
+
+    async def certificate_ids(self) -> list[str]:
+        return sorted(key.split("/")[1] for key in await self.list_keys("certs/")
+                      if key.endswith("/metadata.json"))
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+def create_storage(data_dir: Path, export_public: bool = False):
+    """S3 storage if PQCERT_S3_BUCKET is set, otherwise files under data_dir"""
+    bucket = os.environ.get("PQCERT_S3_BUCKET")
+    if not bucket:
+        return LocalStorage(data_dir, export_public)
+    return S3Storage(
+        endpoint=os.environ.get("PQCERT_S3_ENDPOINT", "https://s3.amazonaws.com"),
+        bucket=bucket,
+        access_key=os.environ["PQCERT_S3_ACCESS_KEY"],
+        secret_key=os.environ["PQCERT_S3_SECRET_KEY"],
+        region=os.environ.get("PQCERT_S3_REGION", "us-east-1"),
+        public_endpoint=os.environ.get("PQCERT_S3_PUBLIC_ENDPOINT"),
+        presign_ttl=int(os.environ.get("PQCERT_S3_PRESIGN_SECONDS", "300")),
+    )
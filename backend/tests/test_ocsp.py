@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509 import ocsp
+from cryptography.x509.oid import NameOID
+
+from cache import MemoryCache
+from ocsp import OCSPResponder
+
+
+def make_cert(subject, issuer=None, issuer_key=None, serial=1):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, subject)])
+    now = datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(issuer.subject if issuer else name)
+        .public_key(key.public_key())
+        .serial_number(serial)
+        .not_valid_before(now)
+        .not_valid_after(now + timedelta(days=1))
+        .sign(issuer_key or key, hashes.SHA256())
+    )
+    return cert, key
+
+
+def der_tlv(tag: int, content: bytes) -> bytes:
+    n = len(content)
+    if n < 0x80:
+        return bytes([tag, n]) + content
+    length = n.to_bytes((n.bit_length() + 7) // 8, "big")
+    return bytes([tag, 0x80 | len(length)]) + length + content
+
+
+def der_children(data: bytes) -> list:
+    """(tag, content) for each element of a constructed value's contents"""
+    children, pos = [], 0
+    while pos < len(data):
+        tag, length = data[pos], data[pos + 1]
+        pos += 2
+        if length & 0x80:
+            n = length & 0x7F
+            length = int.from_bytes(data[pos:pos + n], "big")
+            pos += n
+        children.append((tag, data[pos:pos + length]))
+        pos += length
+    return children
+
+
+def two_certificate_request(ca_cert, leaves) -> bytes:
+    """An OCSPRequest whose requestList holds one Request per leaf"""
+    requests = []
+    for leaf in leaves:
+        single = ocsp.OCSPRequestBuilder().add_certificate(leaf, ca_cert, hashes.SHA1()).build()
+        [(_, tbs)] = der_children(der_children(single.public_bytes(serialization.Encoding.DER))[0][1])
+        [(_, request_list)] = der_children(tbs)
+        requests.append(request_list)
+    return der_tlv(0x30, der_tlv(0x30, der_tlv(0x30, b"".join(requests))))
+
+
+def test_multi_certificate_request_is_malformed_not_an_error():
+    ca_cert, ca_key = make_cert("Test CA")
+    leaves = [make_cert(f"leaf{i}", ca_cert, ca_key, serial=i + 2)[0] for i in range(2)]
+
+    async def lookup(serial):
+        return None
+
+    responder = OCSPResponder(
+        SimpleNamespace(cert=ca_cert, key=ca_key),
+        lookup=lookup, active_serials=lambda: [], cache=MemoryCache(),
+    )
+    der = asyncio.run(responder.respond(two_certificate_request(ca_cert, leaves)))
+    assert der == responder.malformed
+    assert ocsp.load_der_ocsp_response(der).response_status == ocsp.OCSPResponseStatus.MALFORMED_REQUEST
@@ -0,0 +1,33 @@
+import importlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="module")
+def main(tmp_path_factory):
+    # main reads its configuration at import time
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("PQCERT_DATA_DIR", str(tmp_path_factory.mktemp("data")))
+        mp.setenv("PQCERT_PROFILE", "1")
+        mp.setenv("PQCERT_PROFILE_SLOW_MS", "0")
+        mp.setenv("PQCERT_PROFILE_INTERVAL_MS", "1")
+        yield importlib.import_module("main")
+
+
+def test_verify_profile_follows_single_flight_issuance(main, monkeypatch):
+    async def verified(*args, **kwargs):
+        return True
+
+    monkeypatch.setattr(main, "verify_domain_ownership", verified)
+
+    with TestClient(main.app) as client:
+        challenge = client.post("/v1/certificate/request", json={
+            "domain": "example.com", "email": "admin@example.com",
+        }).json()
+        response = client.post(f"/v1/certificate/verify/{challenge['challenge_id']}")
+        assert response.status_code == 200
+
+    [record] = [r for r in main.profiler.recent() if r["path"].startswith("/v1/certificate/verify/")]
+    stacks = main.profiler.get(record["id"])["stacks"]
+    assert "generate_certificate (main.py:" in stacks
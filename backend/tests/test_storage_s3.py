@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import hmac
+import re
+from datetime import datetime, timedelta
+from urllib.parse import parse_qsl, quote, urlsplit
+
+import httpx
+import pytest
+
+import storage
+from storage import S3Storage
+
+ACCESS_KEY = "pqcert-test"
+SECRET_KEY = "pqcert-test-secret"
+REGION = "eu-test-1"
+BUCKET = "certs"
+
+AUTH_PATTERN = re.compile(
+    r"AWS4-HMAC-SHA256 Credential=(?P<credential>[^,]+), "
+    r"SignedHeaders=(?P<signed_headers>[^,]+), Signature=(?P<signature>[0-9a-f]{64})")
+
+
+def sigv4(method, raw_path, query, headers, payload_hash, timestamp, secret=SECRET_KEY):
+    """Signature V4 as the AWS documentation spells it out"""
+    canonical_query = "&".join(
+        f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(query))
+    names = sorted(headers)
+    canonical_request = "\n".join([
+        method, raw_path, canonical_query,
+        "".join(f"{name}:{headers[name].strip()}\n" for name in names),
+        ";".join(names), payload_hash,
+    ])
+    scope = f"{timestamp[:8]}/{REGION}/s3/aws4_request"
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256", timestamp, scope,
+        hashlib.sha256(canonical_request.encode()).hexdigest(),
+    ])
+    key = ("AWS4" + secret).encode()
+    for part in (timestamp[:8], REGION, "s3", "aws4_request"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+
+class FakeS3:
+    """Path-style S3 stand-in (a MockTransport handler) that checks every signature"""
+
+    def __init__(self):
+        self.objects = {}
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        raw_path = request.url.raw_path.decode().split("?")[0]
+        query = parse_qsl(request.url.query.decode(), keep_blank_values=True)
+        if "X-Amz-Signature" in dict(query):
+            if not self._presigned_ok(request, raw_path, query):
+                return httpx.Response(403)
+        elif not self._signed_ok(request, raw_path, query):
+            return httpx.Response(403)
+
+        bucket, _, key = raw_path.lstrip("/").partition("/")
+        assert bucket == BUCKET
+        if request.method == "PUT":
+            self.objects[key] = (request.content, request.headers.get("content-encoding"))
+            return httpx.Response(200)
+        if request.method == "DELETE":
+            self.objects.pop(key, None)
+            return httpx.Response(204)
+        if not key:
+            return self._list(dict(query)["prefix"])
+        if key not in self.objects:
+            return httpx.Response(404)
+        data, encoding = self.objects[key]
+        return httpx.Response(200, content=data,
+                              headers={"content-encoding": encoding} if encoding else {})
+
+    def _signed_ok(self, request, raw_path, query) -> bool:
+        match = AUTH_PATTERN.fullmatch(request.headers.get("authorization", ""))
+        if match is None:
+            return False
+        timestamp = request.headers["x-amz-date"]
+        payload_hash = request.headers["x-amz-content-sha256"]
+        if payload_hash != hashlib.sha256(request.content).hexdigest():
+            return False
+        if match["credential"] != f"{ACCESS_KEY}/{timestamp[:8]}/{REGION}/s3/aws4_request":
+            return False
+        names = match["signed_headers"].split(";")
+        if not {"host", "x-amz-date", "x-amz-content-sha256"} <= set(names):
+            return False
+        headers = {name: request.headers[name] for name in names}
+        expected = sigv4(request.method, raw_path, query, headers, payload_hash, timestamp)
+        return hmac.compare_digest(expected, match["signature"])
+
+    def _presigned_ok(self, request, raw_path, query) -> bool:
+        params = dict(query)
+        timestamp = params["X-Amz-Date"]
+        issued = datetime.strptime(timestamp, "%Y%m%dT%H%M%SZ")
+        if datetime.utcnow() > issued + timedelta(seconds=int(params["X-Amz-Expires"])):
+            return False
+        if params["X-Amz-SignedHeaders"] != "host":
+            return False
+        unsigned = [(k, v) for k, v in query if k != "X-Amz-Signature"]
+        expected = sigv4("GET", raw_path, unsigned, {"host": request.url.netloc.decode()},
+                         "UNSIGNED-PAYLOAD", timestamp)
+        return hmac.compare_digest(expected, params["X-Amz-Signature"])
+
+    def _list(self, prefix: str) -> httpx.Response:
+        contents = "".join(f"<Contents><Key>{key}</Key></Contents>"
+                           for key in sorted(self.objects) if key.startswith(prefix))
+        return httpx.Response(200, content=(
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"{contents}<IsTruncated>false</IsTruncated></ListBucketResult>").encode())
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """S3Storage talking to a FakeS3; clients records every AsyncClient it creates"""
+    fake = FakeS3()
+    clients = []
+    real_client = httpx.AsyncClient
+
+    def client(**kwargs):
+        clients.append(real_client(transport=httpx.MockTransport(fake), **kwargs))
+        return clients[-1]
+
+    monkeypatch.setattr(storage.httpx, "AsyncClient", client)
+    backend = S3Storage("http://minio.test:9000", BUCKET, ACCESS_KEY, SECRET_KEY, region=REGION,
+                        public_endpoint="https://files.example.test")
+    return backend, fake, clients
+
+
+def test_put_get_delete(s3):
+    backend, fake, _ = s3
+
+    async def scenario():
+        await backend.put("challenges/abc.json", b'{"token": "t"}', "application/json")
+        assert await backend.get("challenges/abc.json") == b'{"token": "t"}'
+        assert await backend.list_keys("challenges/") == ["challenges/abc.json"]
+        await backend.delete("challenges/abc.json")
+        assert await backend.get("challenges/abc.json") is None
+        await backend.delete("challenges/abc.json")  # already gone is fine
+        await backend.close()
+
+    asyncio.run(scenario())
+    assert all(r.headers.get("authorization") for r in fake.requests)
+
+
+def test_artifacts_and_presigned_download(s3):
+    backend, fake, _ = s3
+    cert_id = "3fa2c1d4-0000-4000-8000-000000000001"
+
+    async def scenario():
+        await backend.put_artifacts(cert_id, {
+            "cert.pem": b"CERT",
+            "cert.pem.gz": b"GZIPPED",
+            "metadata.json": b"{}",
+        })
+        assert await backend.get_artifact(cert_id, "cert.pem") == b"CERT"
+        assert await backend.get_artifact(cert_id, "missing.pem") is None
+        assert await backend.certificate_ids() == [cert_id]
+        await backend.close()
+
+    asyncio.run(scenario())
+    assert fake.objects[f"certs/{cert_id}/cert.pem.gz"] == (b"GZIPPED", "gzip")
+
+    url = backend.download_url(f"certs/{cert_id}/cert.pem", "cert.pem")
+    assert urlsplit(url).netloc == "files.example.test"
+    # A client following the redirect gets the object; a tampered URL is refused
+    with httpx.Client(transport=httpx.MockTransport(fake)) as client:
+        response = client.get(url)
+        assert response.status_code == 200 and response.content == b"CERT"
+        assert client.get(url.replace("cert.pem?", "key.pem?", 1)).status_code == 403
+
+
+def test_wrong_secret_is_refused(s3, monkeypatch):
+    backend, _, _ = s3
+    monkeypatch.setattr(backend, "secret_key", "not-the-secret")
+
+    async def scenario():
+        with pytest.raises(httpx.HTTPStatusError):
+            await backend.put("challenges/abc.json", b"{}")
+        await backend.close()
+
+    asyncio.run(scenario())
+
+
+def test_one_pooled_client_for_all_requests(s3):
+    backend, fake, clients = s3
+
+    async def scenario():
+        await backend.put_artifacts("3fa2c1d4-0000-4000-8000-000000000002",
+                                    {f"file{i}.pem": b"x" for i in range(10)})
+        for i in range(10):
+            await backend.get(f"certs/3fa2c1d4-0000-4000-8000-000000000002/file{i}.pem")
+        await backend.close()
+
+    asyncio.run(scenario())
+    assert len(fake.requests) == 20
+    assert len(clients) == 1
@@ -0,0 +1,345 @@
+"""
+PQCert - Transparency Log
+Every issued certificate is appended to a local Merkle-tree log (RFC 6962
+hashing: the leaf is the certificate's DER), so anyone can check what the
+CA has issued and that the log is append-only.
+
+Issuance doesn't wait for the log: submit() only queues the certificate,
+and a background task adds the queued certificates in one batch every
+PQCERT_TRANSPARENCY_INTERVAL_SECONDS, then signs a new tree head (STH)
+with the CA key. A certificate is in the log at the latest one interval
+after it was issued.
+
+The hash of every complete subtree (2^k aligned leaves) is kept on disk,
+one file per level, written once when the subtree completes. A proof or a
+root for any tree size is then a handful of reads of those files
+(O(log^2 n) at most), never a pass over the leaves.
+
+Files in DATA_DIR/transparency/ (one log per data directory; like the CRL
+state it is written by a single API process):
+    entries.ndjson   one JSON entry per leaf
+    entries.idx      byte offset of each entry (8 bytes, big-endian)
+    level-<k>.bin    32-byte hashes of the complete subtrees of height k
+    sth.json         latest signed tree head
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+
+logger = logging.getLogger("pqcert.transparency")
+
+HASH_SIZE = 32
+OFFSET_SIZE = 8
+# Most entries and proof sizes one request may ask for
+MAX_ENTRIES = 256
+# What an entry publishes. Never the certificate id: it is the credential
+# for the key download and revocation
+ENTRY_FIELDS = ("index", "serial", "issued_at", "leaf_input")
+# A fresh STH is signed at least this often, even without new entries
+STH_REFRESH = timedelta(hours=1)
+
+
+def leaf_hash(leaf_input: bytes) -> bytes:
+    return hashlib.sha256(b"\x00" + leaf_input).digest()
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+def split_point(n: int) -> int:
+    """Largest power of two smaller than n (n > 1)"""
+    return 1 << ((n - 1).bit_length() - 1)
+
+
+def tree_head_input(timestamp: int, tree_size: int, root: bytes) -> bytes:
+    """RFC 6962 TreeHeadSignature: v1, tree_hash, ms timestamp, size, root"""
+    return struct.pack(">BBQQ", 0, 1, timestamp, tree_size) + root
+
+
+class TransparencyLog:
+
+    def __init__(self, ca, directory: Path):
+        self.ca = ca
+        self.directory = directory
+        # lock: the files and tree state, held through a batch's fsync;
+        # queue_lock: only the pending list, so submit() never waits on disk
+        self.lock = threading.Lock()
+        self.queue_lock = threading.Lock()
+        self.pending = []
+        self.stats = {"batches": 0, "entries": 0, "sth_signed": 0}
+        directory.mkdir(parents=True, exist_ok=True)
+
+        self.entries_fd = self._open("entries.ndjson")
+        self.idx_fd = self._open("entries.idx")
+        self.level_fds = []
+        self.sth_file = directory / "sth.json"
+        self.sth = json.loads(self.sth_file.read_text()) if self.sth_file.exists() else None
+
+        self.size = self._recover()
+        # leaf hash -> index, for proofs by hash (the certificate index is
+        # in memory too)
+        self.leaf_index = {}
+        self._index_leaves(0, self.size)
+        if self.sth is None or self.sth["tree_size"] != self.size:
+            self._sign_sth()
+
+    # ---- files ----
+
+    def _open(self, name: str) -> int:
+        return os.open(self.directory / name, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _level_fd(self, level: int) -> int:
+        while len(self.level_fds) <= level:
+            self.level_fds.append(self._open(f"level-{len(self.level_fds)}.bin"))
+        return self.level_fds[level]
+
+    def _count(self, level: int) -> int:
+        return os.fstat(self._level_fd(level)).st_size // HASH_SIZE
+
+    def _read(self, level: int, offset: int, length: int) -> bytes:
+        return os.pread(self._level_fd(level), length, offset)
+
+    def _offset(self, index: int) -> int:
+        return struct.unpack(">Q", os.pread(self.idx_fd, OFFSET_SIZE, index * OFFSET_SIZE))[0]
+
+    def _recover(self) -> int:
+        """Bring the files back in line after a crash mid-batch; the leaf count"""
+        entries_size = os.fstat(self.entries_fd).st_size
+        count = os.fstat(self.idx_fd).st_size // OFFSET_SIZE
+        # Entries written before their offset, or cut short, are dropped
+        # (their certificates are submitted again by the startup backfill)
+        while count and self._offset(count - 1) >= entries_size:
+            count -= 1
+        end = 0
+        if count:
+            start = self._offset(count - 1)
+            tail = os.pread(self.entries_fd, entries_size - start, start)
+            newline = tail.find(b"\n")
+            if newline < 0:
+                count -= 1
+                end = start
+            else:
+                end = start + newline + 1
+        os.ftruncate(self.entries_fd, end)
+        os.ftruncate(self.idx_fd, count * OFFSET_SIZE)
+
+        if self._count(0) > count:
+            os.ftruncate(self._level_fd(0), count * HASH_SIZE)
+        missing = [leaf_hash(base64.b64decode(entry["leaf_input"]))
+                   for entry in self.entries(self._count(0), count - 1)]
+        os.write(self._level_fd(0), b"".join(missing))
+        self._extend_levels(recovering=True)
+        return count
+
+    def _extend_levels(self, recovering: bool = False):
+        """Add the subtree hashes completed by new leaves, level by level"""
+        levels = len(list(self.directory.glob("level-*.bin")))
+        level = 1
+        while True:
+            expected = self._count(level - 1) // 2
+            have = self._count(level)
+            if have > expected and recovering:
+                os.ftruncate(self._level_fd(level), expected * HASH_SIZE)
+                have = expected
+            if expected == 0 and (level >= levels or not recovering):
+                break
+            if have < expected:
+                data = self._read(level - 1, 2 * have * HASH_SIZE, 2 * (expected - have) * HASH_SIZE)
+                os.write(self._level_fd(level), b"".join(
+                    node_hash(data[i:i + HASH_SIZE], data[i + HASH_SIZE:i + 2 * HASH_SIZE])
+                    for i in range(0, len(data), 2 * HASH_SIZE)))
+            level += 1
+
+    # ---- appending ----
+
+    def submit(self, serial: str, issued_at: str, cert_der: bytes):
+        """Queue a certificate for the next batch"""
+        entry = {
+            "serial": serial,
+            "issued_at": issued_at,
+            "leaf_input": base64.b64encode(cert_der).decode(),
+        }
+        with self.queue_lock:
+            self.pending.append(entry)
+
+    def integrate(self) -> int:
+        """Append the queued certificates and sign the new tree head"""
+        with self.lock:
+            with self.queue_lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return 0
+            size = self.size
+            try:
+                self._append(batch)
+            except Exception:
+                # Keep what made it to disk whole, queue the rest again
+                self.size = self._recover()
+                self._index_leaves(size, self.size)
+                with self.queue_lock:
+                    self.pending[:0] = batch[self.size - size:]
+                raise
+            self.stats["batches"] += 1
+            self.stats["entries"] += len(batch)
+            self._sign_sth()
+            return len(batch)
+
+    def _append(self, batch: list):
+        offset = os.fstat(self.entries_fd).st_size
+        lines, offsets, leaves = [], [], []
+        for i, entry in enumerate(batch, self.size):
+            line = json.dumps({"index": i, **entry}, separators=(",", ":")).encode() + b"\n"
+            lines.append(line)
+            offsets.append(struct.pack(">Q", offset))
+            leaves.append(leaf_hash(base64.b64decode(entry["leaf_input"])))
+            offset += len(line)
+        # Entries before their offsets, offsets before hashes: _recover()
+        # trims whatever a crash left behind
+        os.write(self.entries_fd, b"".join(lines))
+        os.write(self.idx_fd, b"".join(offsets))
+        os.write(self._level_fd(0), b"".join(leaves))
+        self._extend_levels()
+        for fd in (self.entries_fd, self.idx_fd, *self.level_fds):
+            os.fsync(fd)
+        self._index_leaves(self.size, self.size + len(batch))
+        self.size += len(batch)
+
+    def _index_leaves(self, start: int, end: int):
+        level0 = self._read(0, start * HASH_SIZE, (end - start) * HASH_SIZE)
+        for i in range(end - start):
+            self.leaf_index.setdefault(level0[i * HASH_SIZE:(i + 1) * HASH_SIZE], start + i)
+
+    def _sign_sth(self):
+        timestamp = int(time.time() * 1000)
+        root = self.root(self.size)
+        signature = self.ca.key.sign(tree_head_input(timestamp, self.size, root),
+                                     ec.ECDSA(hashes.SHA256()))
+        sth = {
+            "tree_size": self.size,
+            "timestamp": timestamp,
+            "sha256_root_hash": base64.b64encode(root).decode(),
+            "tree_head_signature": base64.b64encode(signature).decode(),
+        }
+        tmp = self.sth_file.with_name(self.sth_file.name + ".tmp")
+        tmp.write_text(json.dumps(sth))
+        os.replace(tmp, self.sth_file)
+        self.sth = sth
+        self.stats["sth_signed"] += 1
+        logger.info("signed tree head: size %d", self.size)
+
+    async def run(self, interval: float = 10):
+        """Integrate queued certificates every interval; keep the STH fresh"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self.pending:
+                    await asyncio.to_thread(self.integrate)
+                elif time.time() * 1000 - self.sth["timestamp"] >= STH_REFRESH.total_seconds() * 1000:
+                    await asyncio.to_thread(self._refresh_sth)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("transparency log batch failed")
+
+    def _refresh_sth(self):
+        with self.lock:
+            self._sign_sth()
+
+    async def close(self):
+        """Integrate what is still queued"""
+        if self.pending:
+            await asyncio.to_thread(self.integrate)
+
+    # ---- startup backfill ----
+
+    def backfill_since(self) -> str:
+        """Certificates issued after this may be missing (a crash lost the queue)"""
+        if self.size == 0:
+            return ""  # a new log starts with every certificate issued so far
+        last = next(self.entries(self.size - 1, self.size - 1))
+        return (datetime.fromisoformat(last["issued_at"]) - timedelta(minutes=10)).isoformat()
+
+    def logged_serials(self, since: str) -> set:
+        """Serials of the newest entries, back to those issued before since"""
+        serials = set()
+        for index in range(self.size - 1, -1, -1):
+            entry = next(self.entries(index, index))
+            serials.add(entry["serial"])
+            if entry["issued_at"] < since:
+                break
+        return serials
+
+    # ---- reading ----
+
+    def entries(self, start: int, end: int):
+        """Entries start..end (inclusive), as stored"""
+        if end < start:
+            return
+        first = self._offset(start)
+        if end + 1 < os.fstat(self.idx_fd).st_size // OFFSET_SIZE:
+            last = self._offset(end + 1)
+        else:
+            last = os.fstat(self.entries_fd).st_size
+        for line in os.pread(self.entries_fd, last - first, first).splitlines():
+            yield json.loads(line)
+
+    def subtree_hash(self, start: int, size: int) -> bytes:
+        """Root of leaves start..start+size-1, from the cached complete subtrees"""
+        if size & (size - 1) == 0 and start % size == 0:
+            level = size.bit_length() - 1
+            index = start >> level
+            return self._read(level, index * HASH_SIZE, HASH_SIZE)
+        k = split_point(size)
+        return node_hash(self.subtree_hash(start, k), self.subtree_hash(start + k, size - k))
+
+    def root(self, tree_size: int) -> bytes:
+        if tree_size == 0:
+            return hashlib.sha256(b"").digest()
+        return self.subtree_hash(0, tree_size)
+
+    def inclusion_proof(self, index: int, tree_size: int) -> list[bytes]:
+        """RFC 6962 audit path of leaf index in the tree of tree_size leaves"""
+        path, start, n, m = [], 0, tree_size, index
+        while n > 1:
+            k = split_point(n)
+            if m < k:
+                path.append(self.subtree_hash(start + k, n - k))
+                n = k
+            else:
+                path.append(self.subtree_hash(start, k))
+                start, n, m = start + k, n - k, m - k
+        return path[::-1]
+
+    def consistency_proof(self, first: int, second: int) -> list[bytes]:
+        """RFC 6962 proof that the tree of first leaves is a prefix of second"""
+        if first == 0 or first == second:
+            return []
+        proof, start, n, m, complete = [], 0, second, first, True
+        while m != n:
+            k = split_point(n)
+            if m <= k:
+                proof.append(self.subtree_hash(start + k, n - k))
+                n = k
+            else:
+                proof.append(self.subtree_hash(start, k))
+                start, n, m, complete = start + k, n - k, m - k, False
+        if not complete:
+            proof.append(self.subtree_hash(start, n))
+        return proof[::-1]
+
+
+def create_transparency_log(ca, data_dir: Path) -> TransparencyLog:
+    return TransparencyLog(ca, data_dir / "transparency")
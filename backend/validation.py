@@ -0,0 +1,179 @@
+"""
+PQCert - Domain Validation
+HTTP-01 challenge fetches with bounded streaming reads and separate
+connect/read/total deadlines, and DNS-01 TXT lookups, on top of an async
+DNS resolver whose answers are cached for their TTL.
+"""
+
+import asyncio
+import ipaddress
+import os
+import time
+from collections import OrderedDict
+
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+import httpx
+
+# Stop reading a challenge response after this many bytes
+MAX_CHALLENGE_BYTES = int(os.environ.get("PQCERT_CHALLENGE_MAX_BYTES", "8192"))
+
+CONNECT_TIMEOUT = float(os.environ.get("PQCERT_VALIDATION_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.environ.get("PQCERT_VALIDATION_READ_TIMEOUT", "5"))
+TOTAL_TIMEOUT = float(os.environ.get("PQCERT_VALIDATION_TOTAL_TIMEOUT", "10"))
+
+# DNS-01: the token goes in a TXT record at _pqcert-challenge.<domain>
+DNS01_LABEL = "_pqcert-challenge"
+
+
+def parse_host_port(value: str, default_port: int) -> tuple[str, int]:
+    """Split "host", "host:port" or "[v6]:port"; a bare IPv6 address gets default_port"""
+    if value.startswith("["):
+        host, _, rest = value[1:].partition("]")
+        return host, int(rest.lstrip(":") or default_port)
+    if value.count(":") == 1:
+        host, port = value.split(":")
+        return host, int(port)
+    return value, default_port
+
+
+class DNSResolver:
+    """
+    Async resolver with a TTL-respecting answer cache, holding at most
+    max_entries names (least recently used are dropped first).
+
+    nameservers is a list of "host" or "host:port" strings; empty means the
+    system configuration (PQCERT_DNS_SERVERS overrides it, e.g. to point
+    at a local stand-in DNS server in tests).
+    """
+
+    def __init__(self, nameservers=None, min_ttl: int = 5, max_ttl: int = 300,
+                 negative_ttl: int = 30, timeout: float = 3.0, max_entries: int = 10000):
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        # (name, rdtype) -> (records, expires), least recently used first
+        self.cache = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+        self.resolver = dns.asyncresolver.Resolver(configure=not nameservers)
+        if nameservers:
+            ports = {}
+            for server in nameservers:
+                host, port = parse_host_port(server, 53)
+                ports[host] = port
+            self.resolver.nameservers = list(ports)
+            self.resolver.nameserver_ports = ports
+        self.resolver.lifetime = timeout
+
+    async def _query(self, name: str, rdtype: str, cached: bool = True) -> list:
+        key = (name.lower().rstrip("."), rdtype)
+        entry = self.cache.get(key) if cached else None
+        if entry is not None and entry[1] > time.monotonic():
+            self.cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[0]
+
+        self.stats["misses"] += 1
+        try:
+            answer = await self.resolver.resolve(name, rdtype)
+            records = [rdata for rdata in answer]
+            ttl = min(max(answer.rrset.ttl, self.min_ttl), self.max_ttl)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            records, ttl = [], self.negative_ttl
+        except dns.exception.DNSException:
+            # Timeouts and server failures are not cached
+            return []
+
+        if cached:
+            self._store(key, records, ttl)
+        return records
+
+    def _store(self, key: tuple, records: list, ttl: float):
+        now = time.monotonic()
+        self.cache[key] = (records, now + ttl)
+        self.cache.move_to_end(key)
+        # Expired entries at the old end go first, then the least recently
+        # used ones while over the limit
+        while self.cache:
+            oldest, (_, expires) = next(iter(self.cache.items()))
+            if expires > now and len(self.cache) <= self.max_entries:
+                break
+            del self.cache[oldest]
+            self.stats["evicted"] += 1
+
+    async def resolve_addresses(self, name: str) -> list[str]:
+        """IPv4 then IPv6 addresses for name (IP literals are returned as-is)"""
+        try:
+            return [str(ipaddress.ip_address(name))]
+        except ValueError:
+            pass
+        v4, v6 = await asyncio.gather(self._query(name, "A"), self._query(name, "AAAA"))
+        return [r.address for r in v4] + [r.address for r in v6]
+
+    async def resolve_txt(self, name: str, cached: bool = True) -> list[str]:
+        """TXT values for name, each record's strings joined"""
+        records = await self._query(name, "TXT", cached)
+        return [b"".join(r.strings).decode("utf-8", "replace") for r in records]
+
+
+def create_resolver() -> DNSResolver:
+    servers = [s.strip() for s in os.environ.get("PQCERT_DNS_SERVERS", "").split(",") if s.strip()]
+    return DNSResolver(servers, max_entries=int(os.environ.get("PQCERT_DNS_CACHE_SIZE", "10000")))
+
+
+async def fetch_contains(url: str, host: str, needle: bytes, client: httpx.AsyncClient) -> bool:
+    """Stream url and stop as soon as needle is seen or MAX_CHALLENGE_BYTES were read"""
+    async with client.stream("GET", url, headers={"Host": host, "Accept-Encoding": "identity"}) as response:
+        if response.status_code != 200:
+            return False
+        seen = b""
+        async for chunk in response.aiter_raw():
+            seen += chunk
+            if needle in seen:
+                return True
+            if len(seen) >= MAX_CHALLENGE_BYTES:
+                return False
+    return False
+
+
+async def verify_http01(domain: str, token: str, resolver: DNSResolver) -> bool:
+    """HTTP-01: http://<domain>/.well-known/pqcert-challenge/<token> must contain the token"""
+    path = f"/.well-known/pqcert-challenge/{token}"
+    timeout = httpx.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT,
+                            write=READ_TIMEOUT, pool=CONNECT_TIMEOUT)
+
+    async def attempt():
+        addresses = await resolver.resolve_addresses(domain)
+        async with httpx.AsyncClient(timeout=timeout, follow_redirects=False) as client:
+            for address in addresses:
+                netloc = f"[{address}]" if ":" in address else address
+                try:
+                    return await fetch_contains(f"http://{netloc}{path}", domain, token.encode(), client)
+                except httpx.TransportError:
+                    continue  # try the next address
+        return False
+
+    try:
+        return await asyncio.wait_for(attempt(), TOTAL_TIMEOUT)
+    except (asyncio.TimeoutError, httpx.HTTPError):
+        return False
+
+
+def dns01_record(domain: str) -> str:
+    """TXT record name for domain; a wildcard is validated at its base domain"""
+    return f"{DNS01_LABEL}.{domain.removeprefix('*.')}"
+
+
+async def verify_dns01(domain: str, token: str, resolver: DNSResolver) -> bool:
+    """DNS-01: a TXT record at _pqcert-challenge.<domain> must hold the token"""
+    # Never from the cache: a miss cached before the record was added would
+    # fail every retry until it expired
+    try:
+        values = await asyncio.wait_for(resolver.resolve_txt(dns01_record(domain), cached=False),
+                                        TOTAL_TIMEOUT)
+    except asyncio.TimeoutError:
+        return False
+    return token in values
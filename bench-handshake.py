@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+TLS handshake cost benchmark for PQCert certificates
+Run: python3 bench-handshake.py [--iterations 200] [--output report.json]
+
+For each algorithm a throwaway CA and localhost certificate are issued with
+the pqcert_localhost generators, served with test-server.py, and measured:
+
+    - full and resumed handshake latency (TCP connect + TLS handshake)
+    - handshakes per second (one connection + one small request each)
+    - bytes on the wire during the handshake (client view, both directions)
+    - certificate chain size (DER)
+
+"hybrid" is an ECDSA P-256 chain with X25519MLKEM768 key exchange. Python's
+ssl module cannot select key exchange groups, so that row is measured with
+openssl s_server / s_time (CLI 3.5+) instead: handshakes per second only,
+next to an X25519 baseline measured the same way on the same chain. Compare
+it with that baseline, not with the other rows.
+
+Algorithms the local OpenSSL cannot issue or serve (e.g. ML-DSA before
+OpenSSL 3.5) are reported as skipped. The report is printed as JSON.
+"""
+
+import argparse
+import importlib.util
+import json
+import platform
+import re
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT / "cli"))
+
+import pqcert_localhost  # noqa: E402
+
+_spec = importlib.util.spec_from_file_location("test_server", ROOT / "test-server.py")
+test_server = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(test_server)
+
+# Hybrid = classical certificate + hybrid post-quantum key exchange, measured
+# with the openssl CLI against a classical key exchange on the same chain
+HYBRID_KEY_TYPE = "ecdsa-p256"
+HYBRID_GROUPS = "X25519MLKEM768"
+BASELINE_GROUPS = "X25519"
+HYBRID_MIN_OPENSSL = (3, 5)
+
+ALGORITHMS = ["rsa-2048", "ecdsa-p256", "ed25519", "hybrid",
+              "ml-dsa-44", "ml-dsa-65", "ml-dsa-87"]
+
+REQUEST = b"GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n"
+
+
+class QuietHandler(test_server.Handler):
+    def log_message(self, format, *args):
+        pass
+
+
+def openssl_cli_version() -> str | None:
+    """`openssl version` output, or None without a working openssl CLI"""
+    try:
+        result = subprocess.run(["openssl", "version"], capture_output=True, text=True)
+    except FileNotFoundError:
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def openssl_at_least(version: str | None, minimum: tuple) -> bool:
+    match = re.match(r"OpenSSL (\d+)\.(\d+)", version or "")
+    return bool(match) and tuple(map(int, match.groups())) >= minimum
+
+
+def der_size(cert_pem: bytes) -> int:
+    return len(ssl.PEM_cert_to_DER_cert(cert_pem.decode()))
+
+
+def connect(context, port, session=None):
+    """
+    Open one TLS connection through a memory BIO so handshake bytes can be counted.
+
+    Returns (handshake_seconds, bytes_sent, bytes_received, session, reused).
+    """
+    incoming, outgoing = ssl.MemoryBIO(), ssl.MemoryBIO()
+    sent = received = 0
+
+    start = time.perf_counter()
+    sock = socket.create_connection(("127.0.0.1", port))
+    try:
+        tls = context.wrap_bio(incoming, outgoing, server_hostname="localhost", session=session)
+
+        def flush():
+            nonlocal sent
+            data = outgoing.read()
+            if data:
+                sock.sendall(data)
+                sent += len(data)
+
+        def fill():
+            nonlocal received
+            data = sock.recv(65536)
+            if not data:
+                return False
+            received += len(data)
+            incoming.write(data)
+            return True
+
+        while True:
+            try:
+                tls.do_handshake()
+                break
+            except ssl.SSLWantReadError:
+                flush()
+                if not fill():
+                    raise ConnectionError("server closed during handshake")
+        flush()
+        handshake_time = time.perf_counter() - start
+        handshake_sent, handshake_received = sent, received
+
+        # One request per connection; reading the response also collects the
+        # TLS 1.3 session tickets needed for resumption.
+        tls.write(REQUEST)
+        flush()
+        while True:
+            try:
+                if not tls.read(65536):
+                    break
+            except ssl.SSLWantReadError:
+                if not fill():
+                    break
+            except ssl.SSLZeroReturnError:
+                break
+
+        return handshake_time, handshake_sent, handshake_received, tls.session, tls.session_reused
+    finally:
+        sock.close()
+
+
+def summarize(samples) -> dict:
+    ms = sorted(s * 1000 for s in samples)
+    # Inclusive: percentiles interpolate between samples, never beyond min/max
+    quantiles = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else ms * 99
+    return {
+        "mean_ms": round(statistics.fmean(ms), 3),
+        "p50_ms": round(quantiles[49], 3),
+        "p99_ms": round(quantiles[98], 3),
+        "min_ms": round(ms[0], 3),
+        "max_ms": round(ms[-1], 3),
+    }
+
+
+def run_loop(context, port, iterations, resume):
+    latencies = []
+    sent = received = reused = 0
+    session = None
+    if resume:
+        # Prime a session with one full handshake
+        session = connect(context, port)[3]
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        elapsed, s, r, new_session, was_reused = connect(context, port, session)
+        latencies.append(elapsed)
+        sent += s
+        received += r
+        reused += was_reused
+        if resume:
+            session = new_session
+    wall = time.perf_counter() - start
+
+    return {
+        "latency": summarize(latencies),
+        "handshakes_per_sec": round(iterations / wall, 1),
+        "handshake_bytes_sent": sent // iterations,
+        "handshake_bytes_received": received // iterations,
+        "resumed": reused,
+    }
+
+
+def issue_chain(name, key_type, workdir: Path) -> tuple:
+    """
+    Throwaway CA and localhost certificate under workdir/name.
+
+    Returns (files, chain sizes); files has "fullchain", "key" and "ca" paths.
+    """
+    ca_key, ca_cert = pqcert_localhost.issue_ca_cert(key_type, f"PQCert Bench CA ({name})")
+    out_dir = workdir / name
+    out_dir.mkdir()
+    pqcert_localhost.atomic_write(out_dir / "ca-key.pem", ca_key, 0o600)
+    pqcert_localhost.atomic_write(out_dir / "ca.pem", ca_cert)
+    key_pem, cert_pem = pqcert_localhost.issue_leaf_cert(
+        "localhost", ["localhost", "127.0.0.1"], key_type,
+        ca_cert=out_dir / "ca.pem", ca_key=out_dir / "ca-key.pem")
+    files = pqcert_localhost.export_artifacts(out_dir, "localhost", key_pem, cert_pem,
+                                              ca_cert, formats=["fullchain"])
+    chain = {
+        "leaf_der_bytes": der_size(cert_pem),
+        "ca_der_bytes": der_size(ca_cert),
+        "chain_der_bytes": der_size(cert_pem) + der_size(ca_cert),
+    }
+    return {**files, "ca": out_dir / "ca.pem"}, chain
+
+
+def error_reason(e) -> str:
+    """Last line of a failed command's stderr, or the exception text"""
+    stderr = getattr(e, "stderr", None)
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode(errors="replace")
+    return stderr.strip().splitlines()[-1] if stderr and stderr.strip() else str(e)
+
+
+def bench_algorithm(name, iterations, workdir: Path) -> dict:
+    result = {"key_type": name}
+
+    try:
+        files, result["chain"] = issue_chain(name, name, workdir)
+    except (subprocess.CalledProcessError, RuntimeError) as e:
+        return {**result, "skipped": f"issuance failed: {error_reason(e)}"}
+
+    try:
+        # Serve leaf + CA so the handshake carries the chain measured above
+        server = test_server.build_server(files["fullchain"], files["key"], "127.0.0.1", 0,
+                                          QuietHandler)
+    except ssl.SSLError as e:
+        return {**result, "skipped": f"cannot serve: {e}"}
+    client = ssl.create_default_context(cafile=str(files["ca"]))
+
+    port = server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        # Warm-up connection, also records the negotiated parameters
+        with socket.create_connection(("127.0.0.1", port)) as sock:
+            with client.wrap_socket(sock, server_hostname="localhost") as tls:
+                result["tls_version"] = tls.version()
+                result["cipher"] = tls.cipher()[0]
+                tls.sendall(REQUEST)
+                while tls.recv(65536):
+                    pass
+        result["full"] = run_loop(client, port, iterations, resume=False)
+        result["resumed"] = run_loop(client, port, iterations, resume=True)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return result
+
+
+# ---- hybrid key exchange (openssl CLI) ----
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def openssl_server(files, groups):
+    """openssl s_server for the chain in files, limited to groups; returns (process, port)"""
+    port = free_port()
+    server = subprocess.Popen(
+        ["openssl", "s_server", "-accept", f"127.0.0.1:{port}", "-www", "-quiet",
+         "-cert", str(files["fullchain"]), "-cert_chain", str(files["ca"]),
+         "-key", str(files["key"]), "-groups", groups],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            stderr = server.stderr.read().decode(errors="replace").strip()
+            raise RuntimeError(stderr.splitlines()[0] if stderr else "openssl s_server exited")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server, port
+        except OSError:
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("openssl s_server did not start")
+
+
+def negotiated_group(port, files, groups) -> str:
+    """Key exchange group of one s_client handshake offering only groups"""
+    result = subprocess.run(
+        ["openssl", "s_client", "-connect", f"127.0.0.1:{port}", "-servername", "localhost",
+         "-CAfile", str(files["ca"]), "-groups", groups, "-verify_return_error", "-brief"],
+        input="", capture_output=True, text=True, timeout=30)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip()
+                           else "openssl s_client failed")
+    # "Negotiated TLS1.3 group: X25519MLKEM768" (3.5+) or "Peer Temp Key: X25519, 253 bits"
+    for line in result.stderr.splitlines():
+        if "group:" in line or "Temp Key:" in line:
+            return line.split(":", 1)[1].strip()
+    return "unknown"
+
+
+def s_time(port, files, mode, seconds) -> dict:
+    """Handshakes per second from openssl s_time (mode: "new" or "reuse")"""
+    result = subprocess.run(
+        ["openssl", "s_time", "-connect", f"127.0.0.1:{port}", f"-{mode}",
+         "-time", str(seconds), "-CAfile", str(files["ca"]), "-www", "/"],
+        capture_output=True, text=True, check=True, timeout=seconds + 60)
+    real = re.search(r"(\d+) connections in (\d+) real seconds", result.stdout)
+    cpu = re.search(r"([\d.]+) connections/user sec", result.stdout)
+    if real is None:
+        raise RuntimeError("unexpected openssl s_time output")
+    connections, elapsed = map(int, real.groups())
+    return {
+        "handshakes_per_sec": round(connections / max(elapsed, 1), 1),
+        "client_cpu_handshakes_per_sec": float(cpu.group(1)) if cpu else None,
+    }
+
+
+def bench_key_exchange(files, groups, seconds) -> dict:
+    server, port = openssl_server(files, groups)
+    try:
+        return {
+            "negotiated": negotiated_group(port, files, groups),
+            "full": s_time(port, files, "new", seconds),
+            "resumed": s_time(port, files, "reuse", seconds),
+        }
+    finally:
+        server.kill()
+        server.wait()
+
+
+def bench_hybrid(seconds, workdir: Path, cli_version: str | None) -> dict:
+    result = {"key_type": HYBRID_KEY_TYPE, "groups": HYBRID_GROUPS, "tool": "openssl s_time"}
+    if not openssl_at_least(cli_version, HYBRID_MIN_OPENSSL):
+        return {**result, "skipped": "needs the openssl CLI 3.5+ for "
+                f"{HYBRID_GROUPS} (found: {cli_version or 'none'})"}
+
+    try:
+        files, result["chain"] = issue_chain("hybrid", HYBRID_KEY_TYPE, workdir)
+    except (subprocess.CalledProcessError, RuntimeError) as e:
+        return {**result, "skipped": f"issuance failed: {error_reason(e)}"}
+
+    try:
+        result["key_exchange"] = {
+            groups: bench_key_exchange(files, groups, seconds)
+            for groups in (HYBRID_GROUPS, BASELINE_GROUPS)
+        }
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, RuntimeError) as e:
+        return {**result, "skipped": f"cannot measure: {error_reason(e)}"}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PQCert TLS handshake cost benchmark")
+    parser.add_argument("-n", "--iterations", type=int, default=200,
+                        help="Handshakes per algorithm and mode (default: %(default)s)")
+    parser.add_argument("-a", "--algorithms", default=",".join(ALGORITHMS),
+                        help="Comma-separated algorithms (default: %(default)s)")
+    parser.add_argument("--cli-seconds", type=int, default=5,
+                        help="Seconds per openssl s_time run for hybrid (default: %(default)s)")
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    algorithms = [a.strip() for a in args.algorithms.split(",") if a.strip()]
+    unknown = [a for a in algorithms if a != "hybrid" and a not in pqcert_localhost.KEY_TYPES]
+    if unknown:
+        parser.error(f"unknown algorithm(s): {', '.join(unknown)}")
+
+    cli_version = openssl_cli_version()
+    report = {
+        "generated_at": datetime.utcnow().isoformat(),
+        "iterations": args.iterations,
+        "python": platform.python_version(),
+        "ssl_library": ssl.OPENSSL_VERSION,
+        "openssl_cli": cli_version,
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="pqcert-bench-") as tmp:
+        for name in algorithms:
+            print(f"[bench] {name}...", file=sys.stderr)
+            if name == "hybrid":
+                report["results"][name] = bench_hybrid(args.cli_seconds, Path(tmp), cli_version)
+            else:
+                report["results"][name] = bench_algorithm(name, args.iterations, Path(tmp))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,9 @@ https://pqcert.org
 Usage:
     pqcert get example.com
     pqcert get example.com --algorithm hybrid
+    pqcert get example.com --server-key
+    pqcert get example.com --reuse-key --max-key-age 365
+    pqcert get '*.example.com'
     pqcert renew
     pqcert status
 """
@@ -15,6 +18,7 @@ import json
 import os
 import sys
 import time
+import secrets
 import subprocess
 from pathlib import Path
 from datetime import datetime
@@ -30,6 +34,7 @@ except ImportError:
 API_URL = os.environ.get("PQCERT_API", "https://api.pqcert.org")
 CERT_DIR = Path(os.environ.get("PQCERT_DIR", "/etc/pqcert"))
 CONFIG_FILE = CERT_DIR / "config.json"
+ACCOUNT_FILE = CERT_DIR / "account.json"
 
 # Colors
 class Colors:
@@ -76,12 +81,135 @@ def ensure_cert_dir():
             sys.exit(1)
 
 
-def get_certificate(domain: str, algorithm: str = "hybrid", email: str = None):
+def load_account_key():
+    """Return this machine's account key, creating it on first use.
+
+    The server remembers domain validations per account key, so renewals
+    for an already-validated domain skip the HTTP-01 challenge.
+    """
+    try:
+        if ACCOUNT_FILE.exists():
+            return json.loads(ACCOUNT_FILE.read_text())["account_key"]
+
+        CERT_DIR.mkdir(parents=True, mode=0o700, exist_ok=True)
+        account_key = secrets.token_urlsafe(32)
+        ACCOUNT_FILE.write_text(json.dumps({
+            "account_key": account_key,
+            "created_at": datetime.utcnow().isoformat()
+        }, indent=2))
+        os.chmod(ACCOUNT_FILE, 0o600)
+        return account_key
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+# Local key types for CSRs; the server can't sign CSRs for ML-DSA keys yet,
+# so ml-dsa certificates still use a server-generated key
+CSR_KEY_ARGS = {
+    "hybrid": ["-newkey", "rsa:2048"],
+    "rsa": ["-newkey", "rsa:2048"],
+}
+
+
+DEFAULT_MAX_KEY_AGE_DAYS = 365
+
+
+def certificate_names(domain: str) -> list:
+    """A wildcard certificate also covers its base domain"""
+    if domain.startswith("*."):
+        return [domain, domain[2:]]
+    return [domain]
+
+
+def generate_key_and_csr(domain: str, algorithm: str, key_file: Path = None) -> tuple:
+    """Generate a private key and a CSR for domain locally; returns (key_pem, csr_pem).
+
+    With key_file, the CSR is made for that existing key and key_pem is None.
+    """
+    key_args = ["-key", str(key_file)] if key_file else [*CSR_KEY_ARGS[algorithm], "-noenc", "-keyout", "-"]
+    result = subprocess.run([
+        "openssl", "req", "-new",
+        *key_args,
+        "-out", "-",
+        "-subj", f"/CN={domain}",
+        "-addext", "subjectAltName=" + ",".join(f"DNS:{name}" for name in certificate_names(domain)),
+    ], capture_output=True, check=True)
+    marker = result.stdout.find(b"-----BEGIN CERTIFICATE REQUEST-----")
+    if marker < 0 or (marker == 0 and not key_file):
+        raise RuntimeError("openssl did not return a key and CSR")
+    return result.stdout[:marker] or None, result.stdout[marker:]
+
+
+def load_settings() -> dict:
+    """Global settings from CONFIG_FILE, e.g. {"reuse_key": true, "max_key_age_days": 365}"""
+    try:
+        return json.loads(CONFIG_FILE.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def key_age_days(config: dict):
+    """Days since the certificate's key was created, or None if unknown"""
+    created = config.get("key_created_at") or config.get("issued_at")
+    if not created:
+        return None
+    return (datetime.utcnow() - datetime.fromisoformat(created.replace("Z", ""))).days
+
+
+def write_private(path: Path, data: bytes):
+    """Write a private key with 0600 permissions from the start, atomically"""
+    tmp = path.with_name(path.name + ".tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def get_certificate(domain: str, algorithm: str = "hybrid", email: str = None,
+                    server_key: bool = False, reuse_key: bool = None, max_key_age: int = None,
+                    force_new: bool = False, dns: bool = False):
     """Main function to obtain a certificate"""
 
     print_banner()
     print_info(f"Requesting certificate for: {Colors.BOLD}{domain}{Colors.END}")
     print_info(f"Algorithm: {algorithm}")
+
+    # Wildcards can only be validated with a DNS TXT record
+    challenge_type = "dns-01" if dns or domain.startswith("*.") else "http-01"
+    # "*.example.com" is kept in "_.example.com"
+    domain_dir = CERT_DIR / domain.replace("*", "_")
+    key_file = domain_dir / "key.pem"
+    try:
+        previous = json.loads((domain_dir / "config.json").read_text())
+    except (OSError, ValueError):
+        previous = {}
+
+    # Key reuse: command line, then this certificate's config, then global settings
+    settings = load_settings()
+    if reuse_key is None:
+        reuse_key = previous.get("reuse_key", settings.get("reuse_key", False))
+    if max_key_age is None:
+        max_key_age = previous.get("max_key_age_days",
+                                   settings.get("max_key_age_days", DEFAULT_MAX_KEY_AGE_DAYS))
+    age = key_age_days(previous)
+    keep_key = (reuse_key and key_file.exists() and age is not None and age <= max_key_age
+                and previous.get("algorithm") == algorithm)
+    if reuse_key and not keep_key and previous:
+        print_info(f"Existing key can't be reused (older than {max_key_age} days or missing); generating a new one")
+
+    # By default the private key is generated here and never leaves this machine
+    key_pem = csr_pem = None
+    reuse_from = None
+    if not server_key and algorithm in CSR_KEY_ARGS:
+        try:
+            key_pem, csr_pem = generate_key_and_csr(domain, algorithm, key_file if keep_key else None)
+            print_info(f"Reusing existing key ({age} days old)" if keep_key else "Private key generated locally")
+        except (OSError, subprocess.CalledProcessError, RuntimeError):
+            print_warning("Could not generate a key with openssl; the server will generate it")
+    if not csr_pem and keep_key and previous.get("cert_id"):
+        # Server-generated key: ask the server to sign for it again
+        reuse_from = previous["cert_id"]
+        print_info(f"Reusing existing key ({age} days old)")
     print()
 
     # Step 1: Request certificate
@@ -94,7 +222,12 @@ def get_certificate(domain: str, algorithm: str = "hybrid", email: str = None):
                 json={
                     "domain": domain,
                     "email": email,
-                    "algorithm": algorithm
+                    "algorithm": algorithm,
+                    "account_key": load_account_key(),
+                    "reuse_key_from": reuse_from,
+                    "max_key_age_days": max_key_age,
+                    "force_new": force_new,
+                    "challenge_type": challenge_type
                 }
             )
             response.raise_for_status()
@@ -108,38 +241,62 @@ def get_certificate(domain: str, algorithm: str = "hybrid", email: str = None):
 
     challenge_token = challenge["challenge_token"]
     challenge_id = challenge["challenge_id"]
+    challenge_file = None
 
-    # Create challenge directory and file
-    challenge_dir = Path(f"/var/www/html/.well-known/pqcert-challenge")
-    challenge_file = challenge_dir / challenge_token
-
-    try:
-        challenge_dir.mkdir(parents=True, exist_ok=True)
-        challenge_file.write_text(challenge_token)
-        print_success("Challenge file created")
-    except PermissionError:
-        print_warning("Could not auto-create challenge file.")
+    if challenge.get("authorized"):
+        print_success("Domain already validated for this account, skipping challenge")
+    elif challenge.get("challenge_type") == "dns-01":
         print()
-        print(f"Please create this file manually:")
-        print(f"  Path: {Colors.YELLOW}.well-known/pqcert-challenge/{challenge_token}{Colors.END}")
-        print(f"  Content: {Colors.YELLOW}{challenge_token}{Colors.END}")
+        print(f"Please add this DNS record:")
+        print(f"  Name:  {Colors.YELLOW}{challenge['dns_record']}{Colors.END}")
+        print(f"  Type:  {Colors.YELLOW}TXT{Colors.END}")
+        print(f"  Value: {Colors.YELLOW}{challenge_token}{Colors.END}")
         print()
-        input("Press Enter when ready...")
+        input("Press Enter once the record is published...")
+    else:
+        # Create challenge directory and file
+        challenge_dir = Path(f"/var/www/html/.well-known/pqcert-challenge")
+        challenge_file = challenge_dir / challenge_token
+
+        try:
+            challenge_dir.mkdir(parents=True, exist_ok=True)
+            challenge_file.write_text(challenge_token)
+            print_success("Challenge file created")
+        except PermissionError:
+            print_warning("Could not auto-create challenge file.")
+            print()
+            print(f"Please create this file manually:")
+            print(f"  Path: {Colors.YELLOW}.well-known/pqcert-challenge/{challenge_token}{Colors.END}")
+            print(f"  Content: {Colors.YELLOW}{challenge_token}{Colors.END}")
+            print()
+            input("Press Enter when ready...")
 
     # Step 3: Verify domain
     print(f"[3/4] Verifying domain ownership...")
 
     # Wait a moment for DNS/web server
-    time.sleep(2)
+    if challenge_file:
+        time.sleep(2)
 
     try:
         with httpx.Client(timeout=60) as client:
-            response = client.post(f"{API_URL}/v1/certificate/verify/{challenge_id}")
+            if csr_pem:
+                # Server checks the challenge and only signs our CSR
+                response = client.post(f"{API_URL}/v1/certificate/sign", json={
+                    "csr": csr_pem.decode(),
+                    "challenge_ids": [challenge_id],
+                    "account_key": load_account_key()
+                })
+            else:
+                response = client.post(f"{API_URL}/v1/certificate/verify/{challenge_id}")
             response.raise_for_status()
             result = response.json()
     except httpx.HTTPError as e:
         print_error(f"Domain verification failed: {e}")
-        print_info("Make sure your web server is running and the challenge file is accessible.")
+        if challenge_type == "dns-01":
+            print_info("Make sure the TXT record is published and visible from the internet.")
+        else:
+            print_info("Make sure your web server is running and the challenge file is accessible.")
         sys.exit(1)
 
     if not result.get("success"):
@@ -147,20 +304,28 @@ def get_certificate(domain: str, algorithm: str = "hybrid", email: str = None):
         sys.exit(1)
 
     print_success("Domain verified!")
+    if result.get("deduplicated"):
+        print_info("A certificate was issued for this domain recently; using it (--force-new for a new one)")
 
     # Step 4: Download certificates
     print(f"[4/4] Downloading certificates...")
 
     cert_id = result["certificate_id"]
-    domain_dir = CERT_DIR / domain
+    # Our key.pem stays as it is if it was reused (locally or by the server)
+    key_reused = bool(csr_pem and not key_pem) or bool(result.get("key_reused"))
 
     ensure_cert_dir()
     domain_dir.mkdir(parents=True, exist_ok=True)
 
-    files_to_download = ["cert.pem", "key.pem", "chain.pem", "fullchain.pem"]
+    files_to_download = ["cert.pem", "chain.pem", "fullchain.pem"]
+    if not csr_pem and not key_reused:
+        files_to_download.append("key.pem")
 
     try:
-        with httpx.Client(timeout=30) as client:
+        # httpx asks for every encoding it can decode (gzip; zstd/br when their
+        # packages are installed) and decodes the pre-compressed artifacts;
+        # with S3 storage the API redirects to the object store
+        with httpx.Client(timeout=30, follow_redirects=True) as client:
             for filename in files_to_download:
                 url = f"{API_URL}/v1/certificate/{cert_id}/{filename}"
                 response = client.get(url)
@@ -179,11 +344,20 @@ def get_certificate(domain: str, algorithm: str = "hybrid", email: str = None):
         print_error(f"Failed to download certificates: {e}")
         sys.exit(1)
 
+    if key_pem:
+        write_private(domain_dir / "key.pem", key_pem)
+
     # Save config
     config = {
         "domain": domain,
         "algorithm": algorithm,
         "cert_id": cert_id,
+        "key_source": "local" if csr_pem else "server",
+        "key_created_at": (previous.get("key_created_at") or previous.get("issued_at")
+                           if key_reused else datetime.utcnow().isoformat()),
+        "reuse_key": reuse_key,
+        "max_key_age_days": max_key_age,
+        "challenge_type": challenge_type,
         "issued_at": datetime.utcnow().isoformat(),
         "expires_at": result.get("expires_at"),
         "cert_dir": str(domain_dir)
@@ -192,7 +366,8 @@ def get_certificate(domain: str, algorithm: str = "hybrid", email: str = None):
 
     # Clean up challenge file
     try:
-        challenge_file.unlink()
+        if challenge_file:
+            challenge_file.unlink()
     except:
         pass
 
@@ -219,7 +394,7 @@ def get_certificate(domain: str, algorithm: str = "hybrid", email: str = None):
 """)
 
 
-def renew_certificates():
+def renew_certificates(reuse_key: bool = None, max_key_age: int = None):
     """Renew all certificates"""
     print_banner()
     print_info("Checking certificates for renewal...")
@@ -245,7 +420,10 @@ def renew_certificates():
 
         if days_left <= 30:
             print_info(f"Renewing {domain} ({days_left} days left)")
-            get_certificate(domain, config.get("algorithm", "hybrid"))
+            get_certificate(domain, config.get("algorithm", "hybrid"),
+                            server_key=config.get("key_source") == "server",
+                            reuse_key=reuse_key, max_key_age=max_key_age,
+                            dns=config.get("challenge_type") == "dns-01")
         else:
             print_success(f"{domain}: {days_left} days remaining")
 
@@ -302,6 +480,8 @@ def main():
 Examples:
   pqcert get example.com              Get a certificate
   pqcert get example.com -a ml-dsa    Get pure post-quantum cert
+  pqcert get example.com --server-key Let the server generate the key
+  pqcert get '*.example.com'          Wildcard certificate (DNS TXT validation)
   pqcert renew                        Renew all certificates
   pqcert status                       Show certificate status
 
@@ -318,9 +498,24 @@ More info: https://pqcert.org/docs
                            choices=["hybrid", "ml-dsa", "rsa"],
                            help="Algorithm: hybrid (default), ml-dsa, or rsa")
     get_parser.add_argument("-e", "--email", help="Contact email (optional)")
+    get_parser.add_argument("--server-key", action="store_true",
+                           help="Let the server generate the private key (default: generate it locally)")
+    get_parser.add_argument("--force-new", action="store_true",
+                           help="Issue a new certificate even if one was issued recently")
+    get_parser.add_argument("--dns", action="store_true",
+                           help="Validate with a DNS TXT record instead of a challenge file "
+                                "(always used for *.example.com)")
 
     # Renew command
-    subparsers.add_parser("renew", help="Renew certificates")
+    renew_parser = subparsers.add_parser("renew", help="Renew certificates")
+
+    for sub in (get_parser, renew_parser):
+        sub.add_argument("--reuse-key", action=argparse.BooleanOptionalAction, default=None,
+                         help="Keep the existing key pair when renewing (default: per-certificate "
+                              "or global setting in config.json, else off)")
+        sub.add_argument("--max-key-age", type=int, metavar="DAYS",
+                         help=f"Generate a new key once the current one is this old "
+                              f"(default: {DEFAULT_MAX_KEY_AGE_DAYS})")
 
     # Status command
     subparsers.add_parser("status", help="Show certificate status")
@@ -331,9 +526,10 @@ More info: https://pqcert.org/docs
     args = parser.parse_args()
 
     if args.command == "get":
-        get_certificate(args.domain, args.algorithm, args.email)
+        get_certificate(args.domain, args.algorithm, args.email, args.server_key,
+                        args.reuse_key, args.max_key_age, args.force_new, args.dns)
     elif args.command == "renew":
-        renew_certificates()
+        renew_certificates(args.reuse_key, args.max_key_age)
     elif args.command == "status":
         show_status()
     else:
@@ -9,17 +9,39 @@ Usage:
     pqcert localhost              # Generate & install localhost cert
     pqcert localhost --install    # Install root CA to system
     pqcert localhost --uninstall  # Remove root CA from system
+    pqcert localhost proxy        # HTTPS proxy minting certs for any *.localhost
 """
 
+import hashlib
+import ipaddress
 import os
+import re
+import shutil
 import sys
+import ssl
+import socket
+import socketserver
 import subprocess
 import platform
-import shutil
+import threading
+from collections import OrderedDict
+from fnmatch import fnmatch
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import tempfile
 
+try:
+    from cryptography import x509
+except ImportError:
+    print("Installing required dependencies...")
+    subprocess.run([sys.executable, "-m", "pip", "install", "cryptography", "-q"])
+    from cryptography import x509
+from cryptography.exceptions import UnsupportedAlgorithm
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+
 # ============== Configuration ==============
 
 PQCERT_DIR = Path.home() / ".pqcert"
@@ -43,6 +65,40 @@ LOCALHOST_DOMAINS = [
     "*.test.local",
 ]
 
+# Key types: name -> (openssl algorithm, pkeyopts, signing digest, leaf keyUsage)
+# Ed25519 signs without a separate digest; RSA leaves also need keyEncipherment
+# for the (legacy) RSA key exchange.
+KEY_TYPES = {
+    "ecdsa-p256": ("EC", ["ec_paramgen_curve:P-256"], "sha256", "digitalSignature"),
+    "ecdsa-p384": ("EC", ["ec_paramgen_curve:P-384"], "sha384", "digitalSignature"),
+    "ed25519": ("ED25519", [], None, "digitalSignature"),
+    "rsa-2048": ("RSA", ["rsa_keygen_bits:2048"], "sha256", "digitalSignature,keyEncipherment"),
+    "rsa-3072": ("RSA", ["rsa_keygen_bits:3072"], "sha256", "digitalSignature,keyEncipherment"),
+    "rsa-4096": ("RSA", ["rsa_keygen_bits:4096"], "sha256", "digitalSignature,keyEncipherment"),
+    # Post-quantum (FIPS 204): generated by the openssl CLI, which must be 3.5+
+    "ml-dsa-44": ("ML-DSA-44", [], None, "digitalSignature"),
+    "ml-dsa-65": ("ML-DSA-65", [], None, "digitalSignature"),
+    "ml-dsa-87": ("ML-DSA-87", [], None, "digitalSignature"),
+}
+# Browsers reject server certificate chains signed with these (curl, openssl
+# and most language runtimes accept them)
+BROWSER_UNSUPPORTED_KEY_TYPES = {"ed25519", "ml-dsa-44", "ml-dsa-65", "ml-dsa-87"}
+# ECDSA P-256: cheapest keygen and handshake signature that every browser accepts
+DEFAULT_KEY_TYPE = "ecdsa-p256"
+DEFAULT_CA_KEY_TYPE = "ecdsa-p256"
+
+# SNI proxy: hostnames minted on demand and where their certificates are kept
+SNI_PATTERNS = ["localhost", "*.localhost"]
+SNI_CERTS_DIR = CERTS_DIR / "sni"
+SNI_CACHE_SIZE = 128
+# Leaf certificates are valid for 825 days; re-mint well before that
+SNI_MAX_AGE_DAYS = 800
+
+# Artifact formats produced by the export stage
+EXPORT_FORMATS = ["pem", "crt", "der", "fullchain", "pfx", "jks"]
+DEFAULT_EXPORT_FORMATS = ["pem", "crt", "fullchain", "pfx"]
+PFX_PASSWORD = "pqcert"
+
 # Colors
 class C:
     GREEN = '\033[92m'
@@ -114,193 +170,391 @@ def check_openssl():
         return False
 
 
-def generate_root_ca():
+def openssl_supports(key_type: str) -> bool:
+    """Whether the openssl CLI can sign with key_type (ML-DSA needs 3.5+)"""
+    try:
+        result = subprocess.run(["openssl", "list", "-signature-algorithms"],
+                                capture_output=True, text=True)
+    except FileNotFoundError:
+        return False
+    return result.returncode == 0 and KEY_TYPES[key_type][0] in result.stdout
+
+
+def key_type_args(key_type: str, flag: str) -> list:
+    """openssl arguments generating a key of key_type (flag: -algorithm or -newkey)"""
+    algorithm, pkeyopts, _, _ = KEY_TYPES[key_type]
+    args = [flag, algorithm]
+    for opt in pkeyopts:
+        args += ["-pkeyopt", opt]
+    return args
+
+
+def digest_args(key_type: str) -> list:
+    """openssl digest argument for signing with a key of key_type"""
+    digest = KEY_TYPES[key_type][2]
+    return [f"-{digest}"] if digest else []
+
+
+def openssl_only(key_type: str) -> bool:
+    """Key types the cryptography package can't generate (ML-DSA)"""
+    return KEY_TYPES[key_type][0].startswith("ML-DSA")
+
+
+def new_private_key(key_type: str):
+    """Generate a key of a classical key_type in-process"""
+    algorithm, pkeyopts, _, _ = KEY_TYPES[key_type]
+    opts = dict(opt.split(":", 1) for opt in pkeyopts)
+    if algorithm == "EC":
+        curve = {"P-256": ec.SECP256R1, "P-384": ec.SECP384R1}[opts["ec_paramgen_curve"]]
+        return ec.generate_private_key(curve())
+    if algorithm == "RSA":
+        return rsa.generate_private_key(public_exponent=65537, key_size=int(opts["rsa_keygen_bits"]))
+    if algorithm == "ED25519":
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError(f"{key_type} keys need the openssl CLI")
+
+
+def signing_hash(key):
+    """Digest for signing with key: none for Ed25519, SHA-384 for P-384, else SHA-256"""
+    if isinstance(key, ed25519.Ed25519PrivateKey):
+        return None
+    if isinstance(key, ec.EllipticCurvePrivateKey) and key.curve.key_size >= 384:
+        return hashes.SHA384()
+    return hashes.SHA256()
+
+
+def key_to_pem(key) -> bytes:
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption())
+
+
+def generate_root_ca(key_type: str = DEFAULT_CA_KEY_TYPE):
     """Generate PQCert Root CA"""
 
     if CA_KEY.exists() and CA_CERT.exists():
         print_info("Root CA already exists, using existing CA")
         return True
 
-    print_step(1, 4, "Generating Root CA private key...")
-
-    # Generate CA private key
-    result = subprocess.run([
-        "openssl", "genrsa",
-        "-out", str(CA_KEY),
-        "4096"
-    ], capture_output=True, text=True)
+    print_step(1, 4, f"Generating Root CA ({key_type})...")
 
-    if result.returncode != 0:
-        print_error(f"Failed to generate CA key: {result.stderr}")
+    try:
+        key_pem, cert_pem = issue_ca_cert(key_type)
+    except subprocess.CalledProcessError as e:
+        print_error(f"Failed to generate CA: {e.stderr.decode(errors='replace')}")
         return False
 
-    os.chmod(CA_KEY, 0o600)
+    print_step(2, 4, "Writing Root CA certificate...")
 
-    print_step(2, 4, "Creating Root CA certificate...")
+    atomic_write(CA_KEY, key_pem, 0o600)
+    atomic_write(CA_CERT, cert_pem)
+    # Also create .crt version for Windows
+    atomic_write(CA_CERT_CRT, cert_pem)
 
-    # CA config
-    ca_config = f"""
-[req]
-distinguished_name = req_distinguished_name
-x509_extensions = v3_ca
-prompt = no
+    print_success("Root CA generated successfully!")
+    return True
 
-[req_distinguished_name]
-CN = PQCert Local Development CA
-O = PQCert
-OU = Local Development
-C = US
 
-[v3_ca]
-basicConstraints = critical, CA:TRUE, pathlen:0
-keyUsage = critical, keyCertSign, cRLSign
-subjectKeyIdentifier = hash
-authorityKeyIdentifier = keyid:always, issuer
-"""
+def split_pem_blocks(data: bytes) -> dict:
+    """Split concatenated PEM output into its key and certificate blocks"""
+    blocks = {"key": b"", "certs": []}
+    current = []
+    for line in data.splitlines(keepends=True):
+        if line.startswith(b"-----BEGIN "):
+            current = [line]
+        elif line.startswith(b"-----END "):
+            current.append(line)
+            block = b"".join(current)
+            if b"PRIVATE KEY" in line:
+                blocks["key"] = block
+            elif b"CERTIFICATE" in line:
+                blocks["certs"].append(block)
+            current = []
+        elif current:
+            current.append(line)
+    return blocks
+
+
+def atomic_write(path: Path, data: bytes, mode: int = 0o644):
+    """Write a file via temp-and-rename so readers never see partial output"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        os.chmod(tmp_path, mode)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def build_pkcs12(key_pem: bytes, cert_pem: bytes, ca_pem: bytes, name: str,
+                 java_compat: bool = False) -> bytes:
+    """Build a PKCS#12 bundle from in-memory PEM data (no files)"""
+    try:
+        key = serialization.load_pem_private_key(key_pem, password=None)
+    except UnsupportedAlgorithm:
+        return _openssl_pkcs12(key_pem, cert_pem, ca_pem, name, java_compat)
+
+    if java_compat:
+        # 3DES/SHA1 bags are readable by every keytool, incl. Java 8 "JKS" keystores
+        encryption = (
+            serialization.PrivateFormat.PKCS12.encryption_builder()
+            .kdf_rounds(2048)
+            .key_cert_algorithm(pkcs12.PBES.PBESv1SHA1And3KeyTripleDESCBC)
+            .hmac_hash(hashes.SHA1())
+            .build(PFX_PASSWORD.encode())
+        )
+    else:
+        encryption = serialization.BestAvailableEncryption(PFX_PASSWORD.encode())
+    return pkcs12.serialize_key_and_certificates(
+        name.encode(), key, x509.load_pem_x509_certificate(cert_pem),
+        x509.load_pem_x509_certificates(ca_pem), encryption,
+    )
 
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.cnf', delete=False) as f:
-        f.write(ca_config)
-        ca_config_path = f.name
 
+def _openssl_pkcs12(key_pem: bytes, cert_pem: bytes, ca_pem: bytes, name: str,
+                    java_compat: bool = False) -> bytes:
+    """PKCS#12 for keys cryptography can't load (ML-DSA), via openssl pkcs12"""
+    cmd = [
+        "openssl", "pkcs12",
+        "-export",
+        "-name", name,
+        "-passout", f"pass:{PFX_PASSWORD}",
+    ]
+    if java_compat:
+        # 3DES/SHA1 bags are readable by every keytool, incl. Java 8 "JKS" keystores
+        cmd += [
+            "-keypbe", "PBE-SHA1-3DES",
+            "-certpbe", "PBE-SHA1-3DES",
+            "-macalg", "sha1",
+        ]
+    result = subprocess.run(cmd, input=key_pem + cert_pem + ca_pem,
+                            capture_output=True, check=True)
+    return result.stdout
+
+
+def export_artifacts(out_dir: Path, name: str, key_pem: bytes, cert_pem: bytes,
+                     ca_pem: bytes, formats=DEFAULT_EXPORT_FORMATS) -> dict:
+    """
+    Export an in-memory key and certificate to every requested format in one pass.
+
+    Each file is written atomically; formats not requested are not produced.
+    Returns a mapping of format name to written path.
+    """
+    unknown = set(formats) - set(EXPORT_FORMATS)
+    if unknown:
+        raise ValueError(f"Unknown export format(s): {', '.join(sorted(unknown))}")
+
+    written = {}
+
+    def emit(fmt, filename, data, mode=0o644):
+        path = out_dir / filename
+        atomic_write(path, data, mode)
+        written[fmt] = path
+
+    # The key is always emitted: every other format is useless without it
+    emit("key", f"{name}-key.pem", key_pem, 0o600)
+
+    if "pem" in formats:
+        emit("pem", f"{name}.pem", cert_pem)
+    if "crt" in formats:
+        emit("crt", f"{name}.crt", cert_pem)
+    if "der" in formats:
+        emit("der", f"{name}.der", ssl.PEM_cert_to_DER_cert(cert_pem.decode()))
+    if "fullchain" in formats:
+        emit("fullchain", f"{name}-fullchain.pem", cert_pem + ca_pem)
+    if "pfx" in formats:
+        emit("pfx", f"{name}.pfx", build_pkcs12(key_pem, cert_pem, ca_pem, name), 0o600)
+    if "jks" in formats:
+        emit("jks", f"{name}.jks",
+             build_pkcs12(key_pem, cert_pem, ca_pem, name, java_compat=True), 0o600)
+
+    return written
+
+
+def is_ip_address(name: str) -> bool:
     try:
-        result = subprocess.run([
-            "openssl", "req",
-            "-x509", "-new", "-nodes",
-            "-key", str(CA_KEY),
-            "-sha256",
-            "-days", "3650",  # 10 years
-            "-out", str(CA_CERT),
-            "-config", ca_config_path
-        ], capture_output=True, text=True)
-
-        if result.returncode != 0:
-            print_error(f"Failed to generate CA certificate: {result.stderr}")
-            return False
+        ipaddress.ip_address(name)
+        return True
+    except ValueError:
+        return False
 
-        # Also create .crt version for Windows
-        shutil.copy(CA_CERT, CA_CERT_CRT)
 
-    finally:
-        os.unlink(ca_config_path)
+def san_extension(domains) -> str:
+    """Build an openssl subjectAltName extension value from a list of names and IPs"""
+    entries = [f"IP:{d}" if is_ip_address(d) else f"DNS:{d}" for d in domains]
+    return "subjectAltName=" + ",".join(entries)
+
+
+def subject_alt_names(domains) -> x509.SubjectAlternativeName:
+    return x509.SubjectAlternativeName([
+        x509.IPAddress(ipaddress.ip_address(d)) if is_ip_address(d) else x509.DNSName(d)
+        for d in domains
+    ])
+
+
+def issue_ca_cert(key_type: str = DEFAULT_CA_KEY_TYPE,
+                  common_name: str = "PQCert Local Development CA") -> tuple:
+    """
+    Generate a self-signed CA key and certificate.
+
+    Key and certificate are returned as PEM bytes; nothing touches disk.
+    Classical key types are generated in-process; ML-DSA goes through the
+    openssl CLI (3.5+).
+    """
+    if openssl_only(key_type):
+        return _openssl_ca_cert(key_type, common_name)
+
+    key = new_private_key(key_type)
+    name = x509.Name([
+        x509.NameAttribute(NameOID.COMMON_NAME, common_name),
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, "PQCert"),
+        x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, "Local Development"),
+        x509.NameAttribute(NameOID.COUNTRY_NAME, "US"),
+    ])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + timedelta(days=3650))  # 10 years
+        .add_extension(x509.BasicConstraints(ca=True, path_length=0), critical=True)
+        .add_extension(x509.KeyUsage(
+            digital_signature=False, content_commitment=False, key_encipherment=False,
+            data_encipherment=False, key_agreement=False, key_cert_sign=True,
+            crl_sign=True, encipher_only=False, decipher_only=False,
+        ), critical=True)
+        .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False)
+        .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(key.public_key()),
+                       critical=False)
+        .sign(key, signing_hash(key))
+    )
+    return key_to_pem(key), cert.public_bytes(serialization.Encoding.PEM)
 
-    print_success("Root CA generated successfully!")
-    return True
 
+def _openssl_ca_cert(key_type: str, common_name: str) -> tuple:
+    result = subprocess.run([
+        "openssl", "req",
+        "-x509", "-new",
+        *key_type_args(key_type, "-newkey"),
+        "-noenc",
+        "-keyout", "-",
+        "-out", "-",
+        *digest_args(key_type),
+        "-days", "3650",  # 10 years
+        "-subj", f"/CN={common_name}/O=PQCert/OU=Local Development/C=US",
+        "-addext", "basicConstraints=critical,CA:TRUE,pathlen:0",
+        "-addext", "keyUsage=critical,keyCertSign,cRLSign",
+        "-addext", "subjectKeyIdentifier=hash",
+        "-addext", "authorityKeyIdentifier=keyid:always,issuer",
+    ], capture_output=True, check=True)
+
+    blocks = split_pem_blocks(result.stdout)
+    if not blocks["key"] or not blocks["certs"]:
+        raise RuntimeError("openssl did not return a key and certificate")
+    return blocks["key"], blocks["certs"][0]
 
-def generate_localhost_cert():
-    """Generate localhost certificate signed by our CA"""
 
-    localhost_dir = CERTS_DIR / "localhost"
-    localhost_dir.mkdir(parents=True, exist_ok=True)
+def issue_leaf_cert(common_name: str, domains, key_type: str = DEFAULT_KEY_TYPE,
+                    ca_cert: Path = None, ca_key: Path = None) -> tuple:
+    """
+    Generate a key and sign a leaf certificate with our CA.
 
-    key_file = localhost_dir / "localhost-key.pem"
-    csr_file = localhost_dir / "localhost.csr"
-    cert_file = localhost_dir / "localhost.pem"
-    cert_crt = localhost_dir / "localhost.crt"
-    cert_pfx = localhost_dir / "localhost.pfx"
-    fullchain = localhost_dir / "localhost-fullchain.pem"
+    Key and certificate are returned as PEM bytes; nothing but the CA is read
+    from disk. An ML-DSA leaf or CA key goes through the openssl CLI (3.5+).
+    """
+    ca_cert_path, ca_key_path = Path(ca_cert or CA_CERT), Path(ca_key or CA_KEY)
+    try:
+        signer = serialization.load_pem_private_key(ca_key_path.read_bytes(), password=None)
+    except UnsupportedAlgorithm:
+        signer = None
+    if signer is None or openssl_only(key_type):
+        return _openssl_leaf_cert(common_name, domains, key_type, ca_cert_path, ca_key_path)
+
+    issuer = x509.load_pem_x509_certificate(ca_cert_path.read_bytes())
+    key = new_private_key(key_type)
+    key_usage = KEY_TYPES[key_type][3].split(",")
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(x509.Name([
+            x509.NameAttribute(NameOID.COMMON_NAME, common_name),
+            x509.NameAttribute(NameOID.ORGANIZATION_NAME, "PQCert"),
+            x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, "Local Development"),
+        ]))
+        .issuer_name(issuer.subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + timedelta(days=825))  # Max for browser trust
+        .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=False)
+        .add_extension(x509.KeyUsage(
+            digital_signature="digitalSignature" in key_usage, content_commitment=False,
+            key_encipherment="keyEncipherment" in key_usage, data_encipherment=False,
+            key_agreement=False, key_cert_sign=False, crl_sign=False,
+            encipher_only=False, decipher_only=False,
+        ), critical=True)
+        .add_extension(x509.ExtendedKeyUsage([ExtendedKeyUsageOID.SERVER_AUTH,
+                                              ExtendedKeyUsageOID.CLIENT_AUTH]), critical=False)
+        .add_extension(subject_alt_names(domains), critical=False)
+        .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False)
+        .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(signer.public_key()),
+                       critical=False)
+        .sign(signer, signing_hash(signer))
+    )
+    return key_to_pem(key), cert.public_bytes(serialization.Encoding.PEM)
 
-    print_step(3, 4, "Generating localhost certificate...")
 
-    # Generate private key
-    subprocess.run([
-        "openssl", "genrsa",
-        "-out", str(key_file),
-        "2048"
+def _openssl_leaf_cert(common_name: str, domains, key_type: str,
+                       ca_cert: Path, ca_key: Path) -> tuple:
+    key_usage = KEY_TYPES[key_type][3]
+    result = subprocess.run([
+        "openssl", "req",
+        "-x509", "-new",
+        *key_type_args(key_type, "-newkey"),
+        "-noenc",
+        "-keyout", "-",
+        "-out", "-",
+        "-CA", str(ca_cert),
+        "-CAkey", str(ca_key),
+        "-days", "825",  # Max for browser trust
+        "-subj", f"/CN={common_name}/O=PQCert/OU=Local Development",
+        "-addext", "basicConstraints=CA:FALSE",
+        "-addext", f"keyUsage=critical,{key_usage}",
+        "-addext", "extendedKeyUsage=serverAuth,clientAuth",
+        "-addext", san_extension(domains),
     ], capture_output=True, check=True)
 
-    os.chmod(key_file, 0o600)
-
-    # Create SAN config
-    san_entries = []
-    ip_count = 1
-    dns_count = 1
-
-    for domain in LOCALHOST_DOMAINS:
-        if domain.replace(".", "").replace(":", "").isdigit() or ":" in domain:
-            san_entries.append(f"IP.{ip_count} = {domain}")
-            ip_count += 1
-        else:
-            san_entries.append(f"DNS.{dns_count} = {domain}")
-            dns_count += 1
-
-    cert_config = f"""
-[req]
-distinguished_name = req_distinguished_name
-req_extensions = v3_req
-prompt = no
-
-[req_distinguished_name]
-CN = localhost
-O = PQCert
-OU = Local Development
-
-[v3_req]
-basicConstraints = CA:FALSE
-keyUsage = critical, digitalSignature, keyEncipherment
-extendedKeyUsage = serverAuth, clientAuth
-subjectAltName = @alt_names
-
-[alt_names]
-{chr(10).join(san_entries)}
-"""
+    blocks = split_pem_blocks(result.stdout)
+    if not blocks["key"] or not blocks["certs"]:
+        raise RuntimeError("openssl did not return a key and certificate")
+    return blocks["key"], blocks["certs"][0]
 
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.cnf', delete=False) as f:
-        f.write(cert_config)
-        cert_config_path = f.name
 
-    try:
-        # Generate CSR
-        subprocess.run([
-            "openssl", "req",
-            "-new",
-            "-key", str(key_file),
-            "-out", str(csr_file),
-            "-config", cert_config_path
-        ], capture_output=True, check=True)
-
-        # Sign with CA
-        subprocess.run([
-            "openssl", "x509",
-            "-req",
-            "-in", str(csr_file),
-            "-CA", str(CA_CERT),
-            "-CAkey", str(CA_KEY),
-            "-CAcreateserial",
-            "-out", str(cert_file),
-            "-days", "825",  # Max for browser trust
-            "-sha256",
-            "-extensions", "v3_req",
-            "-extfile", cert_config_path
-        ], capture_output=True, check=True)
-
-        # Create .crt copy
-        shutil.copy(cert_file, cert_crt)
-
-        # Create fullchain (cert + CA)
-        with open(fullchain, 'w') as f:
-            f.write(cert_file.read_text())
-            f.write(CA_CERT.read_text())
-
-        # Create PFX/P12 for Windows/Java
-        subprocess.run([
-            "openssl", "pkcs12",
-            "-export",
-            "-out", str(cert_pfx),
-            "-inkey", str(key_file),
-            "-in", str(cert_file),
-            "-certfile", str(CA_CERT),
-            "-password", "pass:pqcert"
-        ], capture_output=True, check=True)
-
-        # Clean up CSR
-        csr_file.unlink()
+def generate_localhost_cert(formats=DEFAULT_EXPORT_FORMATS, key_type: str = DEFAULT_KEY_TYPE):
+    """Generate localhost certificate signed by our CA"""
 
-    finally:
-        os.unlink(cert_config_path)
+    localhost_dir = CERTS_DIR / "localhost"
+    localhost_dir.mkdir(parents=True, exist_ok=True)
+
+    print_step(3, 4, f"Generating localhost certificate ({key_type})...")
+
+    try:
+        key_pem, cert_pem = issue_leaf_cert("localhost", LOCALHOST_DOMAINS, key_type)
+    except subprocess.CalledProcessError as e:
+        print_error(f"Failed to generate certificate: {e.stderr.decode(errors='replace')}")
+        return None
+    written = export_artifacts(localhost_dir, "localhost", key_pem, cert_pem,
+                               CA_CERT.read_bytes(), formats)
 
     print_success("Localhost certificate generated!")
-    return localhost_dir
+    return written
 
 
 def install_ca_macos():
@@ -322,47 +576,70 @@ def install_ca_macos():
         return False
 
 
+# Linux trust stores: (anchor path, update command, bundle the command rebuilds)
+LINUX_TRUST_STORES = [
+    ("/usr/local/share/ca-certificates/pqcert-ca.crt",  # Debian/Ubuntu
+     ["update-ca-certificates"], "/etc/ssl/certs/ca-certificates.crt"),
+    ("/etc/pki/ca-trust/source/anchors/pqcert-ca.crt",  # RHEL/CentOS/Fedora
+     ["update-ca-trust", "extract"], "/etc/pki/ca-trust/extracted/pem/tls-ca-bundle.pem"),
+    ("/etc/ca-certificates/trust-source/anchors/pqcert-ca.crt",  # Arch
+     ["trust", "extract-compat"], "/etc/ssl/certs/ca-certificates.crt"),
+]
+
+PEM_CERT_RE = re.compile(r"-----BEGIN CERTIFICATE-----.+?-----END CERTIFICATE-----", re.S)
+
+
+def pem_fingerprints(path) -> set:
+    """SHA-256 fingerprints of every certificate in a PEM file (empty if unreadable)"""
+    try:
+        text = Path(path).read_text(errors="replace")
+    except OSError:
+        return set()
+    fingerprints = set()
+    for block in PEM_CERT_RE.findall(text):
+        try:
+            fingerprints.add(hashlib.sha256(ssl.PEM_cert_to_DER_cert(block)).hexdigest())
+        except ValueError:
+            continue
+    return fingerprints
+
+
+def detect_linux_trust_store():
+    """The (anchor, update command, bundle) entry for this distro, or None"""
+    for anchor, command, bundle in LINUX_TRUST_STORES:
+        if os.path.isdir(os.path.dirname(anchor)) and shutil.which(command[0]):
+            return anchor, command, bundle
+    return None
+
+
 def install_ca_linux():
     """Install CA to Linux trust store"""
     print_info("Installing CA to Linux trust store...")
 
-    # Detect distro and copy to appropriate location
-    ca_paths = [
-        "/usr/local/share/ca-certificates/pqcert-ca.crt",  # Debian/Ubuntu
-        "/etc/pki/ca-trust/source/anchors/pqcert-ca.crt",  # RHEL/CentOS/Fedora
-        "/etc/ca-certificates/trust-source/anchors/pqcert-ca.crt",  # Arch
-    ]
-
-    installed = False
-    for ca_path in ca_paths:
-        ca_dir = os.path.dirname(ca_path)
-        if os.path.exists(ca_dir):
-            try:
-                subprocess.run(["sudo", "cp", str(CA_CERT_CRT), ca_path], check=True)
-                installed = True
-                break
-            except subprocess.CalledProcessError:
-                continue
-
-    if not installed:
+    store = detect_linux_trust_store()
+    if store is None:
         print_warning("Could not find CA certificates directory")
         return False
+    anchor, command, bundle = store
 
-    # Update CA trust
-    update_commands = [
-        ["sudo", "update-ca-certificates"],  # Debian/Ubuntu
-        ["sudo", "update-ca-trust", "extract"],  # RHEL/CentOS/Fedora
-        ["sudo", "trust", "extract-compat"],  # Arch
-    ]
+    # Rebuilding the bundle takes seconds; skip whatever is already done
+    fingerprint = hashlib.sha256(ssl.PEM_cert_to_DER_cert(CA_CERT_CRT.read_text())).hexdigest()
+    anchor_current = fingerprint in pem_fingerprints(anchor)
+    if anchor_current and fingerprint in pem_fingerprints(bundle):
+        print_success("CA already trusted by the Linux trust store")
+        return True
 
-    for cmd in update_commands:
+    if not anchor_current:
         try:
-            result = subprocess.run(cmd, capture_output=True)
-            if result.returncode == 0:
-                print_success("CA installed to Linux trust store")
-                return True
-        except FileNotFoundError:
-            continue
+            subprocess.run(["sudo", "cp", str(CA_CERT_CRT), anchor], check=True)
+        except subprocess.CalledProcessError:
+            print_error(f"Failed to copy CA to {anchor}")
+            return False
+
+    result = subprocess.run(["sudo", *command], capture_output=True)
+    if result.returncode == 0:
+        print_success("CA installed to Linux trust store")
+        return True
 
     print_warning("CA copied but trust store not updated")
     return True
@@ -428,14 +705,12 @@ def uninstall_ca():
             "/Library/Keychains/System.keychain"
         ])
     elif plat == "linux":
-        for path in [
-            "/usr/local/share/ca-certificates/pqcert-ca.crt",
-            "/etc/pki/ca-trust/source/anchors/pqcert-ca.crt",
-            "/etc/ca-certificates/trust-source/anchors/pqcert-ca.crt",
-        ]:
+        for path, _, _ in LINUX_TRUST_STORES:
             if os.path.exists(path):
                 subprocess.run(["sudo", "rm", "-f", path])
-        subprocess.run(["sudo", "update-ca-certificates"], capture_output=True)
+        store = detect_linux_trust_store()
+        if store is not None:
+            subprocess.run(["sudo", *store[1]], capture_output=True)
     elif plat == "windows":
         subprocess.run([
             "certutil", "-delstore", "ROOT", "PQCert Local Development CA"
@@ -444,53 +719,246 @@ def uninstall_ca():
     print_success("CA removed from system trust store")
 
 
-def print_certificate_info(cert_dir: Path):
-    """Print certificate file locations and usage"""
-
-    print(f"""
-{C.GREEN}{'═' * 60}{C.END}
-{C.BOLD}🎉 Localhost certificates ready!{C.END}
-{C.GREEN}{'═' * 60}{C.END}
-
-{C.BOLD}📁 Certificate Files:{C.END}
+# ============== SNI Proxy ==============
+
+HOSTNAME_RE = re.compile(r'^(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)*[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?$')
+
+
+class SNICertCache:
+    """
+    Mints leaf certificates for SNI hostnames on first use.
+
+    SSLContexts live in a size-bounded LRU; the certificates themselves are
+    kept under SNI_CERTS_DIR so a restart (or LRU eviction) reloads them from
+    disk instead of minting again.
+    """
+
+    def __init__(self, patterns=SNI_PATTERNS, size=SNI_CACHE_SIZE, key_type=DEFAULT_KEY_TYPE):
+        self.patterns = patterns
+        self.size = size
+        self.key_type = key_type
+        self.contexts = OrderedDict()
+        self.lock = threading.Lock()
+        self.mint_lock = threading.Lock()
+        self.minted = 0
+        SNI_CERTS_DIR.mkdir(parents=True, exist_ok=True)
+
+    def matches(self, hostname: str) -> bool:
+        return bool(HOSTNAME_RE.match(hostname)) and any(
+            fnmatch(hostname, pattern) for pattern in self.patterns)
+
+    def get(self, hostname: str):
+        """Return an SSLContext for hostname, or None if it doesn't match a pattern"""
+        hostname = hostname.lower().rstrip(".")
+        if not self.matches(hostname):
+            return None
+
+        with self.lock:
+            context = self.contexts.get(hostname)
+            if context is not None:
+                self.contexts.move_to_end(hostname)
+                return context
+
+        # One mint at a time; a concurrent first connection for the same
+        # hostname waits here and then picks up the files from disk.
+        with self.mint_lock:
+            cert_file, key_file = self._ensure_on_disk(hostname)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert_file, key_file)
+
+        with self.lock:
+            self.contexts[hostname] = context
+            self.contexts.move_to_end(hostname)
+            while len(self.contexts) > self.size:
+                self.contexts.popitem(last=False)
+        return context
+
+    def _ensure_on_disk(self, hostname: str):
+        host_dir = SNI_CERTS_DIR / hostname
+        cert_file = host_dir / f"{hostname}-fullchain.pem"
+        key_file = host_dir / f"{hostname}-key.pem"
+
+        if cert_file.exists() and key_file.exists():
+            mtime = cert_file.stat().st_mtime
+            fresh = (datetime.now().timestamp() - mtime) < SNI_MAX_AGE_DAYS * 86400
+            # A regenerated CA invalidates everything it didn't sign
+            if fresh and mtime >= CA_CERT.stat().st_mtime:
+                return cert_file, key_file
+
+        host_dir.mkdir(parents=True, exist_ok=True)
+        key_pem, cert_pem = issue_leaf_cert(hostname, [hostname], self.key_type)
+        export_artifacts(host_dir, hostname, key_pem, cert_pem, CA_CERT.read_bytes(),
+                         formats=["fullchain"])
+        self.minted += 1
+        print_info(f"Minted certificate for {hostname}")
+        return cert_file, key_file
+
+    def sni_callback(self, ssl_sock, server_name, initial_context):
+        if not server_name:
+            return None
+        try:
+            context = self.get(server_name)
+        except (subprocess.CalledProcessError, ssl.SSLError, OSError) as e:
+            print_error(f"Could not mint certificate for {server_name}: {e}")
+            return ssl.ALERT_DESCRIPTION_INTERNAL_ERROR
+        if context is not None:
+            ssl_sock.context = context
+        return None
 
-   {C.CYAN}PEM (nginx, Apache, Node.js):{C.END}
-   • Certificate: {cert_dir}/localhost.pem
-   • Private Key: {cert_dir}/localhost-key.pem
-   • Full Chain:  {cert_dir}/localhost-fullchain.pem
 
-   {C.CYAN}CRT (General use):{C.END}
-   • Certificate: {cert_dir}/localhost.crt
+class SNIProxyHandler(socketserver.BaseRequestHandler):
+    """Terminate TLS and pipe the plaintext stream to the upstream address"""
 
-   {C.CYAN}PFX/P12 (Windows, Java, .NET):{C.END}
-   • Bundle:      {cert_dir}/localhost.pfx
-   • Password:    pqcert
+    def handle(self):
+        try:
+            tls = self.server.context.wrap_socket(self.request, server_side=True)
+        except (ssl.SSLError, OSError):
+            return
 
-{C.BOLD}📋 Supported Domains:{C.END}
-   {', '.join(LOCALHOST_DOMAINS[:6])}
-   {', '.join(LOCALHOST_DOMAINS[6:])}
+        try:
+            upstream = socket.create_connection(self.server.upstream)
+        except OSError as e:
+            print_warning(f"Upstream {self.server.upstream[0]}:{self.server.upstream[1]} unavailable: {e}")
+            tls.close()
+            return
 
-{C.BOLD}🚀 Quick Start Examples:{C.END}
+        def pipe(src, dst):
+            try:
+                while True:
+                    data = src.recv(65536)
+                    if not data:
+                        break
+                    dst.sendall(data)
+            except OSError:
+                pass
+            finally:
+                try:
+                    dst.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+
+        back = threading.Thread(target=pipe, args=(upstream, tls), daemon=True)
+        back.start()
+        pipe(tls, upstream)
+        back.join()
+        upstream.close()
+        tls.close()
+
+
+class SNIProxyServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+def run_sni_proxy(listen: str, upstream: str, patterns=SNI_PATTERNS,
+                  cache_size: int = SNI_CACHE_SIZE, key_type: str = DEFAULT_KEY_TYPE):
+    """Run a TLS-terminating proxy that mints certificates per SNI hostname"""
+
+    def parse_address(value, default_host):
+        host, _, port = value.rpartition(":")
+        return (host or default_host, int(port))
+
+    cache = SNICertCache(patterns, cache_size, key_type)
+
+    # Fallback for clients without SNI (or non-matching names): the localhost cert
+    localhost_dir = CERTS_DIR / "localhost"
+    if not (localhost_dir / "localhost-fullchain.pem").exists():
+        generate_localhost_cert(["pem", "fullchain"], key_type)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(localhost_dir / "localhost-fullchain.pem",
+                            localhost_dir / "localhost-key.pem")
+    context.sni_callback = cache.sni_callback
+
+    server = SNIProxyServer(parse_address(listen, "127.0.0.1"), SNIProxyHandler)
+    server.context = context
+    server.upstream = parse_address(upstream, "127.0.0.1")
+
+    host, port = server.server_address[:2]
+    print_success(f"SNI proxy listening on https://{host}:{port}")
+    print_info(f"Forwarding to {server.upstream[0]}:{server.upstream[1]}")
+    print_info(f"Minting on demand for: {', '.join(patterns)}")
+    print_info("Press Ctrl+C to stop")
 
-   {C.YELLOW}# Node.js / Express:{C.END}
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print()
+        print_info(f"Stopped ({cache.minted} certificate(s) minted this run)")
+    finally:
+        server.server_close()
+
+
+def print_certificate_info(written: dict):
+    """Print the files export_artifacts wrote, and usage examples for them"""
+
+    sections = []
+    pem_lines = [f"   • Certificate: {written['pem']}"] if "pem" in written else []
+    pem_lines.append(f"   • Private Key: {written['key']}")
+    if "fullchain" in written:
+        pem_lines.append(f"   • Full Chain:  {written['fullchain']}")
+    sections.append(f"   {C.CYAN}PEM (nginx, Apache, Node.js):{C.END}\n" + "\n".join(pem_lines))
+    if "crt" in written:
+        sections.append(f"""   {C.CYAN}CRT (General use):{C.END}
+   • Certificate: {written['crt']}""")
+    if "der" in written:
+        sections.append(f"""   {C.CYAN}DER (binary):{C.END}
+   • Certificate: {written['der']}""")
+    if "pfx" in written:
+        sections.append(f"""   {C.CYAN}PFX/P12 (Windows, Java, .NET):{C.END}
+   • Bundle:      {written['pfx']}
+   • Password:    {PFX_PASSWORD}""")
+    if "jks" in written:
+        sections.append(f"""   {C.CYAN}Java keystore (keytool, Java 8+):{C.END}
+   • Keystore:    {written['jks']}
+   • Password:    {PFX_PASSWORD}""")
+    files_info = "\n\n".join(sections)
+
+    # Examples only reference files that exist: any PEM certificate will do
+    # for Node.js and Flask, nginx prefers the full chain
+    key = written["key"]
+    cert = next((written[fmt] for fmt in ("pem", "crt", "fullchain") if fmt in written), None)
+    chain = written.get("fullchain", cert)
+    examples = []
+    if cert:
+        examples.append(f"""   {C.YELLOW}# Node.js / Express:{C.END}
    const https = require('https');
    const fs = require('fs');
    https.createServer({{
-     key: fs.readFileSync('{cert_dir}/localhost-key.pem'),
-     cert: fs.readFileSync('{cert_dir}/localhost.pem')
-   }}, app).listen(443);
+     key: fs.readFileSync('{key}'),
+     cert: fs.readFileSync('{cert}')
+   }}, app).listen(443);""")
+        examples.append(f"""   {C.YELLOW}# nginx:{C.END}
+   ssl_certificate     {chain};
+   ssl_certificate_key {key};""")
+        examples.append(f"""   {C.YELLOW}# Python / Flask:{C.END}
+   app.run(ssl_context=('{cert}',
+                        '{key}'))""")
+    if "pfx" in written:
+        examples.append(f"""   {C.YELLOW}# .NET / Kestrel:{C.END}
+   dotnet dev-certs https --import {written['pfx']} -p {PFX_PASSWORD}""")
+    if "jks" in written:
+        examples.append(f"""   {C.YELLOW}# Java / Spring Boot:{C.END}
+   server.ssl.key-store={written['jks']}
+   server.ssl.key-store-type=PKCS12
+   server.ssl.key-store-password={PFX_PASSWORD}""")
+    quick_start = ""
+    if examples:
+        quick_start = f"\n{C.BOLD}🚀 Quick Start Examples:{C.END}\n\n" + "\n\n".join(examples) + "\n"
 
-   {C.YELLOW}# nginx:{C.END}
-   ssl_certificate     {cert_dir}/localhost-fullchain.pem;
-   ssl_certificate_key {cert_dir}/localhost-key.pem;
+    print(f"""
+{C.GREEN}{'═' * 60}{C.END}
+{C.BOLD}🎉 Localhost certificates ready!{C.END}
+{C.GREEN}{'═' * 60}{C.END}
 
-   {C.YELLOW}# Python / Flask:{C.END}
-   app.run(ssl_context=('{cert_dir}/localhost.pem',
-                        '{cert_dir}/localhost-key.pem'))
+{C.BOLD}📁 Certificate Files:{C.END}
 
-   {C.YELLOW}# .NET / Kestrel:{C.END}
-   dotnet dev-certs https --import {cert_dir}/localhost.pfx -p pqcert
+{files_info}
 
+{C.BOLD}📋 Supported Domains:{C.END}
+   {', '.join(LOCALHOST_DOMAINS[:6])}
+   {', '.join(LOCALHOST_DOMAINS[6:])}
+{quick_start}
 {C.GREEN}{'═' * 60}{C.END}
 {C.BOLD}🔐 Your localhost is now secure!{C.END}
    Open https://localhost - no more certificate warnings!
@@ -505,23 +973,54 @@ def main():
         description="PQCert Localhost - Zero-config local SSL certificates"
     )
     parser.add_argument("command", nargs="?", default="localhost",
-                       help="Command: localhost (default), install, uninstall")
+                       help="Command: localhost (default), install, uninstall, proxy")
     parser.add_argument("--install-only", action="store_true",
                        help="Only install CA to trust store")
     parser.add_argument("--uninstall", action="store_true",
                        help="Remove CA from trust store")
     parser.add_argument("--no-install", action="store_true",
                        help="Generate certs but don't install CA")
+    parser.add_argument("--key-type", default=DEFAULT_KEY_TYPE, choices=list(KEY_TYPES),
+                       help="Key type for the localhost certificate (default: %(default)s; "
+                            "browsers reject ed25519 and ml-dsa-*)")
+    parser.add_argument("--ca-key-type", default=DEFAULT_CA_KEY_TYPE, choices=list(KEY_TYPES),
+                       help="Key type for a newly created Root CA (default: %(default)s; "
+                            "browsers reject ed25519 and ml-dsa-*)")
+    parser.add_argument("--formats", default=",".join(DEFAULT_EXPORT_FORMATS),
+                       help=f"Comma-separated artifact formats to export "
+                            f"({', '.join(EXPORT_FORMATS)}; default: %(default)s)")
+    parser.add_argument("--listen", default="127.0.0.1:8443",
+                       help="proxy: address to listen on (default: %(default)s)")
+    parser.add_argument("--upstream", default="127.0.0.1:3000",
+                       help="proxy: plain HTTP/TCP service to forward to (default: %(default)s)")
+    parser.add_argument("--pattern", action="append", dest="patterns",
+                       help="proxy: hostname glob to mint certificates for "
+                            f"(repeatable; default: {', '.join(SNI_PATTERNS)})")
+    parser.add_argument("--cache-size", type=int, default=SNI_CACHE_SIZE,
+                       help="proxy: TLS contexts kept in memory (default: %(default)s)")
 
     args = parser.parse_args()
 
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    unknown = set(formats) - set(EXPORT_FORMATS)
+    if unknown:
+        parser.error(f"unknown format(s): {', '.join(sorted(unknown))}")
+
     print_banner()
 
-    # Check OpenSSL
-    if not check_openssl():
-        print_error("OpenSSL not found. Please install OpenSSL first.")
+    # Only ML-DSA keys need the openssl CLI; everything else is generated in-process.
+    # Check before anything is written, so a failure doesn't leave a new CA behind
+    unsupported = sorted(key_type for key_type in {args.key_type, args.ca_key_type}
+                         if openssl_only(key_type) and not openssl_supports(key_type))
+    if unsupported:
+        print_error(f"Key type {', '.join(unsupported)} needs OpenSSL 3.5+ (not offered by the "
+                    "installed openssl). Please install OpenSSL 3.5 or pick another key type.")
         sys.exit(1)
 
+    for key_type in sorted({args.key_type, args.ca_key_type} & BROWSER_UNSUPPORTED_KEY_TYPES):
+        print_warning(f"{key_type} certificates are not accepted by browsers "
+                      "(fine for curl, openssl and most language runtimes)")
+
     # Uninstall
     if args.uninstall:
         uninstall_ca()
@@ -531,7 +1030,7 @@ def main():
     ensure_directories()
 
     # Generate Root CA
-    if not generate_root_ca():
+    if not generate_root_ca(args.ca_key_type):
         sys.exit(1)
 
     # Install CA only
@@ -539,15 +1038,23 @@ def main():
         install_ca()
         return
 
+    # On-demand SNI proxy
+    if args.command == "proxy":
+        run_sni_proxy(args.listen, args.upstream, args.patterns or SNI_PATTERNS,
+                      args.cache_size, args.key_type)
+        return
+
     # Generate localhost cert
-    cert_dir = generate_localhost_cert()
+    written = generate_localhost_cert(formats, args.key_type)
+    if written is None:
+        sys.exit(1)
 
     # Install CA to system
     if not args.no_install:
         install_ca()
 
     # Print info
-    print_certificate_info(cert_dir)
+    print_certificate_info(written)
 
 
 if __name__ == "__main__":
@@ -170,7 +170,7 @@ generate_ca() {
     fi
 
     # Generate CA key
-    openssl genrsa -out "$CA_KEY" 4096 2>/dev/null
+    openssl genpkey -algorithm EC -pkeyopt ec_paramgen_curve:P-256 -out "$CA_KEY" 2>/dev/null
     chmod 600 "$CA_KEY"
 
     # Generate CA certificate
@@ -203,7 +203,7 @@ generate_localhost_cert() {
     CERT_FILE="$CERT_DIR/localhost.pem"
 
     # Generate key
-    openssl genrsa -out "$KEY_FILE" 2048 2>/dev/null
+    openssl genpkey -algorithm EC -pkeyopt ec_paramgen_curve:P-256 -out "$KEY_FILE" 2>/dev/null
     chmod 600 "$KEY_FILE"
 
     # Create config with SANs
@@ -221,7 +221,7 @@ OU = Local Development
 
 [v3_req]
 basicConstraints = CA:FALSE
-keyUsage = critical, digitalSignature, keyEncipherment
+keyUsage = critical, digitalSignature
 extendedKeyUsage = serverAuth, clientAuth
 subjectAltName = @alt_names
 
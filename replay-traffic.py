@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Replay captured PQCert API traffic against a local instance
+Run: python3 replay-traffic.py capture/traffic.*.ndjson [--target http://127.0.0.1:8000] [--speed 1]
+
+Re-drives a capture written by the API with PQCERT_CAPTURE=1 (see
+backend/capture.py) with the original timing, or N times faster, and
+reports latency distributions per route next to the captured ones.
+
+Captures hold no real domains or ids, so the replay makes them up:
+every captured domain becomes <ref>.replay.test, ids returned by the
+target are substituted for the captured references in later calls
+(verify after request, downloads after issuance) and CSRs are generated
+on the fly. A stand-in challenge responder answers HTTP-01 for any token,
+and a stand-in DNS server points every name at it and serves the TXT
+records of DNS-01 challenges, so run the target with
+
+    PQCERT_DNS_SERVERS=127.0.0.1:5353 PQCERT_DATA_DIR=/tmp/pqcert-replay \\
+        uvicorn main:app --port 8000
+
+(the API fetches challenges on port 80, so the responder needs to bind it).
+The report is printed as a table; --output also writes it as JSON.
+"""
+
+import argparse
+import asyncio
+import base64
+import http.server
+import json
+import socket
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+import dns.message
+import dns.rdatatype
+import dns.rrset
+import httpx
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509 import ocsp
+from cryptography.x509.oid import NameOID
+
+CHALLENGE_PREFIX = "/.well-known/pqcert-challenge/"
+
+# DNS-01 record name -> token, filled in as the target hands out challenges
+TXT_RECORDS = {}
+
+
+# ============== Stand-in responder ==============
+
+class ChallengeHandler(http.server.BaseHTTPRequestHandler):
+    """Answers every HTTP-01 fetch with its token, like a correctly set up server"""
+
+    def do_GET(self):
+        if not self.path.startswith(CHALLENGE_PREFIX):
+            self.send_error(404)
+            return
+        body = self.path[len(CHALLENGE_PREFIX):].encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_dns(port: int, address: str):
+    """A records for every name -> address, TXT records of DNS-01 challenges; nothing else"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", port))
+
+    def run():
+        while True:
+            data, peer = sock.recvfrom(4096)
+            try:
+                query = dns.message.from_wire(data)
+            except Exception:
+                continue
+            response = dns.message.make_response(query)
+            question = query.question[0]
+            if question.rdtype == dns.rdatatype.A:
+                response.answer.append(dns.rrset.from_text(question.name, 60, "IN", "A", address))
+            elif question.rdtype == dns.rdatatype.TXT:
+                token = TXT_RECORDS.get(question.name.to_text(omit_final_dot=True).lower())
+                if token:
+                    response.answer.append(dns.rrset.from_text(question.name, 60, "IN", "TXT", f'"{token}"'))
+            sock.sendto(response.to_wire(), peer)
+
+    threading.Thread(target=run, name="replay-dns", daemon=True).start()
+
+
+def start_responder(http_port: int, dns_port: int, address: str):
+    server = http.server.ThreadingHTTPServer((address, http_port), ChallengeHandler)
+    threading.Thread(target=server.serve_forever, name="replay-http01", daemon=True).start()
+    serve_dns(dns_port, address)
+
+
+# ============== Replay ==============
+
+def load_capture(paths: list) -> list:
+    events = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    events.append(json.loads(line))
+    events.sort(key=lambda e: e["at"])
+    return events
+
+
+def percentile(values: list, p: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))]
+
+
+class Replayer:
+
+    def __init__(self, client: httpx.AsyncClient, events: list, speed: float,
+                 concurrency: int, dependency_timeout: float):
+        self.client = client
+        self.events = events
+        self.speed = speed
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.dependency_timeout = dependency_timeout
+        self.results = []
+        # Captured reference -> id returned by the target (None if that call failed)
+        self.ids = {}
+        self.challenge_domains = {}
+        self.issued = []
+        self.ocsp_requests = {}
+        # References some earlier event in this capture produces; only those are waited for
+        self.produced = {ref for e in events for ref in e.get("refs", {}).values()}
+
+    def resolved(self, ref: str):
+        loop = asyncio.get_running_loop()
+        if ref not in self.ids:
+            self.ids[ref] = loop.create_future()
+        return self.ids[ref]
+
+    async def lookup(self, ref: str | None) -> str:
+        """The target's id for a captured reference; a random (unknown) id otherwise"""
+        if ref and ref in self.produced:
+            try:
+                value = await asyncio.wait_for(asyncio.shield(self.resolved(ref)),
+                                               self.dependency_timeout)
+                if value:
+                    return value
+            except asyncio.TimeoutError:
+                pass
+        return str(uuid.uuid4())
+
+    @staticmethod
+    def domain(ref: str) -> str:
+        return f"r{ref[:12]}.replay.test"
+
+    @staticmethod
+    def account_key(client_ref: str) -> str:
+        return f"replay-account-{client_ref}".ljust(32, "0")
+
+    async def build(self, event: dict) -> dict | None:
+        """httpx request arguments for a captured event; None if it can't be replayed"""
+        route = event["route"]
+        body = event.get("body", {})
+        fields = body.get("fields", [])
+        headers = {"Accept-Encoding": event.get("accept_encoding", "identity")}
+        # The API only accepts Idempotency-Key together with account_key
+        if "idempotency_key" in event and "account_key" in fields:
+            headers["Idempotency-Key"] = f"replay-{event['idempotency_key']}"
+        request = {"method": event["method"], "headers": headers}
+
+        if route == "/v1/certificate/request":
+            domain = self.domain(body.get("domain", event["client"]))
+            payload = {"domain": f"*.{domain}" if body.get("wildcard") else domain,
+                       "algorithm": body.get("algorithm", "hybrid")}
+            if "challenge_type" in body:
+                payload["challenge_type"] = body["challenge_type"]
+            if "email" in fields:
+                payload["email"] = "replay@example.com"
+            if "account_key" in fields:
+                payload["account_key"] = self.account_key(event["client"])
+            if "reuse_key_from" in fields:
+                payload["reuse_key_from"] = await self.lookup(body.get("reuse_key_from"))
+            if "max_key_age_days" in body:
+                payload["max_key_age_days"] = body["max_key_age_days"]
+            request.update(url=route, json=payload)
+        elif route == "/v1/certificate/sign":
+            challenge_ids = [await self.lookup(ref) for ref in body.get("challenge_ids", [])]
+            domains = [self.challenge_domains[c] for c in challenge_ids if c in self.challenge_domains]
+            payload = {"csr": make_csr(domains or [self.domain(event["client"])]),
+                       "challenge_ids": challenge_ids}
+            if "account_key" in fields:
+                payload["account_key"] = self.account_key(event["client"])
+            request.update(url=route, json=payload)
+        elif route == "/v1/ocsp/prefetch":
+            ids = [cert_id for cert_id, _ in self.issued[-body.get("certificate_count", 1):]]
+            request.update(url=route, json={"certificate_ids": ids})
+        elif route.startswith("/v1/ocsp"):
+            der = await self.ocsp_request()
+            if der is None:
+                return None
+            if event["method"] == "POST":
+                request.update(url=route, content=der,
+                               headers={**headers, "Content-Type": "application/ocsp-request"})
+            else:
+                request.update(url="/v1/ocsp/" + base64.b64encode(der).decode())
+        elif "{id}" in route:
+            request["url"] = route.replace("{id}", await self.lookup(event.get("path_ref")))
+            if route.endswith("/revoke"):
+                request["json"] = {"reason": body.get("reason", "unspecified")}
+        else:
+            request["url"] = route
+        return request
+
+    async def ocsp_request(self) -> bytes | None:
+        """An OCSP request for a certificate issued during this replay"""
+        if not self.issued:
+            return None
+        cert_id, _ = self.issued[-1]
+        if cert_id not in self.ocsp_requests:
+            cert = await self.client.get(f"/v1/certificate/{cert_id}/cert.pem")
+            chain = await self.client.get(f"/v1/certificate/{cert_id}/chain.pem")
+            if cert.status_code != 200 or chain.status_code != 200:
+                return None
+            builder = ocsp.OCSPRequestBuilder().add_certificate(
+                x509.load_pem_x509_certificate(cert.content),
+                x509.load_pem_x509_certificate(chain.content), hashes.SHA1())
+            self.ocsp_requests[cert_id] = builder.build().public_bytes(serialization.Encoding.DER)
+        return self.ocsp_requests[cert_id]
+
+    def learn(self, event: dict, request: dict, response: httpx.Response | None):
+        """Map the references this event produced to the target's ids"""
+        data = {}
+        if response is not None and response.headers.get("content-type", "").startswith("application/json"):
+            try:
+                data = response.json()
+            except ValueError:
+                data = {}
+        if isinstance(data, dict) and data.get("dns_record") and data.get("challenge_token"):
+            TXT_RECORDS[data["dns_record"].lower()] = data["challenge_token"]
+        for field, ref in event.get("refs", {}).items():
+            value = data.get(field) if isinstance(data, dict) else None
+            future = self.resolved(ref)
+            if not future.done():
+                future.set_result(value)
+            if value and field == "challenge_id":
+                self.challenge_domains[value] = request.get("json", {}).get("domain")
+            if value and field == "certificate_id":
+                self.issued.append((value, event["route"]))
+
+    async def play(self, event: dict, due: float):
+        delay = due - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        request = await self.build(event)
+        if request is None:
+            self.results.append({"route": event["route"], "skipped": True})
+            return
+        async with self.semaphore:
+            late = max(0.0, time.monotonic() - due) * 1000
+            started = time.perf_counter()
+            try:
+                response = await self.client.request(**request)
+                status = response.status_code
+            except httpx.HTTPError:
+                response, status = None, None
+            elapsed = (time.perf_counter() - started) * 1000
+        self.learn(event, request, response)
+        self.results.append({
+            "route": f"{event['method']} {event['route']}",
+            "status": status,
+            "captured_status": event["status"],
+            "ms": elapsed,
+            "captured_ms": event["ms"],
+            "late_ms": late,
+        })
+
+    async def run(self):
+        start = time.monotonic()
+        t0 = datetime.fromisoformat(self.events[0]["at"])
+        tasks = []
+        for event in self.events:
+            offset = (datetime.fromisoformat(event["at"]) - t0).total_seconds()
+            due = start + (offset / self.speed if self.speed > 0 else 0)
+            tasks.append(asyncio.create_task(self.play(event, due)))
+        await asyncio.gather(*tasks)
+        return time.monotonic() - start
+
+
+def make_csr(domains: list) -> str:
+    key = ec.generate_private_key(ec.SECP256R1())
+    csr = (
+        x509.CertificateSigningRequestBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, domains[0])]))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(d) for d in domains]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    return csr.public_bytes(serialization.Encoding.PEM).decode()
+
+
+# ============== Report ==============
+
+def summarize(results: list, duration: float) -> dict:
+    by_route = defaultdict(list)
+    skipped = defaultdict(int)
+    for result in results:
+        if result.get("skipped"):
+            skipped[result["route"]] += 1
+        else:
+            by_route[result["route"]].append(result)
+
+    routes = {}
+    for route, items in sorted(by_route.items()):
+        ms = [r["ms"] for r in items]
+        captured = [r["captured_ms"] for r in items]
+        statuses = defaultdict(int)
+        for r in items:
+            statuses[str(r["status"])] += 1
+        routes[route] = {
+            "count": len(items),
+            "statuses": dict(statuses),
+            "status_mismatches": sum(1 for r in items if r["status"] != r["captured_status"]),
+            "errors": sum(1 for r in items if r["status"] is None or r["status"] >= 500),
+            "replay_ms": {
+                "p50": round(percentile(ms, 50), 2),
+                "p90": round(percentile(ms, 90), 2),
+                "p99": round(percentile(ms, 99), 2),
+                "max": round(max(ms), 2),
+                "mean": round(statistics.fmean(ms), 2),
+            },
+            "captured_ms": {
+                "p50": round(percentile(captured, 50), 2),
+                "p90": round(percentile(captured, 90), 2),
+                "p99": round(percentile(captured, 99), 2),
+            },
+            "max_late_ms": round(max(r["late_ms"] for r in items), 2),
+        }
+    return {
+        "requests": sum(len(items) for items in by_route.values()),
+        "skipped": dict(skipped),
+        "duration_s": round(duration, 2),
+        "routes": routes,
+    }
+
+
+def print_table(report: dict):
+    print(f"{'route':<44} {'n':>6} {'err':>4} {'diff':>5} "
+          f"{'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}   {'cap p50':>8} {'cap p99':>8}")
+    for route, r in report["routes"].items():
+        replay, captured = r["replay_ms"], r["captured_ms"]
+        print(f"{route[:44]:<44} {r['count']:>6} {r['errors']:>4} {r['status_mismatches']:>5} "
+              f"{replay['p50']:>8} {replay['p90']:>8} {replay['p99']:>8} {replay['max']:>8}   "
+              f"{captured['p50']:>8} {captured['p99']:>8}")
+    print(f"\n{report['requests']} requests in {report['duration_s']}s"
+          + (f", skipped: {report['skipped']}" if report["skipped"] else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured PQCert API traffic")
+    parser.add_argument("captures", nargs="+", help="NDJSON capture file(s)")
+    parser.add_argument("--target", default="http://127.0.0.1:8000", help="API base URL")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Time compression: 1 = original pacing, 10 = ten times faster, "
+                             "0 = as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=100, help="Requests in flight at most")
+    parser.add_argument("--limit", type=int, help="Replay only the first N requests")
+    parser.add_argument("--dependency-timeout", type=float, default=30.0,
+                        help="Seconds to wait for the call that produces an id a later call uses")
+    parser.add_argument("--responder-address", default="127.0.0.1")
+    parser.add_argument("--responder-port", type=int, default=80,
+                        help="HTTP-01 stand-in port (the API always fetches on 80)")
+    parser.add_argument("--dns-port", type=int, default=5353, help="DNS stand-in port")
+    parser.add_argument("--no-responder", action="store_true",
+                        help="Don't start the stand-ins (e.g. already running)")
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    events = load_capture(args.captures)[:args.limit]
+    if not events:
+        sys.exit("capture is empty")
+    if not args.no_responder:
+        start_responder(args.responder_port, args.dns_port, args.responder_address)
+
+    async def run():
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=args.target, limits=limits, timeout=60) as client:
+            replayer = Replayer(client, events, args.speed, args.concurrency, args.dependency_timeout)
+            duration = await replayer.run()
+            return summarize(replayer.results, duration)
+
+    print(f"[replay] {len(events)} requests against {args.target} at "
+          f"{'max speed' if args.speed <= 0 else f'{args.speed}x'}", file=sys.stderr)
+    report = asyncio.run(run())
+    report["target"] = args.target
+    report["speed"] = args.speed
+    print_table(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
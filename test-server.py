@@ -3,11 +3,19 @@
 Quick test server for PQCert localhost certificates
 Run: python3 test-server.py
 Open: https://localhost:8443
+
+Load-testing mode (thread pool, HTTP/1.1 keep-alive, periodic stats):
+    python3 test-server.py --workers 32 --port 8443 --stats-interval 5
 """
 
+import argparse
 import http.server
 import ssl
 import os
+import selectors
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 CERT_DIR = Path.home() / ".pqcert" / "certs" / "localhost"
@@ -61,17 +69,264 @@ html = """
 </html>
 """
 
+# Encoded once, served as-is on every request
+body = html.encode()
+
 class Handler(http.server.BaseHTTPRequestHandler):
     def do_GET(self):
         self.send_response(200)
         self.send_header('Content-type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        self.wfile.write(html.encode())
+        self.wfile.write(body)
+        self.server.count_request()
 
     def log_message(self, format, *args):
         print(f"[HTTPS] {args[0]}")
 
+class KeepAliveHandler(Handler):
+    """
+    HTTP/1.1 handler for the pooled server: keep-alive, no per-request logging.
+
+    Set up once per connection; the server calls handle_one_request() each
+    time the connection has a request waiting.
+    """
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; don't let Nagle hold the body
+    disable_nagle_algorithm = True
+    # Idle keep-alive connections are closed after this many seconds
+    timeout = 15
+
+    def __init__(self, request, client_address, server):
+        # Not BaseRequestHandler.__init__, which serves the whole connection
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.close_connection = False
+        self.setup()
+
+    def has_pending_request(self) -> bool:
+        """A next request is already readable (pipelined, or buffered by TLS)"""
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def log_message(self, format, *args):
+        pass
+
+class CountingHTTPServer(http.server.HTTPServer):
+    """HTTP server keeping a request count for the stats readout"""
+    # Connections refused because the server was overloaded
+    shed = 0
+
+    def __init__(self, server_address, handler):
+        super().__init__(server_address, handler)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+class Connection:
+    __slots__ = ("request", "client_address", "handler", "deadline")
+
+    def __init__(self, request, client_address):
+        self.request = request
+        self.client_address = client_address
+        self.handler = None  # created once the TLS handshake is done
+        self.deadline = 0.0
+
+class PooledHTTPSServer(CountingHTTPServer):
+    """
+    HTTPS server handling requests (and TLS handshakes) on a worker pool.
+
+    The listening socket stays plain so accept() never blocks on a handshake.
+    Connections wait in a selector until they have something to read, so
+    an idle keep-alive connection holds no worker: a worker does the
+    handshake or serves one request, then hands the connection back. When
+    max_queued connections are already waiting for a worker, new ones are
+    closed straight away (counted in shed) rather than queued.
+    """
+    request_queue_size = 1024
+
+    def __init__(self, server_address, handler, context, workers, max_queued=None):
+        super().__init__(server_address, handler)
+        self.context = context
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="https")
+        self.max_queued = max_queued if max_queued is not None else 64 * workers
+        self.queued = 0
+        self.idle = selectors.DefaultSelector()
+        self.idle_lock = threading.Lock()
+        self.closing = False
+        self.watcher = threading.Thread(target=self._watch_idle, name="https-idle", daemon=True)
+        self.watcher.start()
+
+    def get_request(self):
+        sock, addr = self.socket.accept()
+        return self.context.wrap_socket(sock, server_side=True,
+                                        do_handshake_on_connect=False), addr
+
+    def process_request(self, request, client_address):
+        if self.queued >= self.max_queued:
+            self.shed += 1
+            self.shutdown_request(request)
+            return
+        self._park(Connection(request, client_address))
+
+    # ---- idle connections (selector thread) ----
+
+    def _park(self, conn):
+        conn.deadline = time.monotonic() + self.RequestHandlerClass.timeout
+        with self.idle_lock:
+            self.idle.register(conn.request, selectors.EVENT_READ, conn)
+
+    def _watch_idle(self):
+        while not self.closing:
+            for key, _ in self.idle.select(timeout=1):
+                with self.idle_lock:
+                    self.idle.unregister(key.fileobj)
+                self._submit(key.data)
+
+            now = time.monotonic()
+            with self.idle_lock:
+                expired = [key for key in self.idle.get_map().values() if key.data.deadline <= now]
+                for key in expired:
+                    self.idle.unregister(key.fileobj)
+            for key in expired:
+                self._close(key.data)
+
+        with self.idle_lock:
+            parked = list(self.idle.get_map().values())
+        for key in parked:
+            self._close(key.data)
+        self.idle.close()
+
+    # ---- workers ----
+
+    def _submit(self, conn):
+        with self._lock:
+            self.queued += 1
+        self.pool.submit(self._serve, conn)
+
+    def _serve(self, conn):
+        with self._lock:
+            self.queued -= 1
+        try:
+            if conn.handler is None:
+                conn.request.settimeout(self.RequestHandlerClass.timeout)
+                conn.request.do_handshake()
+                conn.handler = self.RequestHandlerClass(conn.request, conn.client_address, self)
+                if not conn.handler.has_pending_request():
+                    self._park(conn)
+                    return
+            conn.handler.handle_one_request()
+        except (ssl.SSLError, OSError):
+            # Clients dropping connections mid-handshake are normal under load
+            self._close(conn)
+            return
+        except Exception:
+            self.handle_error(conn.request, conn.client_address)
+            self._close(conn)
+            return
+
+        if conn.handler.close_connection:
+            self._close(conn)
+        elif conn.handler.has_pending_request():
+            self._submit(conn)
+        else:
+            self._park(conn)
+
+    def _close(self, conn):
+        if conn.handler is not None:
+            try:
+                conn.handler.finish()
+            except OSError:
+                pass
+        self.shutdown_request(conn.request)
+
+    def server_close(self):
+        super().server_close()
+        self.closing = True
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+def build_context(cert_file, key_file, tickets=None, resumption=True):
+    """Server SSLContext; tickets sets TLS 1.3 tickets per handshake (None: OpenSSL default)"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_file, key_file)
+
+    if not resumption:
+        context.options |= ssl.OP_NO_TICKET
+        context.num_tickets = 0
+    elif tickets is not None:
+        context.num_tickets = tickets
+    return context
+
+def build_server(cert_file, key_file, host='localhost', port=8443, handler=Handler,
+                 workers=0, tickets=None, resumption=True, max_queued=None):
+    """
+    Create an HTTPS server for the given certificate (port 0 picks a free port).
+
+    workers=0 gives the classic single-threaded server; otherwise requests
+    are served by a pool of that many threads with HTTP/1.1 keep-alive
+    (handler must then be a KeepAliveHandler).
+    """
+    context = build_context(cert_file, key_file, tickets, resumption)
+
+    if workers:
+        if handler is Handler:
+            handler = KeepAliveHandler
+        return PooledHTTPSServer((host, port), handler, context, workers, max_queued)
+
+    server = CountingHTTPServer((host, port), handler)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    return server
+
+def report_stats(server, context, interval):
+    """Print requests/s, handshakes/s (full and resumed) and refused connections/s"""
+    last = time.monotonic()
+    last_requests, last_shed = server.requests, server.shed
+    last_tls = context.session_stats()
+
+    while True:
+        time.sleep(interval)
+        now = time.monotonic()
+        requests, shed = server.requests, server.shed
+        tls = context.session_stats()
+        elapsed = now - last
+
+        rps = (requests - last_requests) / elapsed
+        hps = (tls["accept_good"] - last_tls["accept_good"]) / elapsed
+        resumed = (tls["hits"] - last_tls["hits"]) / elapsed
+        line = f"[STATS] {rps:,.0f} req/s | {hps:,.0f} handshakes/s ({resumed:,.0f} resumed/s)"
+        if shed > last_shed:
+            line += f" | {(shed - last_shed) / elapsed:,.0f} refused/s (workers busy)"
+        print(line)
+
+        last, last_requests, last_shed, last_tls = now, requests, shed, tls
+
 def main():
+    parser = argparse.ArgumentParser(description="PQCert HTTPS test server")
+    parser.add_argument("--host", default="localhost", help="Bind address (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=8443, help="Port (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Worker threads; 0 = single-threaded (default: %(default)s)")
+    parser.add_argument("--max-queued", type=int, default=None,
+                        help="Connections waiting for a worker before new ones are refused "
+                             "(default: 64 per worker)")
+    parser.add_argument("--tickets", type=int, default=None,
+                        help="TLS 1.3 session tickets issued per handshake (default: OpenSSL's)")
+    parser.add_argument("--no-resumption", action="store_true",
+                        help="Disable session tickets so every handshake is a full one")
+    parser.add_argument("--stats-interval", type=float, default=None,
+                        help="Seconds between req/s and handshake/s readouts "
+                             "(default: 5 with --workers, off otherwise; 0 = off)")
+    args = parser.parse_args()
+
     cert_file = CERT_DIR / "localhost.pem"
     key_file = CERT_DIR / "localhost-key.pem"
 
@@ -79,16 +334,25 @@ def main():
         print("❌ Certificate not found. Run: python3 cli/pqcert_localhost.py")
         return
 
-    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-    context.load_cert_chain(cert_file, key_file)
+    server = build_server(cert_file, key_file, args.host, args.port,
+                          workers=args.workers, tickets=args.tickets,
+                          resumption=not args.no_resumption, max_queued=args.max_queued)
 
-    server = http.server.HTTPServer(('localhost', 8443), Handler)
-    server.socket = context.wrap_socket(server.socket, server_side=True)
+    stats_interval = args.stats_interval
+    if stats_interval is None:
+        stats_interval = 5 if args.workers else 0
+    if stats_interval > 0:
+        context = server.context if args.workers else server.socket.context
+        threading.Thread(target=report_stats, args=(server, context, stats_interval),
+                         daemon=True).start()
 
     print()
     print("🔐 PQCert Test Server")
     print("=" * 40)
-    print(f"🌐 Open: https://localhost:8443")
+    print(f"🌐 Open: https://localhost:{args.port}")
+    if args.workers:
+        print(f"⚙️  Mode: {args.workers} workers, HTTP/1.1 keep-alive")
+    print(f"🔁 Session resumption: {'off' if args.no_resumption else 'on'}")
     print("=" * 40)
     print("Press Ctrl+C to stop")
     print()
@@ -97,6 +361,8 @@ def main():
         server.serve_forever()
     except KeyboardInterrupt:
         print("\n👋 Server stopped")
+    finally:
+        server.server_close()
 
 if __name__ == "__main__":
     main()